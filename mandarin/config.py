@@ -1,11 +1,27 @@
 import pathlib
 import royalnet.scrolls as s
 import royalnet.lazy as l
+import royalnet.typing as t
 
 
 lazy_config = l.Lazy(lambda: s.Scroll.from_file("MANDARIN", pathlib.Path("config.toml")))
 
 
+def config_get(key: str, default: t.Any = None) -> t.Any:
+    """
+    Get the value of an optional config key.
+
+    :param key: The key to get the value of, such as ``storage.chunksize``.
+    :param default: The value to return if the key isn't set.
+    :return: The value of the key, or ``default`` if it isn't set.
+    """
+    try:
+        return lazy_config.e[key]
+    except s.NotFoundError:
+        return default
+
+
 __all__ = (
     "lazy_config",
+    "config_get",
 )
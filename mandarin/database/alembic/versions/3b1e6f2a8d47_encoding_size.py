@@ -0,0 +1,23 @@
+"""Encoding size
+
+Revision ID: 3b1e6f2a8d47
+Revises: 979f4865c548
+Create Date: 2026-10-17 10:41:07.215364
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3b1e6f2a8d47"
+down_revision = "979f4865c548"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("encodings", sa.Column("size", sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("encodings", "size")
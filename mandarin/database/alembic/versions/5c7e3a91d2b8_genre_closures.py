@@ -0,0 +1,91 @@
+"""Genre closures
+
+Revision ID: 5c7e3a91d2b8
+Revises: a4d9c2e7f150
+Create Date: 2026-10-17 16:25:31.508172
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5c7e3a91d2b8"
+down_revision = "a4d9c2e7f150"
+branch_labels = None
+depends_on = None
+
+# Copied from the model instead of imported, so that later changes to it don't change what this revision does
+GENRECLOSURE_FUNCTION = """
+CREATE OR REPLACE FUNCTION genreclosures_maintain() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO genreclosures (ancestor_id, descendant_id, depth)
+            SELECT NEW.id, NEW.id, 0
+            UNION ALL
+            SELECT ancestor_id, NEW.id, depth + 1 FROM genreclosures WHERE descendant_id = NEW.supergenre_id;
+    ELSE
+        IF EXISTS (SELECT 1 FROM genreclosures WHERE ancestor_id = NEW.id AND descendant_id = NEW.supergenre_id) THEN
+            RAISE EXCEPTION USING
+                MESSAGE = 'Genre ' || NEW.id || ' can''t be moved into its own subgenre ' || NEW.supergenre_id,
+                ERRCODE = 'check_violation';
+        END IF;
+        -- Detach the subtree from the former supergenres...
+        DELETE FROM genreclosures AS link
+            USING genreclosures AS above, genreclosures AS subtree
+            WHERE above.descendant_id = NEW.id AND above.depth > 0
+              AND subtree.ancestor_id = NEW.id
+              AND link.ancestor_id = above.ancestor_id AND link.descendant_id = subtree.descendant_id;
+        -- ...and attach it to the new ones
+        INSERT INTO genreclosures (ancestor_id, descendant_id, depth)
+            SELECT above.ancestor_id, subtree.descendant_id, above.depth + subtree.depth + 1
+            FROM genreclosures AS above, genreclosures AS subtree
+            WHERE above.descendant_id = NEW.supergenre_id AND subtree.ancestor_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+GENRECLOSURE_TRIGGERS = """
+CREATE TRIGGER genreclosures_insert AFTER INSERT ON genres
+    FOR EACH ROW EXECUTE PROCEDURE genreclosures_maintain();
+CREATE TRIGGER genreclosures_update AFTER UPDATE OF supergenre_id ON genres
+    FOR EACH ROW WHEN (OLD.supergenre_id IS DISTINCT FROM NEW.supergenre_id) EXECUTE PROCEDURE genreclosures_maintain();
+"""
+
+GENRECLOSURE_DROP = """
+DROP TRIGGER IF EXISTS genreclosures_update ON genres;
+DROP TRIGGER IF EXISTS genreclosures_insert ON genres;
+DROP FUNCTION IF EXISTS genreclosures_maintain();
+"""
+
+
+def upgrade():
+    op.create_table(
+        "genreclosures",
+        sa.Column("ancestor_id", sa.Integer(), nullable=False),
+        sa.Column("descendant_id", sa.Integer(), nullable=False),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["ancestor_id"], ["genres.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["descendant_id"], ["genres.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("ancestor_id", "descendant_id"),
+    )
+    op.create_index("ix_genreclosures_descendant_id_depth", "genreclosures", ["descendant_id", "depth"], unique=False)
+    op.execute("""
+        INSERT INTO genreclosures (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM genres
+            UNION ALL
+            SELECT tree.ancestor_id, genres.id, tree.depth + 1
+            FROM tree JOIN genres ON genres.supergenre_id = tree.descendant_id AND genres.id != genres.supergenre_id
+        )
+        SELECT ancestor_id, descendant_id, depth FROM tree;
+    """)
+    op.execute(GENRECLOSURE_FUNCTION)
+    op.execute(GENRECLOSURE_TRIGGERS)
+
+
+def downgrade():
+    op.execute(GENRECLOSURE_DROP)
+    op.drop_index("ix_genreclosures_descendant_id_depth", table_name="genreclosures")
+    op.drop_table("genreclosures")
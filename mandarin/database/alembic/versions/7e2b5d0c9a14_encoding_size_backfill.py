@@ -0,0 +1,43 @@
+"""Encoding size backfill
+
+Revision ID: 7e2b5d0c9a14
+Revises: 5c7e3a91d2b8
+Create Date: 2026-10-17 18:02:44.913027
+
+"""
+import os
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7e2b5d0c9a14"
+down_revision = "5c7e3a91d2b8"
+branch_labels = None
+depends_on = None
+
+encodings = sa.table(
+    "encodings",
+    sa.column("id", sa.Integer),
+    sa.column("location", sa.String),
+    sa.column("size", sa.BigInteger),
+)
+
+
+def upgrade():
+    # Encodings uploaded before their size was stored have it read from their file, if it is reachable from here
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select([encodings.c.id, encodings.c.location]).where(encodings.c.size.is_(None))
+    ).fetchall()
+    for encoding_id, location in rows:
+        try:
+            size = os.path.getsize(location)
+        except OSError:
+            continue
+        connection.execute(encodings.update().where(encodings.c.id == encoding_id).values(size=size))
+
+
+def downgrade():
+    # The sizes can't be told apart from the ones stored on upload, and are correct anyways
+    pass
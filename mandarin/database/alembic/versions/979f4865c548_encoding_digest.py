@@ -0,0 +1,32 @@
+"""Encoding digest
+
+Revision ID: 979f4865c548
+Revises: 9f0128c8efba
+Create Date: 2026-10-17 09:12:31.482930
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "979f4865c548"
+down_revision = "9f0128c8efba"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("encodings", sa.Column("digest", sa.LargeBinary(), nullable=True))
+    op.create_index("ix_encodings_digest", "encodings", ["digest"], unique=False)
+
+    # Stored files are named after the hex digest of their contents
+    op.execute(
+        "UPDATE encodings "
+        "SET digest = decode(substring(location from '([0-9a-f]{128})[^/]*$'), 'hex') "
+        "WHERE digest IS NULL;"
+    )
+
+
+def downgrade():
+    op.drop_index("ix_encodings_digest", table_name="encodings")
+    op.drop_column("encodings", "digest")
@@ -0,0 +1,24 @@
+"""Audit logs keyset indexes
+
+Revision ID: a4d9c2e7f150
+Revises: 3b1e6f2a8d47
+Create Date: 2026-10-17 14:02:48.930125
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a4d9c2e7f150"
+down_revision = "3b1e6f2a8d47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_auditlogs_timestamp_id", "auditlogs", ["timestamp", "id"], unique=False)
+    op.create_index("ix_auditlogs_user_id_timestamp_id", "auditlogs", ["user_id", "timestamp", "id"], unique=False)
+
+
+def downgrade():
+    op.drop_index("ix_auditlogs_user_id_timestamp_id", table_name="auditlogs")
+    op.drop_index("ix_auditlogs_timestamp_id", table_name="auditlogs")
@@ -0,0 +1,24 @@
+"""Audit logs genre index
+
+Revision ID: d3f8a1b6c2e9
+Revises: 7e2b5d0c9a14
+Create Date: 2026-10-17 18:47:19.260418
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d3f8a1b6c2e9"
+down_revision = "7e2b5d0c9a14"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_auditlogs_id_genre", "auditlogs", ["id"], unique=False,
+                    postgresql_where=sa.column("action").like("genre.%"))
+
+
+def downgrade():
+    op.drop_index("ix_auditlogs_id_genre", table_name="auditlogs")
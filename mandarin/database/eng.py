@@ -1,12 +1,96 @@
+import logging
+import os
+
+import sqlalchemy.event
+import sqlalchemy.exc
 import sqlalchemy.orm
+import sqlalchemy.pool
 import royalnet.lazy
 
 from ..config import *
 # noinspection PyUnresolvedReferences
 from . import tables
 
+log = logging.getLogger(__name__)
+
+
+def engine_options() -> dict:
+    """
+    Get the keyword arguments to pass to :func:`sqlalchemy.create_engine` from the ``database`` section of the config.
+
+    If ``database.pgbouncer`` is set, connections are pooled by PgBouncer instead of by SQLAlchemy, and no startup
+    parameters are sent, as PgBouncer would reject them.
+
+    :return: A :class:`dict` of keyword arguments.
+    """
+    options = {
+        "pool_pre_ping": config_get("database.pool.preping", False),
+    }
+
+    if config_get("database.pgbouncer", False):
+        options["poolclass"] = sqlalchemy.pool.NullPool
+    else:
+        options["pool_size"] = config_get("database.pool.size", 5)
+        options["max_overflow"] = config_get("database.pool.overflow", 10)
+        options["pool_timeout"] = config_get("database.pool.timeout", 30)
+        options["pool_recycle"] = config_get("database.pool.recycle", -1)
+
+    statement_timeout = config_get("database.statementtimeout")
+    if statement_timeout is not None:
+        if config_get("database.pgbouncer", False):
+            log.warning("database.statementtimeout is ignored with PgBouncer, set it on the database role instead")
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+
+    return options
+
+
+def guard_fork(engine: sqlalchemy.engine.Engine) -> None:
+    """
+    Prevent pooled connections from being used by a process other than the one that created them, such as a worker
+    forked by Celery, by invalidating them on checkout.
+
+    :param engine: The engine to guard.
+    """
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+
+    @sqlalchemy.event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info["pid"] != pid:
+            # Drop the connection without closing it, as it still belongs to the parent process
+            connection_record.connection = connection_proxy.connection = None
+            raise sqlalchemy.exc.DisconnectionError(
+                f"Connection created by process {connection_record.info['pid']} checked out by process {pid}"
+            )
+
+
+def create_engine(c) -> sqlalchemy.engine.Engine:
+    """
+    Create the :mod:`sqlalchemy` engine, configured with :func:`.engine_options` and guarded with :func:`.guard_fork`.
+
+    :param c: The config to use.
+    :return: The created engine.
+    """
+    engine = sqlalchemy.create_engine(c["database.uri"], **engine_options())
+    guard_fork(engine)
+    return engine
+
+
+def dispose_engine() -> None:
+    """
+    Close all the pooled connections of the engine, if it has been initialized.
+
+    It should be called before forking, so that the forked processes don't inherit any open connection.
+    """
+    if lazy_engine.evaluated:
+        log.debug("Disposing of the database engine...")
+        lazy_engine.evaluate().dispose()
+
 
-lazy_engine = royalnet.lazy.Lazy(lambda c: sqlalchemy.create_engine(c["database.uri"]), c=lazy_config)
+lazy_engine = royalnet.lazy.Lazy(create_engine, c=lazy_config)
 """
 The uninitialized sqlalchemy engine.
 """
@@ -20,4 +104,5 @@ The uninitialized Session.
 __all__ = (
     "lazy_engine",
     "lazy_Session",
+    "dispose_engine",
 )
@@ -7,6 +7,7 @@ from .albuminvolvements import *
 from .albums import *
 from .auditlogs import *
 from .encodings import *
+from .genreclosures import *
 from .genres import *
 from .people import *
 from .roles import *
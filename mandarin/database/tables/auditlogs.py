@@ -18,6 +18,13 @@ class AuditLog(base.Base, a.ColRepr):
 
     obj = s.Column("obj", s.Integer)
 
+    __table_args__ = (
+        s.Index("ix_auditlogs_timestamp_id", timestamp, id),
+        s.Index("ix_auditlogs_user_id_timestamp_id", user_id, timestamp, id),
+        # Looked up to find out whether the genres were edited
+        s.Index("ix_auditlogs_id_genre", id, postgresql_where=action.like("genre.%")),
+    )
+
 
 __all__ = (
     "AuditLog",
@@ -11,6 +11,8 @@ class Encoding(base.Base, a.ColRepr, a.Updatable):
     id = s.Column("id", s.Integer, primary_key=True)
 
     location = s.Column("location", s.String, nullable=False, unique=True)
+    digest = s.Column("digest", s.LargeBinary, index=True)
+    size = s.Column("size", s.BigInteger)
     mime_type = s.Column("mime_type", s.String)
     mime_software = s.Column("mime_software", s.String)
 
@@ -18,7 +20,7 @@ class Encoding(base.Base, a.ColRepr, a.Updatable):
     uploader = o.relationship("User", back_populates="uploads")
 
     layer_id = s.Column("layer_id", s.Integer, s.ForeignKey("layers.id"))
-    layer = o.relationship("Layer", back_populates="files")
+    layer = o.relationship("Layer", back_populates="encodings")
 
 
 __all__ = (
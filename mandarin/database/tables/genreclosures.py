@@ -0,0 +1,109 @@
+from __future__ import annotations
+from .__imports__ import *
+
+
+class GenreClosure(base.Base, a.ColRepr):
+    """
+    A pair of genres, one of which is a subgenre (at any depth) of the other; every genre is also paired with itself
+    at depth 0.
+
+    It allows all the subgenres or all the supergenres of a genre to be found with a single indexed query, instead of
+    walking :attr:`.Genre.supergenre_id` one level at a time.
+
+    .. important:: Rows are maintained by a trigger on the genres table whenever genres are created, moved or deleted,
+                   and should never be edited directly.
+    """
+    __tablename__ = "genreclosures"
+
+    ancestor_id = s.Column("ancestor_id", s.Integer, s.ForeignKey("genres.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = s.Column("descendant_id", s.Integer, s.ForeignKey("genres.id", ondelete="CASCADE"),
+                             primary_key=True)
+    depth = s.Column("depth", s.Integer, nullable=False)
+
+    __table_args__ = (
+        s.Index("ix_genreclosures_descendant_id_depth", descendant_id, depth),
+    )
+
+
+GENRECLOSURE_FUNCTION = """
+CREATE OR REPLACE FUNCTION genreclosures_maintain() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO genreclosures (ancestor_id, descendant_id, depth)
+            SELECT NEW.id, NEW.id, 0
+            UNION ALL
+            SELECT ancestor_id, NEW.id, depth + 1 FROM genreclosures WHERE descendant_id = NEW.supergenre_id;
+    ELSE
+        IF EXISTS (SELECT 1 FROM genreclosures WHERE ancestor_id = NEW.id AND descendant_id = NEW.supergenre_id) THEN
+            RAISE EXCEPTION USING
+                MESSAGE = 'Genre ' || NEW.id || ' can''t be moved into its own subgenre ' || NEW.supergenre_id,
+                ERRCODE = 'check_violation';
+        END IF;
+        -- Detach the subtree from the former supergenres...
+        DELETE FROM genreclosures AS link
+            USING genreclosures AS above, genreclosures AS subtree
+            WHERE above.descendant_id = NEW.id AND above.depth > 0
+              AND subtree.ancestor_id = NEW.id
+              AND link.ancestor_id = above.ancestor_id AND link.descendant_id = subtree.descendant_id;
+        -- ...and attach it to the new ones
+        INSERT INTO genreclosures (ancestor_id, descendant_id, depth)
+            SELECT above.ancestor_id, subtree.descendant_id, above.depth + subtree.depth + 1
+            FROM genreclosures AS above, genreclosures AS subtree
+            WHERE above.descendant_id = NEW.supergenre_id AND subtree.ancestor_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+"""
+The function of the trigger maintaining the :class:`.GenreClosure`; rows of deleted genres are removed by the
+``ON DELETE CASCADE`` of its foreign keys.
+"""
+
+GENRECLOSURE_TRIGGERS = """
+CREATE TRIGGER genreclosures_insert AFTER INSERT ON genres
+    FOR EACH ROW EXECUTE PROCEDURE genreclosures_maintain();
+CREATE TRIGGER genreclosures_update AFTER UPDATE OF supergenre_id ON genres
+    FOR EACH ROW WHEN (OLD.supergenre_id IS DISTINCT FROM NEW.supergenre_id) EXECUTE PROCEDURE genreclosures_maintain();
+"""
+"""
+The triggers maintaining the :class:`.GenreClosure`.
+"""
+
+GENRECLOSURE_BACKFILL = """
+INSERT INTO genreclosures (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+    SELECT id, id, 0 FROM genres
+    UNION ALL
+    SELECT tree.ancestor_id, genres.id, tree.depth + 1
+    FROM tree JOIN genres ON genres.supergenre_id = tree.descendant_id AND genres.id != genres.supergenre_id
+)
+SELECT ancestor_id, descendant_id, depth FROM tree;
+"""
+"""
+Fill the :class:`.GenreClosure` with the genres which already exist, such as the root genre if it was created before
+the closure table.
+"""
+
+GENRECLOSURE_DROP = """
+DROP TRIGGER IF EXISTS genreclosures_update ON genres;
+DROP TRIGGER IF EXISTS genreclosures_insert ON genres;
+DROP FUNCTION IF EXISTS genreclosures_maintain();
+"""
+"""
+Drop the triggers maintaining the :class:`.GenreClosure` and their function.
+"""
+
+s.event.listen(GenreClosure.__table__, "after_create", s.DDL(GENRECLOSURE_BACKFILL).execute_if(dialect="postgresql"))
+s.event.listen(GenreClosure.__table__, "after_create", s.DDL(GENRECLOSURE_FUNCTION).execute_if(dialect="postgresql"))
+s.event.listen(GenreClosure.__table__, "after_create", s.DDL(GENRECLOSURE_TRIGGERS).execute_if(dialect="postgresql"))
+s.event.listen(GenreClosure.__table__, "before_drop", s.DDL(GENRECLOSURE_DROP).execute_if(dialect="postgresql"))
+
+
+__all__ = (
+    "GenreClosure",
+    "GENRECLOSURE_FUNCTION",
+    "GENRECLOSURE_TRIGGERS",
+    "GENRECLOSURE_BACKFILL",
+    "GENRECLOSURE_DROP",
+)
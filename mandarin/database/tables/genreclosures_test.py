@@ -0,0 +1,96 @@
+import pytest
+import sqlalchemy.exc
+from mandarin.testing.fixtures import *
+from mandarin import database
+from mandarin.database import tables, merge_rows
+
+
+@pytest.fixture
+def genres(recreate_db, session):
+    """
+    Fill the database with a small tree of genres, returning their ids by name.
+    """
+    root = tables.Genre(id=0, name="Root")
+    rock = tables.Genre(name="Rock", supergenre=root)
+    metal = tables.Genre(name="Metal", supergenre=rock)
+    jazz = tables.Genre(name="Jazz", supergenre=root)
+    session.add_all([root, rock, metal, jazz])
+    session.commit()
+    root.supergenre_id = None
+    session.commit()
+    return {genre.name: genre.id for genre in (root, rock, metal, jazz)}
+
+
+def closures(session):
+    """
+    :return: The rows of the genre closure table, as a :class:`set` of ``(ancestor_id, descendant_id, depth)``.
+    """
+    return set(session.query(tables.GenreClosure.ancestor_id,
+                             tables.GenreClosure.descendant_id,
+                             tables.GenreClosure.depth).all())
+
+
+def test_insert(genres, session):
+    root, rock, metal, jazz = genres["Root"], genres["Rock"], genres["Metal"], genres["Jazz"]
+    assert closures(session) == {
+        (root, root, 0),
+        (rock, rock, 0), (root, rock, 1),
+        (metal, metal, 0), (rock, metal, 1), (root, metal, 2),
+        (jazz, jazz, 0), (root, jazz, 1),
+    }
+
+
+def test_move(genres, session):
+    root, rock, metal, jazz = genres["Root"], genres["Rock"], genres["Metal"], genres["Jazz"]
+    session.query(tables.Genre).get(rock).supergenre_id = jazz
+    session.commit()
+    assert closures(session) == {
+        (root, root, 0),
+        (jazz, jazz, 0), (root, jazz, 1),
+        (rock, rock, 0), (jazz, rock, 1), (root, rock, 2),
+        (metal, metal, 0), (rock, metal, 1), (jazz, metal, 2), (root, metal, 3),
+    }
+
+
+def test_cycle(genres, session):
+    session.query(tables.Genre).get(genres["Rock"]).supergenre_id = genres["Metal"]
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        session.commit()
+    session.rollback()
+    session.query(tables.Genre).get(genres["Rock"]).supergenre_id = genres["Rock"]
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        session.commit()
+
+
+def test_merge(genres, session):
+    root, rock, metal, jazz = genres["Root"], genres["Rock"], genres["Metal"], genres["Jazz"]
+    merge_rows(session, tables.Genre, jazz, [rock])
+    session.commit()
+    assert closures(session) == {
+        (root, root, 0),
+        (jazz, jazz, 0), (root, jazz, 1),
+        (metal, metal, 0), (jazz, metal, 1), (root, metal, 2),
+    }
+
+
+def test_delete(genres, session):
+    root, rock, jazz = genres["Root"], genres["Rock"], genres["Jazz"]
+    session.delete(session.query(tables.Genre).get(genres["Metal"]))
+    session.commit()
+    assert closures(session) == {
+        (root, root, 0),
+        (rock, rock, 0), (root, rock, 1),
+        (jazz, jazz, 0), (root, jazz, 1),
+    }
+
+
+def test_backfill(recreate_db, session):
+    engine = database.lazy_engine.evaluate()
+    tables.GenreClosure.__table__.drop(bind=engine)
+    root = tables.Genre(id=0, name="Root")
+    rock = tables.Genre(name="Rock", supergenre=root)
+    session.add_all([root, rock])
+    session.commit()
+
+    tables.GenreClosure.__table__.create(bind=engine)
+    assert closures(session) == {(root.id, root.id, 0), (rock.id, rock.id, 0), (root.id, rock.id, 1)}
@@ -15,7 +15,7 @@ class Layer(base.Base, a.ColRepr, a.Updatable):
     song_id = s.Column("song_id", s.Integer, s.ForeignKey("songs.id"))
     song = o.relationship("Song", back_populates="layers")
 
-    files = o.relationship("File", back_populates="layer")
+    encodings = o.relationship("Encoding", back_populates="layer")
 
     # noinspection PyTypeChecker
     search = s.Column("search", utils.to_tsvector(
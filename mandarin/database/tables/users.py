@@ -18,7 +18,7 @@ class User(base.Base, a.ColRepr, a.Updatable):
     email_verified = s.Column("email_verified", s.String, nullable=False)
     updated_at = s.Column("updated_at", s.String, nullable=False)
 
-    uploads = o.relationship("File", back_populates="uploader")
+    uploads = o.relationship("Encoding", back_populates="uploader")
     audit_logs = o.relationship("AuditLog", back_populates="user")
 
     __table_args__ = (
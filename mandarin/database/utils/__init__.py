@@ -1,2 +1,6 @@
 from .actions import *
 from .ts import *
+from .counts import *
+from .bulk import *
+from .transactions import *
+from .thesaurus import *
@@ -0,0 +1,108 @@
+"""
+This module defines functions useful to edit many rows of a table with a single statement.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy
+import sqlalchemy.dialects.postgresql as postgresql
+import sqlalchemy.orm
+from royalnet.typing import *
+
+
+def any_of(column: sqlalchemy.Column, values: Iterable[Any]) -> sqlalchemy.sql.ClauseElement:
+    """
+    Create a ``column = ANY(:values)`` criterion.
+
+    Unlike :meth:`sqlalchemy.sql.operators.ColumnOperators.in_`, the values are sent as a single array parameter, so
+    the statement stays the same regardless of how many values there are.
+
+    :param column: The column to compare.
+    :param values: The values the column should be equal to any of.
+    :return: The criterion.
+    """
+    return column == sqlalchemy.any_(sqlalchemy.literal(list(values), type_=postgresql.ARRAY(column.type)))
+
+
+def link_all(junction: sqlalchemy.Table,
+             column: sqlalchemy.Column,
+             table: type,
+             ids: Iterable[int],
+             **values: Any) -> sqlalchemy.sql.Insert:
+    """
+    Create an ``INSERT ... SELECT ... ON CONFLICT DO NOTHING`` statement, linking each of the rows of ``table`` with
+    the specified ids to the same other rows through a junction table, skipping the links that already exist.
+
+    Ids not matching any row are skipped as well.
+
+    :param junction: The junction table.
+    :param column: The column of the junction table referencing ``table``.
+    :param table: The table of the rows to link.
+    :param ids: The ids of the rows to link.
+    :param values: The values of the other columns of the junction table, the same for all links.
+    :return: The statement.
+    """
+    select = sqlalchemy.select([table.id, *[sqlalchemy.literal(value) for value in values.values()]])
+    select = select.where(any_of(table.id, ids))
+    return postgresql.insert(junction).from_select([column.name, *values.keys()], select).on_conflict_do_nothing()
+
+
+def repoint(session: sqlalchemy.orm.Session, column: sqlalchemy.Column, target: int, sources: List[int]) -> None:
+    """
+    Make all the rows referencing any of the ``sources`` through a foreign key ``column`` reference the ``target``
+    instead.
+
+    If the column is part of the primary key, as in junction tables, the rows are copied with ``ON CONFLICT DO
+    NOTHING`` and the originals are deleted, so that rows which would become duplicates are merged; otherwise, they
+    are updated in place.
+
+    :param session: The session to use.
+    :param column: The foreign key column.
+    :param target: The id the rows should reference.
+    :param sources: The ids the rows should stop referencing.
+    """
+    table: sqlalchemy.Table = column.table
+    if column.primary_key:
+        select = sqlalchemy.select([
+            sqlalchemy.literal(target, type_=column.type) if other is column else other for other in table.columns
+        ]).where(any_of(column, sources))
+        session.execute(postgresql.insert(table).from_select(
+            [other.name for other in table.columns], select,
+        ).on_conflict_do_nothing())
+        session.execute(table.delete().where(any_of(column, sources)))
+    else:
+        update = table.update().where(any_of(column, sources)).values({column.name: target})
+        if column.references(table.c.id):
+            # The target itself may be referencing one of the sources
+            update = update.where(table.c.id != target)
+        session.execute(update)
+
+
+def merge_rows(session: sqlalchemy.orm.Session, table: type, target: int, sources: List[int]) -> None:
+    """
+    Merge some rows of a table into another one with a few set-based statements, without loading any of them.
+
+    All the foreign keys referencing the ``sources`` are :func:`.repoint`\ ed to the ``target``, then the ``sources``
+    are deleted; foreign keys with ``ON DELETE CASCADE``, such as the ones of derived tables maintained by triggers,
+    are left alone, and their rows are deleted with the ``sources``.
+
+    :param session: The session to use; the statements are not committed.
+    :param table: The table of the rows to merge.
+    :param target: The id of the row to merge the others into.
+    :param sources: The ids of the rows to merge into the ``target``.
+    """
+    sources = [source for source in sources if source != target]
+    primary_key = table.__table__.c.id
+    for referencing in table.metadata.sorted_tables:
+        for foreign_key in referencing.foreign_keys:
+            if foreign_key.column is primary_key and foreign_key.ondelete != "CASCADE":
+                repoint(session, foreign_key.parent, target, sources)
+    session.execute(table.__table__.delete().where(any_of(primary_key, sources)))
+
+
+__all__ = (
+    "any_of",
+    "link_all",
+    "repoint",
+    "merge_rows",
+)
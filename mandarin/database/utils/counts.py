@@ -0,0 +1,123 @@
+"""
+This module defines functions to count the rows of database tables without scanning them whole, if possible.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy
+import sqlalchemy.orm
+from royalnet.typing import *
+
+from .. import tables
+
+
+pg_class = sqlalchemy.table("pg_class", sqlalchemy.column("oid"), sqlalchemy.column("reltuples"))
+"""
+The catalog of PostgreSQL containing the statistics of the tables.
+"""
+
+
+def scalar_estimate(table: type) -> sqlalchemy.sql.expression.ScalarSelect:
+    """
+    :return: A scalar subquery selecting the number of rows of ``table`` estimated by PostgreSQL, which is
+             :data:`None` if the table doesn't exist and negative or zero if it was never analyzed.
+    """
+    return sqlalchemy.select([pg_class.c.reltuples]).where(
+        pg_class.c.oid == sqlalchemy.func.to_regclass(sqlalchemy.literal(table.__tablename__))
+    ).as_scalar()
+
+
+def estimate_count(session: sqlalchemy.orm.Session, table: type) -> Optional[int]:
+    """
+    Estimate the number of rows of a table from the statistics collected by PostgreSQL, without reading the table.
+
+    The estimate is updated by ``VACUUM``, ``ANALYZE`` and ``CREATE INDEX``, so it may be slightly out of date.
+
+    :param session: The session to use.
+    :param table: The table to estimate the rows of.
+    :return: The estimated number of rows, or :data:`None` if the table was never analyzed.
+    """
+    estimate = session.query(scalar_estimate(table)).scalar()
+    if estimate is None or estimate < 0:
+        return None
+    return int(estimate)
+
+
+def count_rows(session: sqlalchemy.orm.Session, table: type, exact: bool = False, threshold: int = 10000) -> int:
+    """
+    Count the rows of a table, estimating their number with :func:`.estimate_count` if there are many of them.
+
+    :param session: The session to use.
+    :param table: The table to count the rows of.
+    :param exact: Whether the rows should always be counted exactly, scanning the whole table.
+    :param threshold: The estimate under which the rows are counted exactly anyways, as it is cheap to do so and
+                      estimates of small tables are the least accurate.
+    :return: The number of rows.
+    """
+    if not exact:
+        estimate = estimate_count(session, table)
+        if estimate is not None and estimate >= threshold:
+            return estimate
+    return session.query(sqlalchemy.func.count()).select_from(table).scalar()
+
+
+def scalar_count(table: type, *criteria) -> sqlalchemy.sql.expression.ScalarSelect:
+    """
+    :return: A scalar subquery counting the rows of ``table`` matching all ``criteria``.
+    """
+    select = sqlalchemy.select([sqlalchemy.func.count()]).select_from(table)
+    for criterion in criteria:
+        select = select.where(criterion)
+    return select.as_scalar()
+
+
+def scalar_count_rows(table: type, threshold: int) -> sqlalchemy.sql.ColumnElement:
+    """
+    :return: An expression counting the rows of ``table`` like :func:`.count_rows` does, estimating them if the
+             estimate is at least ``threshold`` and counting them exactly otherwise.
+    """
+    estimate = scalar_estimate(table)
+    # PostgreSQL only runs the subquery of the branch it takes, so large tables are never scanned
+    return sqlalchemy.case(
+        [(estimate >= threshold, sqlalchemy.cast(estimate, sqlalchemy.BigInteger))],
+        else_=scalar_count(table),
+    )
+
+
+def instance_stats(session: sqlalchemy.orm.Session, threshold: int = 10000) -> Dict[str, int]:
+    """
+    Compute the statistics of the whole instance with a single query, estimating the number of rows of the tables
+    like :func:`.count_rows` does.
+
+    :param session: The session to use.
+    :param threshold: The estimate under which the rows of a table are counted exactly anyways.
+    :return: A :class:`dict` containing the number of rows of each table, the total size in bytes of the stored
+             encodings (``bytes``), the number of layers not belonging to any song (``orphaned_layers``) and the number
+             of encodings not belonging to any layer (``orphaned_encodings``).
+
+    .. note:: Encodings whose size is unknown, as they were uploaded before it was stored and their file couldn't be
+              read while migrating the database, aren't included in ``bytes``.
+    """
+    total_size = sqlalchemy.func.coalesce(sqlalchemy.func.sum(tables.Encoding.size), 0)
+    columns = {
+        "songs": scalar_count_rows(tables.Song, threshold),
+        "albums": scalar_count_rows(tables.Album, threshold),
+        "layers": scalar_count_rows(tables.Layer, threshold),
+        "encodings": scalar_count_rows(tables.Encoding, threshold),
+        "genres": scalar_count_rows(tables.Genre, threshold),
+        "people": scalar_count_rows(tables.Person, threshold),
+        "roles": scalar_count_rows(tables.Role, threshold),
+        "users": scalar_count_rows(tables.User, threshold),
+        "bytes": sqlalchemy.select([total_size]).as_scalar(),
+        "orphaned_layers": scalar_count(tables.Layer, tables.Layer.song_id.is_(None)),
+        "orphaned_encodings": scalar_count(tables.Encoding, tables.Encoding.layer_id.is_(None)),
+    }
+    row = session.query(*[column.label(name) for name, column in columns.items()]).one()
+    return {name: int(value) for name, value in zip(columns.keys(), row)}
+
+
+__all__ = (
+    "estimate_count",
+    "count_rows",
+    "instance_stats",
+)
@@ -0,0 +1,33 @@
+from mandarin.testing.fixtures import *
+from mandarin.database import tables
+
+from .counts import instance_stats
+
+
+def test_instance_stats(recreate_db, session, query_budget):
+    layer = tables.Layer(name="Default")
+    session.add_all([
+        tables.Encoding(location="a.mp3", size=10, layer=layer),
+        tables.Encoding(location="b.mp3", size=20),
+        tables.Encoding(location="c.mp3"),
+    ])
+    session.commit()
+
+    with query_budget(1) as statements:
+        stats = instance_stats(session)
+    assert len(statements) == 1
+    assert stats["encodings"] == 3
+    assert stats["layers"] == 1
+    assert stats["songs"] == 0
+    assert stats["bytes"] == 30
+    assert stats["orphaned_layers"] == 1
+    assert stats["orphaned_encodings"] == 2
+
+
+def test_instance_stats_estimated(recreate_db, session):
+    session.add_all([tables.Encoding(location=f"{number}.mp3") for number in range(3)])
+    session.commit()
+    session.execute("ANALYZE encodings")
+
+    # With no threshold, every table is estimated, and analyzed tables are estimated exactly
+    assert instance_stats(session, threshold=0)["encodings"] == 3
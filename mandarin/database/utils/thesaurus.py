@@ -0,0 +1,91 @@
+"""
+This module defines functions to import a whole hierarchy of genres at once.
+"""
+
+from __future__ import annotations
+
+import sqlalchemy
+import sqlalchemy.dialects.postgresql as postgresql
+import sqlalchemy.orm
+from royalnet.typing import *
+
+from .. import tables
+from .bulk import any_of
+
+
+def thesaurus_levels(thesaurus: Dict[str, Any]) -> List[Dict[str, Optional[str]]]:
+    """
+    Flatten a thesaurus, a tree of nested :class:`dict`\\ s whose keys are the names of the genres and whose values are
+    their subgenres, level by level.
+
+    If a genre appears more than once, only its first occurrence is kept, but the subgenres of all occurrences are.
+
+    :param thesaurus: The thesaurus to flatten.
+    :return: A :class:`list` of levels, each a :class:`dict` mapping the names of the genres at that depth to the name
+             of their supergenre, or to :data:`None` at the top level.
+    :raises ValueError: If the thesaurus isn't made of nested :class:`dict`\\ s.
+    """
+    levels: List[Dict[str, Optional[str]]] = []
+    seen: Set[str] = set()
+    current: List[Tuple[Optional[str], Any]] = [(None, thesaurus)]
+    while current:
+        level: Dict[str, Optional[str]] = {}
+        following: List[Tuple[Optional[str], Any]] = []
+        for supergenre, subgenres in current:
+            if not isinstance(subgenres, dict):
+                raise ValueError(f"The subgenres of '{supergenre}' should be an object, not {subgenres!r}")
+            for name, children in subgenres.items():
+                if name not in seen:
+                    seen.add(name)
+                    level[name] = supergenre
+                following.append((name, children))
+        if level:
+            levels.append(level)
+        current = following
+    return levels
+
+
+def import_thesaurus(session: sqlalchemy.orm.Session,
+                     thesaurus: Dict[str, Any],
+                     supergenre_id: int = 0) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Create all the genres of a thesaurus which don't exist yet with two statements per level of the thesaurus,
+    resolving their supergenres by name.
+
+    Genres with the same name as an existing one are left as they are, and their id is used for their subgenres.
+
+    :param session: The session to use; the statements are not committed.
+    :param thesaurus: The thesaurus to import, in the format accepted by :func:`.thesaurus_levels`.
+    :param supergenre_id: The id of the supergenre of the genres at the top level of the thesaurus.
+    :return: A :class:`tuple` of a :class:`dict` mapping the names of all the genres of the thesaurus to their ids,
+             and of the :class:`list` of the names of the created genres.
+    :raises ValueError: If the thesaurus isn't made of nested :class:`dict`\\ s.
+    """
+    genres = tables.Genre.__table__
+    ids: Dict[str, int] = {}
+    created: List[str] = []
+    for level in thesaurus_levels(thesaurus):
+        insert = postgresql.insert(genres).values([
+            {
+                "name": name,
+                "description": "",
+                "supergenre_id": supergenre_id if supergenre is None else ids[supergenre],
+            }
+            for name, supergenre in level.items()
+        ]).on_conflict_do_nothing(index_elements=[genres.c.name]).returning(genres.c.id, genres.c.name)
+        for id_, name in session.execute(insert):
+            ids[name] = id_
+            created.append(name)
+
+        existing = [name for name in level if name not in ids]
+        if existing:
+            select = sqlalchemy.select([genres.c.id, genres.c.name]).where(any_of(genres.c.name, existing))
+            for id_, name in session.execute(select):
+                ids[name] = id_
+    return ids, created
+
+
+__all__ = (
+    "thesaurus_levels",
+    "import_thesaurus",
+)
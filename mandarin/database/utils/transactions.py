@@ -0,0 +1,160 @@
+"""
+This module defines functions to run database transactions, retrying them if they fail because of concurrent ones.
+"""
+
+from __future__ import annotations
+
+import functools
+import logging
+import random
+import threading
+import time
+
+import psycopg2.errorcodes
+import sqlalchemy.exc
+import sqlalchemy.orm
+from royalnet.typing import *
+
+from .. import eng
+from ...config import config_get
+
+log = logging.getLogger(__name__)
+
+ResultType = TypeVar("ResultType")
+
+RETRYABLE_ERRORS = {
+    psycopg2.errorcodes.SERIALIZATION_FAILURE,
+    psycopg2.errorcodes.DEADLOCK_DETECTED,
+}
+"""
+The SQLSTATE codes of the errors after which a transaction can simply be run again.
+"""
+
+
+class TransactionStats:
+    """
+    The number of transactions run by :func:`.run_transaction` in the current process, of the retries they needed and
+    of the ones which failed even after being retried.
+    """
+
+    def __init__(self):
+        self.transactions: int = 0
+        self.retries: int = 0
+        self.failures: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def count(self, transactions: int = 0, retries: int = 0, failures: int = 0) -> None:
+        """
+        Add to the counters.
+        """
+        with self.lock:
+            self.transactions += transactions
+            self.retries += retries
+            self.failures += failures
+
+    def stats(self) -> Tuple[int, int, int]:
+        """
+        :return: A :class:`tuple` of the number of transactions, retries and failures.
+        """
+        with self.lock:
+            return self.transactions, self.retries, self.failures
+
+
+transaction_stats = TransactionStats()
+"""
+The :class:`.TransactionStats` of the current process.
+"""
+
+
+def is_retryable(error: sqlalchemy.exc.DBAPIError) -> bool:
+    """
+    :return: :data:`True` if the transaction which raised the error should be run again, :data:`False` otherwise.
+    """
+    return getattr(error.orig, "pgcode", None) in RETRYABLE_ERRORS
+
+
+def backoff(attempt: int, delay: float, max_delay: float) -> float:
+    """
+    Get how long to wait before retrying a transaction, with exponential backoff and full jitter, so that the
+    transactions which conflicted don't retry all at the same time.
+
+    :param attempt: The number of the attempt which failed, starting from 1.
+    :param delay: The maximum number of seconds to wait after the first attempt.
+    :param max_delay: The maximum number of seconds to wait after any attempt.
+    :return: The number of seconds to wait.
+    """
+    return random.uniform(0, min(max_delay, delay * 2 ** (attempt - 1)))
+
+
+def run_transaction(func: Callable[..., ResultType],
+                    *args,
+                    isolation_level: str = "SERIALIZABLE",
+                    attempts: Optional[int] = None,
+                    **kwargs) -> ResultType:
+    """
+    Call ``func`` with a new session as the first argument, then commit the session; if the transaction fails because
+    of a concurrent one, roll it back and do it again with a new session.
+
+    As it may be called more than once, ``func`` should only act on the database; other side effects should happen
+    after the transaction is committed.
+
+    :param func: The function to call.
+    :param args: Other positional arguments to pass to ``func``.
+    :param isolation_level: The isolation level of the transaction.
+    :param attempts: How many times the transaction should be run at most, or :data:`None` to read it from the
+                     ``database.retry.attempts`` config key (defaulting to 5).
+    :param kwargs: Keyword arguments to pass to ``func``.
+    :return: The value returned by ``func``.
+    :raises sqlalchemy.exc.DBAPIError: If the last attempt failed as well, or if it failed for any other reason.
+    """
+    if attempts is None:
+        attempts = config_get("database.retry.attempts", 5)
+    delay = config_get("database.retry.delay", 0.05)
+    max_delay = config_get("database.retry.maxdelay", 2)
+
+    transaction_stats.count(transactions=1)
+    attempt = 1
+    while True:
+        session: sqlalchemy.orm.Session = eng.lazy_Session.evaluate()()
+        try:
+            session.connection(execution_options={"isolation_level": isolation_level})
+            result = func(session, *args, **kwargs)
+            session.commit()
+            return result
+        except sqlalchemy.exc.DBAPIError as error:
+            session.rollback()
+            if not is_retryable(error):
+                raise
+            if attempt >= attempts:
+                transaction_stats.count(failures=1)
+                raise
+            wait = backoff(attempt, delay=delay, max_delay=max_delay)
+            log.debug(f"Retrying {func.__name__} in {wait:.3f}s after attempt {attempt}/{attempts} failed: {error}")
+            transaction_stats.count(retries=1)
+            attempt += 1
+            time.sleep(wait)
+        finally:
+            session.close()
+
+
+def transaction(func: Callable[..., ResultType]) -> Callable[..., ResultType]:
+    """
+    Decorate a function taking a session as the first argument, so that calling it runs it with
+    :func:`.run_transaction` with the other arguments, instead.
+    """
+    @functools.wraps(func)
+    def decorated(*args, **kwargs) -> ResultType:
+        return run_transaction(func, *args, **kwargs)
+
+    return decorated
+
+
+__all__ = (
+    "RETRYABLE_ERRORS",
+    "TransactionStats",
+    "transaction_stats",
+    "is_retryable",
+    "backoff",
+    "run_transaction",
+    "transaction",
+)
@@ -1,6 +1,8 @@
 import celery
+import celery.signals
 
 from ..config import lazy_config
+from ..database import dispose_engine
 
 
 class CeleryConfig:
@@ -15,12 +17,19 @@ class CeleryConfig:
     imports = ["mandarin.taskbus.tasks"]
     task_serializer = "pickle"
     accept_content = ["application/json", "application/x-python-serialize"]
+    task_track_started = True
 
 
 app = celery.Celery("mandarin")
 app.config_from_object(CeleryConfig())
 
 
+@celery.signals.worker_init.connect
+def dispose_before_fork(**kwargs):
+    # The pool processes are forked from the main one, and must not share its database connections
+    dispose_engine()
+
+
 __all__ = (
     "app",
 )
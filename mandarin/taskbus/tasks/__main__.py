@@ -0,0 +1,91 @@
+# Special imports
+from __future__ import annotations
+
+# External imports
+import logging
+
+import click
+import coloredlogs
+
+# Internal imports
+from .processfiles import relocate_encodings, sweep_staged
+from ...database import lazy_Session
+
+# Special global objects
+log = logging.getLogger(__name__)
+
+
+# Code
+@click.group("tasks")
+@click.option(
+    "-D", "--debug",
+    help="Display the full debug log while running the command.",
+    is_flag=True,
+)
+def _group_tasks(
+        debug: bool,
+):
+    coloredlogs.install(
+        level="DEBUG" if debug else "INFO",
+        fmt="{asctime} {levelname} {name}: {message}",
+        style="{",
+    )
+
+
+@_group_tasks.command("relocate")
+@click.option(
+    "-b", "--batch-size",
+    help="The number of files to move and update in a single transaction.",
+    default=1000,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "-n", "--dry-run",
+    help="Only count the files that would be moved, without moving them.",
+    is_flag=True,
+)
+def _command_relocate(
+        batch_size: int,
+        dry_run: bool,
+):
+    """
+    Move all stored music files to the layout set in the config file, updating their location in the database.
+    """
+    session = lazy_Session.evaluate()()
+
+    checked, relocated = 0, 0
+    try:
+        for batch_checked, batch_relocated in relocate_encodings(session=session, batch_size=batch_size,
+                                                                 dry_run=dry_run):
+            checked += batch_checked
+            relocated += batch_relocated
+            log.info(f"Checked {checked} files, {'would move' if dry_run else 'moved'} {relocated}")
+    finally:
+        session.close()
+
+    click.echo(f"{'Would move' if dry_run else 'Moved'} {relocated} of {checked} files.")
+
+
+@_group_tasks.command("sweep")
+@click.option(
+    "-a", "--max-age",
+    help="The number of hours after which a staged upload which wasn't processed is deleted.",
+    default=24.0,
+    type=click.FloatRange(min=0),
+)
+def _command_sweep(
+        max_age: float,
+):
+    """
+    Delete the uploads left in the staging directory by processing tasks which were lost.
+    """
+    deleted = sweep_staged(max_age=max_age * 3600)
+    click.echo(f"Deleted {deleted} abandoned staged files.")
+
+
+def main():
+    _group_tasks()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,112 +5,122 @@ import logging
 import mimetypes
 import os
 import pathlib
+import tempfile
+import time
 
-import mutagen
 import royalnet.typing as t
 import sqlalchemy.orm
 
 from ..__main__ import app as celery
-from ..utils import MutagenParse
-from ...config import lazy_config
-from ...database import tables, lazy_Session
+from ..utils import MutagenParse, tag_process
+from ...config import lazy_config, config_get
+from ...database import tables, run_transaction, any_of, merge_rows
 
 log = logging.getLogger(__name__)
 
 
-def tag_parse(file: mutagen.File) -> t.Dict[str, t.List[str]]:
-    """
-    Copy the tag of a :class:`mutagen.File` to a :class:`dict`.
-
-    :param file: The file to copy the tags from.
-    :return: The copied dict.
-    """
-    tag: t.Dict[str, t.List[str]] = dict(file.tags)
-    return tag
+READ_CHUNK_SIZE = 65536
 
 
-def tag_strip(file: mutagen.File) -> None:
+def chunk_size() -> int:
     """
-    Remove the tag of a :class:`mutagen.File`.
-
-    :param file: The file to remove the tags of.
+    :return: The size in bytes of the chunks files should be read and written in, as set in the ``storage.chunksize``
+             config key, or :data:`.READ_CHUNK_SIZE` if it isn't set.
     """
-    file.tags.clear()
+    return config_get("storage.chunksize", READ_CHUNK_SIZE)
 
 
-def tag_save(file: mutagen.File, destination_stream: t.IO[bytes]) -> t.IO[bytes]:
+def copy_and_hash(source: t.IO[bytes], destination: t.IO[bytes], size: int = READ_CHUNK_SIZE) -> hashlib.sha512:
     """
-    Write the specified :class:`mutagen.File` to the passed destination stream (which can be any writeable file-like
-    object), using no padding for the tag section.
-
-    :param file: The file to save.
-    :param destination_stream: The file-like object to save the file to.
+    Copy the contents of a file-like object to another in chunks, calculating the :class:`hashlib.sha512` hash of the
+    copied data in the same pass.
 
-                               .. important:: The destination stream must be the same exact one that was used to
-                                              create the ``file``, otherwise :mod:`mutagen` won't work!
+    :param source: The file-like object to copy the contents of; it will be read from the start.
+    :param destination: The writeable file-like object to copy the contents to.
+    :param size: The size in bytes of the chunks to read and write.
+    :return: The :class:`hashlib.sha512` hash of the copied data.
     """
-    file.save(fileobj=destination_stream, padding=lambda _: 0)
-    return destination_stream
+    h = hashlib.sha512()
+    source.seek(0)
+    while chunk := source.read(size):
+        h.update(chunk)
+        destination.write(chunk)
+    return h
 
 
-def tag_process(stream: t.IO[bytes]) -> MutagenParse:
+def determine_extension(path: os.PathLike) -> str:
     """
-    Extract the tag of a file from its contents, creating a :class:`.MutagenParse` object.
+    Determine the extension of a file path, normalized to lowercase.
 
-    :param stream: The file-like object that will be parsed and **edited**.
-    :return: The :class:`.MutagenParse` object containing information about the song.
+    :param path: The path-like object to parse, such as a :class:`str` or a `pathlib.Path`.
+    :return: The extension of the file object.
     """
-    stream.seek(0)
-    file: mutagen.File = mutagen.File(fileobj=stream, easy=True)
-    tag: t.Dict[str, t.List[str]] = tag_parse(file)
-    tag_strip(file)
-    stream.seek(0)
-    tag_save(file=file, destination_stream=stream)
-    stream.seek(0)
-    return MutagenParse.from_tags(tag)
+    _, ext = os.path.splitext(path)
+    return ext.lower()
 
 
-HASH_CHUNK_SIZE = 8192
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
 
 
-def hash_file(stream: t.IO[bytes]) -> hashlib.sha512:
+def determine_location(hexdigest: str, extension: str) -> pathlib.Path:
     """
-    Calculate the :class:`hashlib.sha512` hash of a file-like object.
+    Determine the path that a music file with the given hash should be stored at.
 
-    :param stream: The file-like object to calculate the hash of.
-    :return: The :class:`hashlib.sha512` hash.
+    Files are sharded in nested subdirectories of the music directory named after the first characters of their hash
+    (such as ``ab/cd/abcd...``), so that no directory contains too many files; the number of levels and characters
+    per level can be set with the ``storage.music.depth`` and ``storage.music.width`` config keys, defaulting to
+    :data:`.SHARD_DEPTH` and :data:`.SHARD_WIDTH`.
+
+    :param hexdigest: The hex digest of the :class:`hashlib.sha512` hash of the contents of the file.
+    :param extension: The extension the file should have, including the leading dot.
+    :return: A :class:`pathlib.Path` object representing the path that the file should have.
     """
-    h = hashlib.sha512()
-    stream.seek(0)
-    while chunk := stream.read(HASH_CHUNK_SIZE):
-        h.update(chunk)
-    return h
+    musicdir = pathlib.Path(lazy_config.e["storage.music.dir"])
+    depth = config_get("storage.music.depth", SHARD_DEPTH)
+    width = config_get("storage.music.width", SHARD_WIDTH)
+    shards = [hexdigest[level * width:(level + 1) * width] for level in range(depth)]
+    return musicdir.joinpath(*shards, f"{hexdigest}{extension}")
 
 
-def determine_extension(path: os.PathLike) -> str:
+def determine_filename(h: hashlib.sha512, original_path: t.Union[os.PathLike, str]) -> pathlib.Path:
     """
-    Determine the extension of a file path.
+    Determine the filename that should be given to a music file, given its hash.
 
-    :param path: The path-like object to parse, such as a :class:`str` or a `pathlib.Path`.
-    :return: The extension of the file object.
+    :param h: The :class:`hashlib.sha512` hash of the contents of the file.
+    :param original_path: The original path of the file, used to determine the extension and the mimetype.
+    :return: A :class:`pathlib.Path` object representing the path that the file should have, as determined by
+             :func:`.determine_location`.
     """
-    _, ext = os.path.splitext(path)
-    return ext
+    return determine_location(hexdigest=h.hexdigest(), extension=determine_extension(original_path))
 
 
-def determine_filename(stream: t.IO[bytes], original_path: t.Union[os.PathLike, str]) -> pathlib.Path:
+def store_file(stream: t.IO[bytes],
+               original_path: t.Union[os.PathLike, str]) -> t.Tuple[pathlib.Path, hashlib.sha512, bool]:
     """
-    Determine the filename that should be given to a music file, passed as a file-like object.
+    Write a file-like object to the music directory in a single pass, hashing it while it is being written and then
+    moving it to the path determined by :func:`.determine_filename`.
 
-    :param stream: The file-like object.
-    :param original_path: The original path of the file, used to determine the extension and the mimetype.
-    :return: A :class:`pathlib.Path` object representing the path that the file should have.
+    :param stream: The file-like object to store.
+    :param original_path: The original path of the file, used to determine the extension.
+    :return: A :class:`tuple` of the :class:`pathlib.Path` of the stored file, its :class:`hashlib.sha512` hash and a
+             :class:`bool` that is :data:`True` if a file with the same contents was already stored.
     """
-    filename = hash_file(stream).hexdigest()
-    stream.seek(0)
     musicdir = pathlib.Path(lazy_config.e["storage.music.dir"])
-    extension = determine_extension(original_path)
-    return musicdir.joinpath(f"{filename}{extension}")
+    os.makedirs(musicdir, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(dir=musicdir, prefix=".", suffix=".part", delete=False) as part:
+        h = copy_and_hash(source=stream, destination=part, size=chunk_size())
+
+    destination = determine_filename(h=h, original_path=original_path)
+    if os.path.exists(destination):
+        log.debug(f"{destination} is already stored, discarding the copy")
+        os.remove(part.name)
+        return destination, h, True
+
+    os.makedirs(destination.parent, exist_ok=True)
+    os.replace(part.name, destination)
+    return destination, h, False
 
 
 def guess_mimetype(original_path: t.Union[os.PathLike, str]) -> t.Tuple[t.Optional[str], t.Optional[str]]:
@@ -236,77 +246,297 @@ def make_entries_from_layer(session: sqlalchemy.orm.session.Session,
     return album, song
 
 
-READ_CHUNK_SIZE = 8192
+def relocate_encodings(session: sqlalchemy.orm.session.Session,
+                       batch_size: int = 1000,
+                       dry_run: bool = False) -> t.Iterator[t.Tuple[int, int]]:
+    """
+    Move the stored files of all :class:`~mandarin.database.tables.Encoding` to the path determined by
+    :func:`.determine_location`, rewriting their ``location`` in bulk, one batch at a time.
 
+    Each batch is committed after its files have been moved; if the relocation is interrupted, running it again will
+    fix the locations of the files that were moved but not committed.
 
-@celery.task
-def process_music(stream: t.IO[bytes],
-                  original_filename: str,
-                  uploader_id: t.Optional[int] = None,
-                  layer_data: t.Optional[t.Dict[str, t.Any]] = None,
-                  generate_entries: bool = False) -> t.Tuple[int, int]:
+    As extensions are normalized to lowercase, two encodings may have to be moved to the same path: if they have the
+    same digest and aren't part of different layers, the later one is merged into the earlier one, deleting its file;
+    otherwise, the later one keeps its original extension.
+
+    :param session: The :class:`~sqlalchemy.orm.session.Session` to use.
+    :param batch_size: The number of encodings to relocate in a single transaction.
+    :param dry_run: Only count the encodings that would be relocated, without moving or changing anything.
+    :return: An iterator yielding, for each batch, a :class:`tuple` of the number of encodings checked and of the
+             number of encodings that were relocated or merged.
     """
-    A :mod:`celery` task that processes an uploaded music file.
+    columns = (tables.Encoding.id, tables.Encoding.location, tables.Encoding.digest, tables.Encoding.layer_id)
+
+    def claimants(locations: t.Iterable[pathlib.Path]) -> t.Dict[pathlib.Path, t.Dict[str, t.Any]]:
+        query = session.query(*columns).filter(any_of(tables.Encoding.location, [str(path) for path in locations]))
+        return {pathlib.Path(row.location): row._asdict() for row in query.all()}
+
+    last_id = 0
+    while True:
+        query = session.query(*columns)
+        batch = query.filter(tables.Encoding.id > last_id).order_by(tables.Encoding.id).limit(batch_size).all()
+        if len(batch) == 0:
+            break
+        last_id = batch[-1].id
+
+        plans = []
+        for row in batch:
+            source = pathlib.Path(row.location)
+            hexdigest = row.digest.hex() if row.digest is not None else source.stem
+            plans.append((row, source, hexdigest, determine_location(hexdigest, determine_extension(source))))
+
+        # The encodings stored at each of the destinations, either already or after being moved in this batch
+        claimed = claimants(destination for *_, destination in plans)
+
+        mappings = []
+        merged = 0
+        for row, source, hexdigest, destination in plans:
+            if source == destination:
+                continue
+
+            other = claimed.get(destination)
+            mergeable = (
+                other is not None
+                and other["digest"] is not None
+                and other["digest"] == row.digest
+                and (None in (row.layer_id, other["layer_id"]) or row.layer_id == other["layer_id"])
+            )
+            if mergeable:
+                log.debug(f"Merging encoding {row.id} into encoding {other['id']}, as both are stored at {destination}")
+                adopt_layer = other["layer_id"] is None and row.layer_id is not None
+                if adopt_layer:
+                    other["layer_id"] = row.layer_id
+                if not dry_run:
+                    if adopt_layer:
+                        session.query(tables.Encoding).filter_by(id=other["id"]).update(
+                            {"layer_id": row.layer_id}, synchronize_session=False
+                        )
+                    merge_rows(session, tables.Encoding, other["id"], [row.id])
+                    if source.exists():
+                        os.remove(source)
+                merged += 1
+                continue
+
+            if other is not None:
+                # Keep the original extension instead of overwriting a different file
+                destination = determine_location(hexdigest, source.suffix)
+                if source == destination:
+                    continue
+                if destination in claimed or claimants([destination]):
+                    log.warning(f"Skipping encoding {row.id}, as {destination} is already taken")
+                    continue
+
+            if dry_run:
+                mappings.append({"id": row.id, "location": str(destination)})
+            elif source.exists():
+                os.makedirs(destination.parent, exist_ok=True)
+                os.replace(source, destination)
+                mappings.append({"id": row.id, "location": str(destination)})
+            elif destination.exists():
+                log.debug(f"{source} was already moved to {destination}")
+                mappings.append({"id": row.id, "location": str(destination)})
+            else:
+                log.warning(f"Skipping encoding {row.id}, as {source} doesn't exist on the filesystem")
+                continue
+            claimed[destination] = {"id": row.id, "location": str(destination), "digest": row.digest,
+                                    "layer_id": row.layer_id}
+
+        if not dry_run:
+            session.bulk_update_mappings(tables.Encoding, mappings)
+            session.commit()
+
+        yield len(batch), len(mappings) + merged
+
+
+def stage_upload(stream: t.IO[bytes],
+                 original_path: t.Union[os.PathLike, str]) -> t.Tuple[pathlib.Path, hashlib.sha512]:
+    """
+    Spool a file-like object to the staging directory in chunks, calculating its :class:`hashlib.sha512` hash in the
+    meantime, so that only the path of the staged file has to be sent to the taskbus.
 
-    :param stream: A file-like object containing info about the file.
+    .. important:: The staging directory (``storage.tmp.dir``) must be reachable by the workers of the taskbus, as
+                   :func:`.process_staged_music` will have to open the staged file.
+
+    :param stream: The file-like object to stage.
+    :param original_path: The original path of the file, used to determine the extension.
+    :return: A :class:`tuple` of the :class:`pathlib.Path` of the staged file and its :class:`hashlib.sha512` hash.
+    """
+    tmpdir = pathlib.Path(lazy_config.e["storage.tmp.dir"])
+    os.makedirs(tmpdir, exist_ok=True)
+    h = hashlib.sha512()
+    size = chunk_size()
+    with tempfile.NamedTemporaryFile(dir=tmpdir, suffix=determine_extension(original_path), delete=False) as staged:
+        while data := stream.read(size):
+            h.update(data)
+            staged.write(data)
+    return pathlib.Path(staged.name), h
+
+
+def sweep_staged(max_age: float) -> int:
+    """
+    Delete the files staged with :func:`.stage_upload` more than ``max_age`` seconds ago, which were left behind by
+    tasks that were never queued or were lost by the taskbus, as :func:`.process_staged_music` deletes the others.
+
+    :param max_age: The age in seconds after which a staged file is considered abandoned; it should be much longer than
+                    the time an upload waits in the queue.
+    :return: The number of deleted files.
+    """
+    tmpdir = pathlib.Path(lazy_config.e["storage.tmp.dir"])
+    if not tmpdir.exists():
+        return 0
+
+    deleted = 0
+    oldest = time.time() - max_age
+    for path in tmpdir.iterdir():
+        try:
+            if path.is_file() and path.stat().st_mtime < oldest:
+                log.debug(f"Removing abandoned staged file: {path}")
+                path.unlink()
+                deleted += 1
+        except FileNotFoundError:
+            # Processed in the meantime
+            continue
+    return deleted
+
+
+def ingest_music(stream: t.IO[bytes],
+                 original_filename: str,
+                 uploader_id: t.Optional[int] = None,
+                 layer_data: t.Optional[t.Dict[str, t.Any]] = None,
+                 generate_entries: bool = False) -> t.Tuple[int, int]:
+    """
+    Process an uploaded music file, storing it in the music directory and creating the database entries for it.
+
+    :param stream: A file-like object containing the file; it **will be edited** by :func:`.tag_process`.
     :param original_filename: The filename the file originally had.
     :param uploader_id: The id of the :class:`~mandarin.database.tables.User` who uploaded the file, or :data:`None`
                         if it was anonymous.
     :param layer_data: ``**kwargs`` to pass to the :class:`~mandarin.database.tables.Layer` constructor.
     :param generate_entries: Whether entries for the music file should be generated with
                              :func:`.make_entries_from_layer`.
-    :return: A :class:`tuple` of the ids of the created :class:`~mandarin.database.tables.File` and
-             :class:`~mandarin.database.tables.Layer` respectively.
+    :return: A :class:`tuple` of the ids of the :class:`~mandarin.database.tables.Encoding` and
+             :class:`~mandarin.database.tables.Layer` respectively; if the same contents were already uploaded, the ids
+             of the existing ones are returned instead of creating new ones, but the entries are still generated if
+             the existing layer doesn't belong to a song yet, and the uploader is set if it was unknown.
     """
 
     if layer_data is None:
         layer_data: t.Dict[str, t.Any] = {}
 
-    session = lazy_Session.evaluate()()
-    session.connection(execution_options={"isolation_level": "SERIALIZABLE"})
-
     mp: MutagenParse = tag_process(stream=stream)
-    destination = determine_filename(stream=stream, original_path=original_filename)
+    destination, h, duplicate = store_file(stream=stream, original_path=original_filename)
     mime_type, mime_software = guess_mimetype(original_path=original_filename)
 
-    file: t.Optional[tables.File] = None
-    if os.path.exists(destination):
-        file = session.query(tables.File).filter_by(name=str(destination)).one_or_none()
-    else:
-        os.makedirs(destination.parent, exist_ok=True)
-        with open(destination, "wb") as f:
-            while data := stream.read(READ_CHUNK_SIZE):
-                f.write(data)
-
-    if file is None:
-        file = tables.File(
-            name=str(destination),
-            mime_type=mime_type,
-            mime_software=mime_software,
-            uploader_id=uploader_id
-        )
-        session.add(file)
+    def register(session: sqlalchemy.orm.session.Session) -> t.Tuple[int, int, str]:
+        # Duplicates are detected through the indexed digest, independently of where the files are stored
+        encoding: t.Optional[tables.Encoding] = session.query(tables.Encoding).filter_by(digest=h.digest()).first()
 
-    layer = tables.Layer(
-        **layer_data,
-        file=file,
-    )
-    session.add(layer)
+        if encoding is not None:
+            log.debug(f"Contents of {original_filename!r} are already stored as {encoding!r}")
+            if encoding.uploader_id is None:
+                encoding.uploader_id = uploader_id
+            if encoding.layer is None:
+                encoding.layer = tables.Layer(**layer_data)
+                session.add(encoding.layer)
 
-    if generate_entries:
-        album, song = make_entries_from_layer(session=session, layer=layer, mp=mp)
-        session.add(album)
-        session.add(song)
+        else:
+            encoding = tables.Encoding(
+                location=str(destination),
+                digest=h.digest(),
+                size=os.path.getsize(destination),
+                mime_type=mime_type,
+                mime_software=mime_software,
+                uploader_id=uploader_id,
+                layer=tables.Layer(**layer_data),
+            )
+            session.add(encoding)
+
+        # Entries are also generated for files first uploaded without them
+        if generate_entries and encoding.layer.song is None:
+            album, song = make_entries_from_layer(session=session, layer=encoding.layer, mp=mp)
+            session.add(album)
+            session.add(song)
 
-    session.commit()
+        session.flush()
+        return encoding.id, encoding.layer_id, encoding.location
 
-    result = (file.id, layer.id)
+    # Concurrent uploads may create the same albums, songs or people, so the transaction is retried if they conflict
+    encoding_id, layer_id, location = run_transaction(register)
 
-    session.close()
+    if not duplicate and location != str(destination):
+        os.remove(destination)
 
-    return result
+    return encoding_id, layer_id
+
+
+@celery.task
+def process_music(stream: t.IO[bytes],
+                  original_filename: str,
+                  uploader_id: t.Optional[int] = None,
+                  layer_data: t.Optional[t.Dict[str, t.Any]] = None,
+                  generate_entries: bool = False) -> t.Tuple[int, int]:
+    """
+    A :mod:`celery` task that processes an uploaded music file with :func:`.ingest_music`.
+
+    :param stream: A file-like object containing info about the file.
+    :param original_filename: The filename the file originally had.
+    :param uploader_id: The id of the :class:`~mandarin.database.tables.User` who uploaded the file, or :data:`None`
+                        if it was anonymous.
+    :param layer_data: ``**kwargs`` to pass to the :class:`~mandarin.database.tables.Layer` constructor.
+    :param generate_entries: Whether entries for the music file should be generated with
+                             :func:`.make_entries_from_layer`.
+    :return: A :class:`tuple` of the ids of the :class:`~mandarin.database.tables.Encoding` and
+             :class:`~mandarin.database.tables.Layer` respectively.
+    """
+    return ingest_music(
+        stream=stream,
+        original_filename=original_filename,
+        uploader_id=uploader_id,
+        layer_data=layer_data,
+        generate_entries=generate_entries,
+    )
+
+
+@celery.task
+def process_staged_music(staged_path: str,
+                         original_filename: str,
+                         uploader_id: t.Optional[int] = None,
+                         layer_data: t.Optional[t.Dict[str, t.Any]] = None,
+                         generate_entries: bool = False) -> t.Tuple[int, int]:
+    """
+    A :mod:`celery` task that processes a music file staged with :func:`.stage_upload` with :func:`.ingest_music`,
+    deleting the staged file afterwards.
+
+    :param staged_path: The path of the staged file, as returned by :func:`.stage_upload`.
+    :param original_filename: The filename the file originally had.
+    :param uploader_id: The id of the :class:`~mandarin.database.tables.User` who uploaded the file, or :data:`None`
+                        if it was anonymous.
+    :param layer_data: ``**kwargs`` to pass to the :class:`~mandarin.database.tables.Layer` constructor.
+    :param generate_entries: Whether entries for the music file should be generated with
+                             :func:`.make_entries_from_layer`.
+    :return: A :class:`tuple` of the ids of the :class:`~mandarin.database.tables.Encoding` and
+             :class:`~mandarin.database.tables.Layer` respectively.
+    """
+    try:
+        with open(staged_path, "r+b") as stream:
+            return ingest_music(
+                stream=stream,
+                original_filename=original_filename,
+                uploader_id=uploader_id,
+                layer_data=layer_data,
+                generate_entries=generate_entries,
+            )
+    finally:
+        log.debug(f"Removing staged file: {staged_path}")
+        os.remove(staged_path)
 
 
 __all__ = (
+    "relocate_encodings",
+    "stage_upload",
+    "sweep_staged",
+    "ingest_music",
     "process_music",
+    "process_staged_music",
 )
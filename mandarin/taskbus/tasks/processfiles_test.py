@@ -1,4 +1,5 @@
 import pytest
+import json
 import pathlib
 import shutil
 import os
@@ -9,8 +10,10 @@ from mandarin.testing.fixtures import *
 from mandarin.database import tables
 
 # noinspection PyProtectedMember
-from .processfiles import tag_parse, tag_strip, tag_save, tag_process, hash_file, determine_extension, \
-    determine_filename, guess_mimetype, find_song_from_tag, find_album_from_tag, make_entries_from_layer, process_music
+from .processfiles import determine_extension, determine_filename, guess_mimetype, find_song_from_tag, \
+    find_album_from_tag, make_entries_from_layer, process_music, stage_upload, copy_and_hash, store_file, \
+    determine_location, relocate_encodings, sweep_staged
+from ..utils import tag_parse, tag_strip, tag_save, tag_process, hash_file, hash_music
 
 
 @pytest.fixture
@@ -108,9 +111,54 @@ def test_hash_file(tmp_sample_noise_bytesio, sample_noise_hash):
     assert h.hexdigest() == sample_noise_hash
 
 
+def test_hash_music(tmp_sample_noise_bytesio):
+    stripped = io.BytesIO(tmp_sample_noise_bytesio.getvalue())
+    tag_process(stripped)
+
+    h = hash_music(tmp_sample_noise_bytesio)
+    assert h.hexdigest() == hash_file(stripped).hexdigest()
+
+
+def test_copy_and_hash(tmp_sample_noise_bytesio, sample_noise_hash):
+    destination = io.BytesIO()
+    h = copy_and_hash(tmp_sample_noise_bytesio, destination, size=1000)
+    assert h.hexdigest() == sample_noise_hash
+    assert destination.getvalue() == tmp_sample_noise_bytesio.getvalue()
+
+
+def test_store_file(tmp_path, monkeypatch, tmp_sample_noise_bytesio, sample_noise_hash):
+    monkeypatch.setenv("MANDARIN_STORAGE_MUSIC_DIR", json.dumps(str(tmp_path.joinpath("music"))))
+
+    destination, h, duplicate = store_file(tmp_sample_noise_bytesio, "noise.mp3")
+    assert h.hexdigest() == sample_noise_hash
+    assert destination == tmp_path.joinpath("music", sample_noise_hash[0:2], sample_noise_hash[2:4],
+                                            f"{sample_noise_hash}.mp3")
+    assert not duplicate
+    assert destination.exists()
+
+    destination, h, duplicate = store_file(tmp_sample_noise_bytesio, "noise.mp3")
+    assert duplicate
+    assert os.listdir(destination.parent) == [f"{sample_noise_hash}.mp3"]
+    assert not any(path.name.endswith(".part") for path in tmp_path.joinpath("music").iterdir())
+
+
+def test_determine_location(tmp_path, monkeypatch, sample_noise_hash):
+    monkeypatch.setenv("MANDARIN_STORAGE_MUSIC_DIR", json.dumps(str(tmp_path)))
+
+    monkeypatch.setenv("MANDARIN_STORAGE_MUSIC_DEPTH", "3")
+    monkeypatch.setenv("MANDARIN_STORAGE_MUSIC_WIDTH", "1")
+    location = determine_location(sample_noise_hash, ".mp3")
+    assert location == tmp_path.joinpath(*sample_noise_hash[0:3], f"{sample_noise_hash}.mp3")
+
+    monkeypatch.setenv("MANDARIN_STORAGE_MUSIC_DEPTH", "0")
+    location = determine_location(sample_noise_hash, ".mp3")
+    assert location == tmp_path.joinpath(f"{sample_noise_hash}.mp3")
+
+
 def test_determine_extension(tmp_sample_noise_path):
     ext = determine_extension(tmp_sample_noise_path)
     assert ext == ".mp3"
+    assert determine_extension("NOISE.MP3") == ".mp3"
 
 
 def test_guess_mimetype(tmp_sample_noise_path):
@@ -119,37 +167,78 @@ def test_guess_mimetype(tmp_sample_noise_path):
     assert mimesoftware is None
 
 
+def test_stage_upload(tmp_path, monkeypatch, tmp_sample_noise_bytesio, sample_noise_hash):
+    monkeypatch.setenv("MANDARIN_STORAGE_TMP_DIR", json.dumps(str(tmp_path.joinpath("staging"))))
+    staged_path, h = stage_upload(tmp_sample_noise_bytesio, "noise.mp3")
+
+    assert h.hexdigest() == sample_noise_hash
+    assert staged_path.parent == tmp_path.joinpath("staging")
+    assert staged_path.suffix == ".mp3"
+    with open(staged_path, "rb") as file:
+        assert file.read() == tmp_sample_noise_bytesio.getvalue()
+
+
 class TestProcessMusic:
 
     def test_simple(self, recreate_db, session, tmp_sample_noise_bytesio):
-        file_id, layer_id = process_music.delay(
+        encoding_id, layer_id = process_music.delay(
             stream=tmp_sample_noise_bytesio,
             original_filename="noise.mp3",
         ).get(timeout=5)
-        assert file_id == 1
+        assert encoding_id == 1
         assert layer_id == 1
 
-        file: tables.File = session.query(tables.File).get(file_id)
-        assert file is not None
-        assert file.location.startswith("data/music/")
-        assert file.location.endswith(".mp3")
-        assert file.uploader_id is None
-        assert file.mime_type == "audio/mpeg"
+        encoding: tables.Encoding = session.query(tables.Encoding).get(encoding_id)
+        assert encoding is not None
+        assert encoding.location.startswith("data/music/")
+        assert encoding.location.endswith(".mp3")
+        assert encoding.digest == bytes.fromhex(encoding.location[-132:-4])
+        assert encoding.size > 0
+        assert encoding.uploader_id is None
+        assert encoding.mime_type == "audio/mpeg"
+        assert encoding.layer_id == layer_id
 
         layer: tables.Layer = session.query(tables.Layer).get(layer_id)
         assert layer is not None
         assert layer.name == "Default"
         assert layer.description == ""
-        assert layer.file_id == file_id
         assert layer.song is None
 
+    def test_duplicate(self, recreate_db, session, tmp_sample_noise_bytesio):
+        first = process_music.delay(
+            stream=tmp_sample_noise_bytesio,
+            original_filename="noise.mp3",
+        ).get(timeout=5)
+        second = process_music.delay(
+            stream=tmp_sample_noise_bytesio,
+            original_filename="NOISE.MP3",
+        ).get(timeout=5)
+        assert first == second
+        assert session.query(tables.Encoding).count() == 1
+
+    def test_duplicate_with_entries(self, recreate_db, session, tmp_sample_noise_bytesio):
+        first = process_music.delay(
+            stream=tmp_sample_noise_bytesio,
+            original_filename="noise.mp3",
+        ).get(timeout=5)
+        second = process_music.delay(
+            stream=tmp_sample_noise_bytesio,
+            original_filename="noise.mp3",
+            generate_entries=True,
+        ).get(timeout=5)
+        assert first == second
+
+        layer: tables.Layer = session.query(tables.Layer).get(second[1])
+        assert layer.song is not None
+        assert layer.song.title == "Brownian"
+
     def test_with_entries(self, recreate_db, session, tmp_sample_noise_bytesio):
-        file_id, layer_id = process_music.delay(
+        encoding_id, layer_id = process_music.delay(
             stream=tmp_sample_noise_bytesio,
             original_filename="noise.mp3",
             generate_entries=True,
         ).get(timeout=5)
-        assert file_id == 1
+        assert encoding_id == 1
         assert layer_id == 1
 
         layer: tables.Layer = session.query(tables.Layer).get(layer_id)
@@ -165,3 +254,71 @@ class TestProcessMusic:
         album: tables.Album = song.album
         assert album.title == "Noise"
         assert album.description == ""
+
+
+class TestRelocateEncodings:
+
+    @pytest.fixture
+    def legacy(self, tmp_path, monkeypatch, sample_noise_hash):
+        """
+        Store the sample file twice in a legacy directory, named after its hash with two differently cased
+        extensions, returning the paths of the two copies.
+        """
+        monkeypatch.setenv("MANDARIN_STORAGE_MUSIC_DIR", json.dumps(str(tmp_path.joinpath("music"))))
+        legacy = tmp_path.joinpath("legacy")
+        os.makedirs(legacy)
+        upper = legacy.joinpath(f"{sample_noise_hash}.MP3")
+        lower = legacy.joinpath(f"{sample_noise_hash}.mp3")
+        for path in (upper, lower):
+            shutil.copy2("mandarin/testing/samples/noise.mp3", path)
+        return upper, lower
+
+    def test_merge_same_digest(self, recreate_db, session, legacy, sample_noise_hash):
+        upper, lower = legacy
+        layer = tables.Layer(name="Default")
+        session.add_all([
+            tables.Encoding(location=str(upper), digest=bytes.fromhex(sample_noise_hash)),
+            tables.Encoding(location=str(lower), digest=bytes.fromhex(sample_noise_hash), layer=layer),
+        ])
+        session.commit()
+
+        assert list(relocate_encodings(session=session)) == [(2, 2)]
+        session.expire_all()
+        encoding = session.query(tables.Encoding).one()
+        assert encoding.id == 1
+        assert encoding.location == str(determine_location(sample_noise_hash, ".mp3"))
+        assert encoding.layer_id == layer.id
+        assert pathlib.Path(encoding.location).exists()
+        assert not upper.exists()
+        assert not lower.exists()
+
+        # Running it again changes nothing
+        assert list(relocate_encodings(session=session)) == [(1, 0)]
+
+    def test_keep_extension_different_digest(self, recreate_db, session, legacy, sample_noise_hash):
+        upper, lower = legacy
+        session.add_all([
+            tables.Encoding(location=str(lower)),
+            tables.Encoding(location=str(upper), digest=bytes.fromhex(sample_noise_hash)),
+        ])
+        session.commit()
+
+        assert list(relocate_encodings(session=session)) == [(2, 2)]
+        session.expire_all()
+        first, second = session.query(tables.Encoding).order_by(tables.Encoding.id).all()
+        assert first.location == str(determine_location(sample_noise_hash, ".mp3"))
+        assert second.location == str(determine_location(sample_noise_hash, ".MP3"))
+        assert pathlib.Path(first.location).exists()
+        assert pathlib.Path(second.location).exists()
+
+
+def test_sweep_staged(tmp_path, monkeypatch, tmp_sample_noise_bytesio):
+    monkeypatch.setenv("MANDARIN_STORAGE_TMP_DIR", json.dumps(str(tmp_path.joinpath("staging"))))
+    abandoned, _ = stage_upload(tmp_sample_noise_bytesio, "noise.mp3")
+    tmp_sample_noise_bytesio.seek(0)
+    recent, _ = stage_upload(tmp_sample_noise_bytesio, "noise.mp3")
+    os.utime(abandoned, (0, 0))
+
+    assert sweep_staged(max_age=3600) == 1
+    assert not abandoned.exists()
+    assert recent.exists()
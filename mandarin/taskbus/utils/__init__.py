@@ -1 +1,2 @@
 from .mutagenparse import *
+from .tagging import *
@@ -0,0 +1,106 @@
+"""
+This module defines functions to read the tags of music files and to hash their contents without them.
+
+It doesn't depend on the database or on the task bus, so that it can be used by clients as well.
+"""
+
+from __future__ import annotations
+
+import hashlib
+
+import mutagen
+import royalnet.typing as t
+
+from .mutagenparse import MutagenParse
+
+
+def tag_parse(file: mutagen.File) -> t.Dict[str, t.List[str]]:
+    """
+    Copy the tag of a :class:`mutagen.File` to a :class:`dict`.
+
+    :param file: The file to copy the tags from.
+    :return: The copied dict.
+    """
+    tag: t.Dict[str, t.List[str]] = dict(file.tags)
+    return tag
+
+
+def tag_strip(file: mutagen.File) -> None:
+    """
+    Remove the tag of a :class:`mutagen.File`.
+
+    :param file: The file to remove the tags of.
+    """
+    file.tags.clear()
+
+
+def tag_save(file: mutagen.File, destination_stream: t.IO[bytes]) -> t.IO[bytes]:
+    """
+    Write the specified :class:`mutagen.File` to the passed destination stream (which can be any writeable file-like
+    object), using no padding for the tag section.
+
+    :param file: The file to save.
+    :param destination_stream: The file-like object to save the file to.
+
+                               .. important:: The destination stream must be the same exact one that was used to
+                                              create the ``file``, otherwise :mod:`mutagen` won't work!
+    """
+    file.save(fileobj=destination_stream, padding=lambda _: 0)
+    return destination_stream
+
+
+def tag_process(stream: t.IO[bytes]) -> MutagenParse:
+    """
+    Extract the tag of a file from its contents, creating a :class:`.MutagenParse` object.
+
+    :param stream: The file-like object that will be parsed and **edited**.
+    :return: The :class:`.MutagenParse` object containing information about the song.
+    """
+    stream.seek(0)
+    file: mutagen.File = mutagen.File(fileobj=stream, easy=True)
+    tag: t.Dict[str, t.List[str]] = tag_parse(file)
+    tag_strip(file)
+    stream.seek(0)
+    tag_save(file=file, destination_stream=stream)
+    stream.seek(0)
+    return MutagenParse.from_tags(tag)
+
+
+HASH_CHUNK_SIZE = 8192
+
+
+def hash_file(stream: t.IO[bytes]) -> hashlib.sha512:
+    """
+    Calculate the :class:`hashlib.sha512` hash of a file-like object.
+
+    :param stream: The file-like object to calculate the hash of.
+    :return: The :class:`hashlib.sha512` hash.
+    """
+    h = hashlib.sha512()
+    stream.seek(0)
+    while chunk := stream.read(HASH_CHUNK_SIZE):
+        h.update(chunk)
+    return h
+
+
+def hash_music(stream: t.IO[bytes]) -> hashlib.sha512:
+    """
+    Calculate the :class:`hashlib.sha512` hash a music file will have once stored by :func:`.ingest_music`, which is
+    the hash of its contents with the tags stripped.
+
+    :param stream: The file-like object to calculate the hash of; it **will be edited** by :func:`.tag_process`.
+    :return: The :class:`hashlib.sha512` hash.
+    """
+    tag_process(stream=stream)
+    return hash_file(stream)
+
+
+__all__ = (
+    "tag_parse",
+    "tag_strip",
+    "tag_save",
+    "tag_process",
+    "HASH_CHUNK_SIZE",
+    "hash_file",
+    "hash_music",
+)
@@ -1 +1,3 @@
 from .database import *
+from .queries import *
+from .clock import *
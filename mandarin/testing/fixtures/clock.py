@@ -0,0 +1,27 @@
+import pytest
+
+
+class FakeClock:
+    """
+    A replacement for :func:`time.monotonic` or :func:`time.time` which only moves when :attr:`.now` is changed.
+    """
+
+    def __init__(self, now: float = 1_600_000_000.0):
+        self.now: float = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def fake_clock() -> FakeClock:
+    """
+    Provide a :class:`.FakeClock`, to be patched over the clocks used by the tested module.
+    """
+    return FakeClock()
+
+
+__all__ = (
+    "FakeClock",
+    "fake_clock",
+)
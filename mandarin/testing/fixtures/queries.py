@@ -0,0 +1,48 @@
+import contextlib
+
+import pytest
+import sqlalchemy.event
+from royalnet.typing import *
+
+from mandarin import database
+
+
+@contextlib.contextmanager
+def count_queries() -> Iterator[List[str]]:
+    """
+    Record the SQL statements sent to the database while the context is active.
+
+    :return: A :class:`list` which the statements are appended to as they are executed.
+    """
+    statements = []
+    engine = database.lazy_engine.evaluate()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sqlalchemy.event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Provide a function which asserts that the code run inside the returned context issues at most ``budget`` queries.
+    """
+    @contextlib.contextmanager
+    def check(budget: int):
+        with count_queries() as statements:
+            yield statements
+        assert len(statements) <= budget, f"{len(statements)} queries issued, budget is {budget}:\n" + \
+                                          "\n".join(statements)
+
+    return check
+
+
+__all__ = (
+    "count_queries",
+    "query_budget",
+)
@@ -6,16 +6,15 @@ import json
 import logging
 import os
 import pathlib
-import time
 import typing as t
 
 import click
 import coloredlogs
 import lyricsgenius
-import requests
 import toml
 
 from .utils import MandarinAuth, LocalConfig
+from .utils import UploadJournal, BulkUploader
 # Internal imports
 from .utils import MandarinInstance, MANDARIN_INSTANCE_TYPE
 from .utils import prints
@@ -154,11 +153,52 @@ def _group_auth(
     type=str,
     required=False,
 )
+@click.option(
+    "-w", "--workers",
+    help="The number of files to hash and of batches to upload at the same time.",
+    default=4,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "-b", "--batch-size",
+    help="The number of files to upload in a single request.",
+    default=10,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "-r", "--retries",
+    help="The number of times a request failing with a transient error should be retried.",
+    default=5,
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "-j", "--journal", "journal_str",
+    help="The file where the progress of the upload should be stored in, allowing interrupted uploads to be resumed.",
+    default=f"{pathlib.Path.home()}/.config/mandarin/cli/upload.jsonl",
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click.option(
+    "--wait/--no-wait",
+    help="Wait for the uploaded files to be processed by the instance.",
+    default=True,
+)
+@click.option(
+    "--wait-timeout",
+    help="The number of seconds to wait at most for the uploaded files to be processed.",
+    default=3600.0,
+    type=click.FloatRange(min=0),
+)
 @click.pass_context
 def _(
         ctx: click.Context,
         files: t.Collection[str],
         extension: t.Optional[str],
+        workers: int,
+        batch_size: int,
+        retries: int,
+        journal_str: str,
+        wait: bool,
+        wait_timeout: float,
 ):
     instance: MandarinInstance = ctx.obj["INSTANCE"]
     auth: MandarinAuth = ctx.obj["AUTH"]
@@ -181,53 +221,61 @@ def _(
     if len(files) == 0 and extension:
         files = get_files(pathlib.Path("."))
 
-    log.debug("Creating progress bar...")
-    with click.progressbar(
-            files,
-            label="Uploading files",
-            show_eta=True,
-            show_percent=True,
-            show_pos=True,
-            item_show_func=lambda i: str(i)
-    ) as bar:
-        log.debug("Iterating over all files...")
-        for path in bar:
-            with open(path, mode="rb") as file:
-                log.debug(f"Uploading: {file.name!r}")
-
-                try:
-                    r = instance.post(
-                        "/files/layer",
-                        params={
-                            "generate_entries": True,
-                        },
-                        files={
-                            "file": (file.name, file)
-                        },
-                        headers=auth.data.token.access_header(),
-                    )
-                except requests.exceptions.ConnectionError as e:
-                    log.info(f"Could not connect to the upload endpoint: {e!r}")
-                    raise click.ClickException(f"Could not connect to the upload endpoint: {e}")
-
-                log.debug(f"Response status: {r.status_code!r}")
-                if r.status_code >= 400:
-                    log.info(f"File upload returned HTTP status: {r.status_code!r}")
-                    raise click.ClickException(f"File upload returned HTTP status: {r.status_code!r}")
-
-                log.debug(f"Parsing response JSON...")
-                j: str = r.json()
-                log.debug(f"Parsed response: {j!r}")
+    paths = [pathlib.Path(file).resolve() for file in files]
+
+    journal_path = pathlib.Path(journal_str)
+    log.debug(f"Ensuring the journal directories exist: {journal_path.parent!r}")
+    os.makedirs(journal_path.parent, exist_ok=True)
+    journal = UploadJournal(path=journal_path, instance=instance)
+    uploader = BulkUploader(
+        instance=instance,
+        headers=auth.data.token.access_header(),
+        journal=journal,
+        workers=workers,
+        retries=retries,
+    )
+
+    log.debug("Skipping files already uploaded...")
+    pending = [path for path in paths if not journal.completed(path)]
+    if len(pending) < len(paths):
+        click.echo(f"Skipping {len(paths) - len(pending)} files already uploaded.")
+
+    with click.progressbar(length=len(pending), label="Hashing files", show_eta=True, show_pos=True) as bar:
+        hashed = uploader.hash_all(pending, progress=bar.update)
+
+    log.debug("Skipping duplicate files...")
+    unique = uploader.deduplicate(hashed)
+    if len(unique) < len(hashed):
+        click.echo(f"Skipping {len(hashed) - len(unique)} duplicate files.")
+
+    log.debug("Skipping files already stored on the instance...")
+    missing = uploader.probe(unique)
+    if len(missing) < len(unique):
+        click.echo(f"Skipping {len(unique) - len(missing)} files already stored on the instance.")
+
+    with click.progressbar(length=len(missing), label="Uploading files", show_eta=True, show_pos=True) as bar:
+        queued = uploader.upload_all(missing, batch_size=batch_size, progress=bar.update)
+
+    if wait:
+        with click.progressbar(length=len(queued), label="Processing files", show_eta=True, show_pos=True) as bar:
+            uploader.wait_all(queued, progress=bar.update, timeout=wait_timeout)
+
+    current = {str(path) for path in paths}
+    failed = [entry for entry in journal.failed() if entry.path in current]
+    if failed:
+        for entry in failed:
+            log.info(f"Failed: {entry.path}")
+        raise click.ClickException(f"{len(failed)} files could not be uploaded; run the command again to retry them.")
 
     click.echo("Success!")
 
 
 @_group_auth.command("thesaurus")
 @click.option(
-    "-d", "--delay",
-    help="The delay between two Mandarin requests.",
-    default=1.0,
-    type=float,
+    "-s", "--supergenre",
+    help="The id of the genre the top level genres of the thesaurus should be subgenres of.",
+    default=0,
+    type=int,
 )
 @click.argument(
     "file",
@@ -237,7 +285,7 @@ def _(
 @click.pass_context
 def _(
         ctx: click.Context,
-        delay: float,
+        supergenre: int,
         file: t.TextIO,
 ):
     instance: MandarinInstance = ctx.obj["INSTANCE"]
@@ -245,35 +293,33 @@ def _(
 
     j = json.load(file)
 
-    def genre_dfs(supergenre: int, genre: str, children: dict, indent: int):
-        prints.tree(indent, genre, has_children=len(children) > 0)
+    r = instance.post(
+        "/genres/thesaurus",
+        params={
+            "supergenre_id": supergenre,
+        },
+        json=j,
+        headers=auth.data.token.access_header()
+    )
+    rj = r.json()
+    if not 200 <= r.status_code < 400:
+        raise click.ClickException(f"Could not import the thesaurus: {rj['detail']}")
 
-        r = instance.post(
-            f"/genres/",
-            json={
-                "location": genre,
-                "description": "",
-                "supergenre_id": supergenre
-            },
-            headers=auth.data.token.access_header()
-        )
-        rj = r.json()
-
-        if 200 <= r.status_code < 400:
-            genre_id = rj["id"]
-            prints.id_(genre_id, success=True)
-        else:
-            genre_id = rj["detail"]["id"]
-            prints.id_(genre_id, success=False)
-        click.echo()
+    ids = rj["ids"]
+    created = set(rj["created"])
 
-        time.sleep(delay)
+    def genre_dfs(genre: str, children: dict, indent: int):
+        prints.tree(indent, genre, has_children=len(children) > 0)
+        prints.id_(ids[genre], success=genre in created)
+        click.echo()
 
         for key, value in children.items():
-            genre_dfs(supergenre=genre_id, genre=key, children=value, indent=indent + 1)
+            genre_dfs(genre=key, children=value, indent=indent + 1)
 
     for _key, _value in j.items():
-        genre_dfs(supergenre=0, genre=_key, children=_value, indent=0)
+        genre_dfs(genre=_key, children=_value, indent=0)
+
+    click.echo(f"Created {len(created)} genres.")
 
 
 def main():
@@ -5,3 +5,4 @@ Utilities for building Mandarin command line tools.
 from .auth import *
 from .instance import *
 from .prints import *
+from .upload import *
@@ -0,0 +1,379 @@
+# Special imports
+from __future__ import annotations
+
+# External imports
+import concurrent.futures
+import contextlib
+import logging
+import pathlib
+import random
+import shutil
+import tempfile
+import threading
+import time
+import typing as t
+
+import click
+import pydantic
+import requests
+import requests.adapters
+
+# Internal imports
+from .instance import MandarinInstance
+from ...taskbus.utils import hash_music
+
+# Special global objects
+log = logging.getLogger(__name__)
+Progress = t.Callable[[int], None]
+
+
+# Code
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+"""
+The HTTP status codes that will cause a request to be retried.
+"""
+
+
+class JournalEntry(pydantic.BaseModel):
+    """
+    The record of a file processed by the :class:`.BulkUploader`.
+    """
+    instance: str
+    path: str
+    size: int
+    mtime: float
+    sha512: t.Optional[str]
+    status: str
+    task_id: t.Optional[str]
+
+
+class UploadJournal:
+    """
+    An append-only file recording the files processed by the :class:`.BulkUploader`, allowing an interrupted upload to
+    be resumed from where it stopped.
+
+    Each line of the file is a :class:`.JournalEntry` serialized in JSON; only the last entry of each path matters.
+    """
+
+    COMPLETED = {"queued", "processed", "duplicate"}
+    """
+    The statuses of the files that don't need to be uploaded again.
+    """
+
+    def __init__(self, path: pathlib.Path, instance: MandarinInstance):
+        self.path: pathlib.Path = path
+        self.instance: MandarinInstance = instance
+        self.entries: t.Dict[str, JournalEntry] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+        if not path.exists():
+            return
+
+        log.debug(f"Loading upload journal: {path!r}")
+        with open(path) as file:
+            for line in file:
+                try:
+                    entry = JournalEntry.parse_raw(line)
+                except pydantic.ValidationError:
+                    log.warning(f"Skipping corrupted upload journal line: {line!r}")
+                    continue
+                if entry.instance == instance.url:
+                    self.entries[entry.path] = entry
+
+    def completed(self, path: pathlib.Path) -> bool:
+        """
+        :return: :data:`True` if the file at the specified path has already been uploaded and hasn't changed since,
+                 :data:`False` otherwise.
+        """
+        entry = self.entries.get(str(path))
+        if entry is None or entry.status not in self.COMPLETED:
+            return False
+        stat = path.stat()
+        return entry.size == stat.st_size and entry.mtime == stat.st_mtime
+
+    def completed_hashes(self) -> t.Set[str]:
+        """
+        :return: The hashes of all the files that don't need to be uploaded again.
+        """
+        return {entry.sha512 for entry in self.entries.values() if entry.status in self.COMPLETED and entry.sha512}
+
+    def failed(self) -> t.List[JournalEntry]:
+        """
+        :return: The entries of the files that failed to be uploaded or processed.
+        """
+        return [entry for entry in self.entries.values() if entry.status == "failed"]
+
+    def append(self, entry: JournalEntry) -> JournalEntry:
+        """
+        Append an entry to the journal.
+
+        :param entry: The entry to append.
+        :return: The appended entry.
+        """
+        with self.lock:
+            self.entries[entry.path] = entry
+            with open(self.path, "a") as file:
+                file.write(f"{entry.json()}\n")
+        return entry
+
+    def record(self, path: pathlib.Path, status: str, sha512: t.Optional[str] = None,
+               task_id: t.Optional[str] = None) -> JournalEntry:
+        """
+        Record the new status of a file, appending it to the journal.
+
+        :param path: The path of the file.
+        :param status: The new status of the file.
+        :param sha512: The hash of the file, as calculated by :func:`mandarin.taskbus.utils.hash_music`.
+        :param task_id: The id of the task processing the file.
+        :return: The recorded :class:`.JournalEntry`.
+        """
+        stat = path.stat()
+        return self.append(JournalEntry(
+            instance=self.instance.url,
+            path=str(path),
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            sha512=sha512,
+            status=status,
+            task_id=task_id,
+        ))
+
+
+class BulkUploader:
+    """
+    An uploader which hashes, deduplicates and uploads many files to a Mandarin instance concurrently, using a pool of
+    HTTP connections and retrying transient failures.
+    """
+
+    def __init__(self,
+                 instance: MandarinInstance,
+                 headers: t.Dict[str, str],
+                 journal: UploadJournal,
+                 workers: int = 4,
+                 retries: int = 5,
+                 backoff: float = 1.0):
+        self.instance: MandarinInstance = instance
+        self.headers: t.Dict[str, str] = headers
+        self.journal: UploadJournal = journal
+        self.workers: int = workers
+        self.retries: int = retries
+        self.backoff: float = backoff
+
+        self.session: requests.Session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def retry(self, request: t.Callable[[], requests.Response]) -> requests.Response:
+        """
+        Perform a request, retrying it with an exponential and jittered backoff if it fails with a connection error or
+        with one of the :data:`.TRANSIENT_STATUS_CODES`.
+
+        :param request: A function performing the request.
+        :return: The last received response.
+        :raises requests.RequestException: If the last try failed with a connection error.
+        """
+        attempt = 0
+        while True:
+            try:
+                r = request()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                log.info(f"Request failed with {e!r}, retrying...")
+            else:
+                if r.status_code not in TRANSIENT_STATUS_CODES or attempt >= self.retries:
+                    return r
+                log.info(f"Request returned HTTP status {r.status_code!r}, retrying...")
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    def hash_all(self, paths: t.Collection[pathlib.Path], progress: Progress) -> t.List[t.Tuple[pathlib.Path, str]]:
+        """
+        Hash the specified files concurrently; files which can't be hashed are recorded as failed.
+
+        As hashing strips the tags of the files, each of them is first copied in chunks to a temporary file, so that
+        neither the original is edited nor the whole file is kept in memory.
+
+        :param paths: The paths of the files to hash.
+        :param progress: A function called with the number of files hashed every time a file is hashed.
+        :return: A :class:`list` of :class:`tuple` of the path of each successfully hashed file and its hash.
+        """
+        def hash_path(path: pathlib.Path) -> t.Optional[str]:
+            try:
+                with open(path, "rb") as file, tempfile.TemporaryFile() as copy:
+                    shutil.copyfileobj(file, copy)
+                    return hash_music(copy).hexdigest()
+            except Exception as e:
+                log.info(f"Could not hash {path!r}: {e!r}")
+                self.journal.record(path, status="failed")
+                return None
+
+        hashed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for path, h in zip(paths, executor.map(hash_path, paths)):
+                if h is not None:
+                    hashed.append((path, h))
+                progress(1)
+        return hashed
+
+    def deduplicate(self, hashed: t.List[t.Tuple[pathlib.Path, str]]) -> t.List[t.Tuple[pathlib.Path, str]]:
+        """
+        Skip the files whose hash has already been uploaded, or which are duplicates of another specified file,
+        recording them as duplicates.
+
+        :param hashed: A :class:`list` of :class:`tuple` of the path of each file and its hash.
+        :return: The files that still have to be uploaded, in the same format.
+        """
+        seen = self.journal.completed_hashes()
+        unique = []
+        for path, h in hashed:
+            if h in seen:
+                log.debug(f"Skipping duplicate: {path!r}")
+                self.journal.record(path, status="duplicate", sha512=h)
+                continue
+            seen.add(h)
+            unique.append((path, h))
+        return unique
+
+    def probe(self, hashed: t.List[t.Tuple[pathlib.Path, str]],
+              page_size: int = 1000) -> t.List[t.Tuple[pathlib.Path, str]]:
+        """
+        Ask the instance which of the files are already stored through ``/files/probe``, recording them as duplicates.
+
+        :param hashed: A :class:`list` of :class:`tuple` of the path of each file and its hash.
+        :param page_size: The number of hashes to check in a single request.
+        :return: The files that still have to be uploaded, in the same format.
+        """
+        stored = set()
+        for i in range(0, len(hashed), page_size):
+            r = self.retry(lambda: self.session.post(
+                self.instance.absolute("/files/probe"),
+                json=[h for _, h in hashed[i:i + page_size]],
+                headers=self.headers,
+            ))
+            if r.status_code >= 400:
+                raise click.ClickException(f"Could not probe the instance for stored files: HTTP {r.status_code}")
+            stored.update(r.json())
+
+        missing = []
+        for path, h in hashed:
+            if h in stored:
+                log.debug(f"Skipping file already stored: {path!r}")
+                self.journal.record(path, status="duplicate", sha512=h)
+                continue
+            missing.append((path, h))
+        return missing
+
+    def upload_batch(self, batch: t.List[t.Tuple[pathlib.Path, str]]) -> t.List[JournalEntry]:
+        """
+        Upload a batch of files in a single request to ``/files/layers``, recording the results in the journal.
+
+        :param batch: A :class:`list` of :class:`tuple` of the path of each file and its hash.
+        :return: The journal entries of the files that were queued for processing.
+        """
+        def request() -> requests.Response:
+            with contextlib.ExitStack() as stack:
+                files = [("files", (path.name, stack.enter_context(open(path, "rb")))) for path, _ in batch]
+                return self.session.post(
+                    self.instance.absolute("/files/layers"),
+                    params={
+                        "generate_entries": True,
+                    },
+                    files=files,
+                    headers=self.headers,
+                )
+
+        try:
+            r = self.retry(request)
+        except requests.RequestException as e:
+            log.info(f"Could not connect to the upload endpoint: {e!r}")
+            for path, h in batch:
+                self.journal.record(path, status="failed", sha512=h)
+            return []
+
+        if r.status_code >= 400:
+            log.info(f"File upload returned HTTP status: {r.status_code!r}")
+            for path, h in batch:
+                self.journal.record(path, status="failed", sha512=h)
+            return []
+
+        return [
+            self.journal.record(path, status="queued", sha512=h, task_id=task["id"])
+            for (path, h), task in zip(batch, r.json())
+        ]
+
+    def upload_all(self,
+                   files: t.List[t.Tuple[pathlib.Path, str]],
+                   batch_size: int,
+                   progress: Progress) -> t.List[JournalEntry]:
+        """
+        Upload the specified files concurrently, in batches of ``batch_size`` files.
+
+        :param files: A :class:`list` of :class:`tuple` of the path of each file and its hash.
+        :param batch_size: The number of files to upload in a single request.
+        :param progress: A function called with the number of files uploaded every time a batch is uploaded.
+        :return: The journal entries of the files that were queued for processing.
+        """
+        queued = []
+        batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.upload_batch, batch): batch for batch in batches}
+            for future in concurrent.futures.as_completed(futures):
+                queued += future.result()
+                progress(len(futures[future]))
+        return queued
+
+    def wait_all(self, queued: t.List[JournalEntry], progress: Progress, interval: float = 5.0,
+                 page_size: int = 100, timeout: float = 3600.0) -> None:
+        """
+        Wait for the processing tasks of the specified queued files to finish, recording their results.
+
+        Tasks which haven't finished after ``timeout`` seconds, such as the ones whose results expired or which the
+        instance doesn't know about, are recorded as failed.
+
+        :param queued: The journal entries of the queued files.
+        :param progress: A function called with the number of files processed every time some tasks finish.
+        :param interval: The time in seconds to wait between two checks.
+        :param page_size: The number of tasks to check in a single request.
+        :param timeout: The time in seconds to wait at most for all the tasks to finish.
+        """
+        pending = {entry.task_id: entry for entry in queued}
+        deadline = time.monotonic() + timeout
+        while pending:
+            if time.monotonic() >= deadline:
+                log.info(f"Gave up waiting for {len(pending)} tasks")
+                for entry in pending.values():
+                    self.journal.append(entry.copy(update={"status": "failed"}))
+                progress(len(pending))
+                return
+            task_ids = list(pending.keys())
+            for i in range(0, len(task_ids), page_size):
+                r = self.retry(lambda: self.session.get(
+                    self.instance.absolute("/files/tasks/"),
+                    params={
+                        "task_ids": task_ids[i:i + page_size],
+                    },
+                    headers=self.headers,
+                ))
+                if r.status_code >= 400:
+                    raise click.ClickException(f"Could not check the status of the uploaded files: "
+                                               f"HTTP {r.status_code}")
+                for status in r.json():
+                    if not status["ready"]:
+                        continue
+                    entry = pending.pop(status["id"])
+                    self.journal.append(entry.copy(update={
+                        "status": "processed" if status["state"] == "SUCCESS" else "failed",
+                    }))
+                    progress(1)
+            if pending:
+                time.sleep(interval)
+
+
+# Objects exported by this module
+__all__ = (
+    "JournalEntry",
+    "UploadJournal",
+    "BulkUploader",
+)
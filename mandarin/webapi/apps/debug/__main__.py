@@ -1,12 +1,16 @@
+import asyncio
+import concurrent.futures
+
 import fastapi as f
 import fastapi.middleware.cors as cors
 import pkg_resources
 import uvicorn
 
 from mandarin import database
-from mandarin.config import lazy_config
+from mandarin.config import lazy_config, config_get
 from .description import description
 from ...routes import *
+from ...utils import OffloadEmulationMiddleware, NEXT_CURSOR_HEADER
 
 app = f.FastAPI(
     debug=True,
@@ -25,13 +29,27 @@ app.include_router(router_albums, prefix="/albums", tags=["Albums"])
 app.include_router(router_genres, prefix="/genres", tags=["Genres"])
 app.include_router(router_people, prefix="/people", tags=["People"])
 app.include_router(router_auditlogs, prefix="/audit-logs", tags=["Audit Logs"])
+app.include_router(router_stats, prefix="/stats", tags=["Statistics"])
 app.add_middleware(
     cors.CORSMiddleware,
     allow_origins=["http://127.0.0.1:30009"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+
+
+@app.on_event("startup")
+async def set_threadpool_size():
+    # Sync routes and dependencies run in the default executor, whose size caps the number of concurrent requests
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=config_get("apps.debug.threads", 64))
+    )
+
+
+if config_get("storage.music.offload.emulate", False):
+    app.add_middleware(OffloadEmulationMiddleware)
 database.utils.create_all()
 
 
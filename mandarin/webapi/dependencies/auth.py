@@ -1,17 +1,28 @@
-import expiringdict
+import collections
+import hashlib
+import json
+import logging
+import threading
+
 import fastapi as f
 import fastapi.openapi.models as fom
 import fastapi.security.base as fsb
 import fastapi.security.utils as fsu
+import jose.exceptions
 import requests
 import royalnet.lazy as l
 import sqlalchemy.orm
+import starlette.concurrency
 from royalnet.typing import *
 
 from mandarin.config import *
 from mandarin.database.tables import *
 from .db import *
 from ..utils.loginsession import LoginSession
+from ..utils.jwks import JWKSCache
+from ..utils.userinfocache import make_user_info_cache, token_key, token_ttl
+
+log = logging.getLogger(__name__)
 
 
 class LazyAuthorizationCodeBearer(fsb.SecurityBase):
@@ -53,40 +64,204 @@ class LazyAuthorizationCodeBearer(fsb.SecurityBase):
         ))
 
 
-# TODO: is max_len mandatory?
-USER_INFO_CACHE = expiringdict.ExpiringDict(max_len=100, max_age_seconds=60 * 60 * 24)
+lazy_user_info_cache = l.Lazy(make_user_info_cache)
+"""
+The uninitialized :class:`.UserInfoCache` of the web API.
+"""
+
+USER_INFO_CLAIMS = {"sub", "name", "nickname", "picture", "email", "email_verified", "updated_at"}
+"""
+The claims required to create a :class:`~mandarin.database.tables.User`.
+"""
+
+KNOWN_USERS: "collections.OrderedDict[str, Tuple[int, str]]" = collections.OrderedDict()
+"""
+A map from the subjects of the users who recently logged in to the id of their :class:`~mandarin.database.tables.User`
+and to the :func:`.claims_fingerprint` of their info when it was last synced, in least recently used order.
+"""
+
+KNOWN_USERS_MAX_LEN = 10000
+"""
+The maximum number of users in :data:`.KNOWN_USERS`; the least recently used ones are forgotten first.
+"""
+
+known_users_lock = threading.Lock()
+
+lazy_jwks = l.Lazy(lambda c: JWKSCache(url=c["auth.jwks"]), c=lazy_config)
+"""
+The uninitialized :class:`.JWKSCache` of the IDP.
+"""
+
+
+def get_user_info(token: str) -> JSON:
+    """
+    Get the info of the user owning a token from the ``/userinfo`` endpoint of the IDP.
+
+    :param token: The access token of the user.
+    :return: The user info.
+    :raises fastapi.HTTPException: If the IDP refused the token.
+    """
+    r = requests.get(lazy_config.e["auth.userinfo"], headers={
+        "Authorization": f"Bearer {token}"
+    }, timeout=10)
+    if r.status_code >= 400:
+        raise f.HTTPException(401, "Invalid access token", headers={"WWW-Authenticate": "Bearer"})
+    return r.json()
+
+
+async def run_unless(nonblocking: bool, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a function directly in the event loop if it doesn't block, or in the threadpool otherwise.
+
+    :param nonblocking: Whether the function can be run directly.
+    :param func: The function to run.
+    :return: The value returned by the function.
+    """
+    if nonblocking:
+        return func(*args, **kwargs)
+    return await starlette.concurrency.run_in_threadpool(func, *args, **kwargs)
+
+
+def require_subject(payload: JSON) -> JSON:
+    """
+    Ensure that the claims of a token or a user info identify a user, as users are matched by their ``sub`` claim.
+
+    :param payload: The claims or the user info.
+    :return: The same ``payload``.
+    :raises fastapi.HTTPException: If the ``sub`` claim is missing or isn't a non-empty string.
+    """
+    subject = payload.get("sub")
+    if not isinstance(subject, str) or not subject:
+        log.debug("Rejecting access token without a subject")
+        raise f.HTTPException(401, "Invalid access token", headers={"WWW-Authenticate": "Bearer"})
+    return payload
+
+
+async def cached_user_info(key: str, token: str) -> JSON:
+    """
+    Get the user info of a token from the :class:`.UserInfoCache`, asking ``/userinfo`` for it if it isn't cached.
+
+    :param key: The key the user info is cached with.
+    :param token: The access token of the user.
+    :return: The user info.
+    :raises fastapi.HTTPException: If the IDP refused the token.
+    """
+    cache = lazy_user_info_cache.e
+    user_info = await run_unless(not cache.blocking, cache.get, key)
+    if user_info is None:
+        user_info = await starlette.concurrency.run_in_threadpool(get_user_info, token)
+        await run_unless(not cache.blocking, cache.set, key, user_info, ttl=token_ttl(token, max_age=cache.max_age))
+    return user_info
+
+
+async def verify_access_token(token: str) -> JSON:
+    """
+    Verify an access token locally against the :class:`.JWKSCache` of the IDP, asking ``/userinfo`` for the user
+    info only if the token doesn't contain all the required claims.
+
+    The user info is cached by subject, so that it isn't requested again when the user refreshes their token.
+
+    :param token: The access token to verify, which must be a JWT.
+    :return: The user info.
+    :raises fastapi.HTTPException: If the token is invalid.
+    """
+    jwks = lazy_jwks.e
+    audience = lazy_config.e["auth.audience"]
+    issuer = config_get("auth.issuer")
+    try:
+        # If the key is already cached, verify the token in the event loop without ever touching the lock of the key
+        # set, which may be held by a thread downloading it
+        key = jwks.cached(token)
+        if key is not None:
+            claims = jwks.decode(token, key, audience=audience, issuer=issuer)
+        else:
+            claims = await starlette.concurrency.run_in_threadpool(jwks.verify, token, audience=audience,
+                                                                   issuer=issuer)
+    except jose.exceptions.JWTError as e:
+        log.debug(f"Rejecting access token: {e!r}")
+        raise f.HTTPException(401, "Invalid access token", headers={"WWW-Authenticate": "Bearer"})
+    except requests.RequestException as e:
+        log.error(f"Could not download the JWKS: {e!r}")
+        raise f.HTTPException(503, "Could not verify the access token")
 
+    require_subject(claims)
+    if USER_INFO_CLAIMS.issubset(claims.keys()):
+        return {key: claims[key] for key in USER_INFO_CLAIMS}
 
-def dependency_access_token(
+    return await cached_user_info(key=f"sub:{claims['sub']}", token=token)
+
+
+async def dependency_access_token(
         token: str = f.Security(LazyAuthorizationCodeBearer(lazy_config=lazy_config))
 ) -> JSON:
-    if token not in USER_INFO_CACHE:
-        user_info = requests.get(lazy_config.e["auth.userinfo"], headers={
-            "Authorization": f"Bearer {token}"
-        }).json()
-        USER_INFO_CACHE[token] = user_info
+    # This runs in the event loop, so that requests whose user info is already known don't take a thread:
+    # only blocking calls are sent to the threadpool
+    if config_get("auth.verification", "userinfo") == "jwks":
+        return require_subject(await verify_access_token(token))
+    return require_subject(await cached_user_info(key=token_key(token), token=token))
+
+
+def claims_fingerprint(payload: JSON) -> str:
+    """
+    :return: A fingerprint of the claims of a user info that are stored in the :class:`~mandarin.database.tables.User`
+             table, which changes only if any of them changes.
+    """
+    claims = {key: payload.get(key) for key in USER_INFO_CLAIMS}
+    return hashlib.sha256(json.dumps(claims, sort_keys=True).encode()).hexdigest()
+
+
+def sync_user(session: sqlalchemy.orm.session.Session, payload: JSON) -> User:
+    """
+    Create or update the :class:`~mandarin.database.tables.User` matching a user info, committing only if anything
+    changed.
+
+    :param session: The :class:`~sqlalchemy.orm.session.Session` to use.
+    :param payload: The user info.
+    :return: The synced user.
+    """
+    # Optional claims omitted by the IDP are left as they are, or empty for new users
+    claims = {key: payload[key] for key in USER_INFO_CLAIMS if key in payload}
+    user = session.query(User).filter_by(sub=claims["sub"]).one_or_none()
+    if user is None:
+        user = User(**{**{key: "" for key in USER_INFO_CLAIMS}, **claims})
+        session.add(user)
     else:
-        user_info = USER_INFO_CACHE[token]
-    return user_info
+        for key, value in claims.items():
+            if getattr(user, key) != value:
+                setattr(user, key, value)
+    if session.new or session.dirty:
+        log.debug(f"Syncing user: {claims['sub']!r}")
+        session.commit()
+    return user
 
 
 def dependency_login_session(
     session: sqlalchemy.orm.session.Session = f.Depends(dependency_db_session),
     payload: JSON = f.Depends(dependency_access_token)
 ) -> LoginSession:
-    user = session.query(User).filter_by(sub=payload["sub"]).one_or_none()
-    if user is None:
-        user = User(**payload)
-        session.add(user)
-    else:
-        for key, value in payload.items():
-            user.__setattr__(key, value)
-    session.commit()
+    # Skip the sync if the user info didn't change since it was last synced by this process
+    fingerprint = claims_fingerprint(payload)
+    with known_users_lock:
+        known = KNOWN_USERS.get(payload["sub"])
+        if known is not None:
+            KNOWN_USERS.move_to_end(payload["sub"])
+    if known is not None and known[1] == fingerprint:
+        user = session.query(User).get(known[0])
+        if user is not None:
+            return LoginSession(user=user, session=session)
+
+    user = sync_user(session=session, payload=payload)
+    with known_users_lock:
+        KNOWN_USERS[payload["sub"]] = (user.id, fingerprint)
+        KNOWN_USERS.move_to_end(payload["sub"])
+        while len(KNOWN_USERS) > KNOWN_USERS_MAX_LEN:
+            KNOWN_USERS.popitem(last=False)
     return LoginSession(user=user, session=session)
 
 
 __all__ = (
     "LazyAuthorizationCodeBearer",
+    "lazy_user_info_cache",
     "dependency_access_token",
     "LoginSession",
     "dependency_login_session",
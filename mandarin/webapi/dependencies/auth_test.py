@@ -0,0 +1,16 @@
+import fastapi
+import pytest
+
+from .auth import require_subject
+
+
+def test_require_subject():
+    payload = {"sub": "user", "name": "User"}
+    assert require_subject(payload) is payload
+
+
+@pytest.mark.parametrize("payload", [{}, {"sub": ""}, {"sub": None}, {"sub": 42}])
+def test_require_subject_missing(payload):
+    with pytest.raises(fastapi.HTTPException) as info:
+        require_subject(payload)
+    assert info.value.status_code == 401
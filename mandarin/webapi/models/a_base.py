@@ -5,7 +5,10 @@ This allows for quick changes to the configuration of *all* Mandarin models.
 """
 
 from royalnet.typing import *
+import functools
 import pydantic
+import sqlalchemy
+import sqlalchemy.orm
 
 
 class MandarinModel(pydantic.BaseModel):
@@ -37,6 +40,42 @@ class OrmModel(MandarinModel):
         """
         orm_mode = True
 
+    @classmethod
+    @functools.lru_cache()
+    def loader_options(cls, table: type, depth: int = 4) -> Tuple[sqlalchemy.orm.Load, ...]:
+        """
+        Get the :mod:`sqlalchemy` loader options that eagerly load every relationship of ``table`` this model
+        serializes, so that it can be created with :meth:`.from_orm` without lazily loading them one row at a time.
+
+        The options are derived from the fields of the model whose name is a relationship of the table:
+        collections are loaded with :func:`sqlalchemy.orm.selectinload`, single objects with
+        :func:`sqlalchemy.orm.joinedload`, and the fields which are :class:`.OrmModel` themselves are followed
+        recursively; models may override this method to load their relationships differently.
+
+        :param table: The table the model is created from.
+        :param depth: How many relationships should be followed at most, as recursive models such as
+                      :class:`.GenreTree` would otherwise never stop.
+        :return: A :class:`tuple` of loader options, to be passed to :meth:`sqlalchemy.orm.Query.options`.
+        """
+        if depth <= 0:
+            return ()
+
+        relationships = sqlalchemy.inspect(table).relationships
+        options = []
+        for field in cls.__fields__.values():
+            if field.name not in relationships:
+                continue
+            relationship = relationships[field.name]
+            attribute = getattr(table, field.name)
+            option = sqlalchemy.orm.selectinload(attribute) if relationship.uselist else \
+                sqlalchemy.orm.joinedload(attribute)
+            if isinstance(field.type_, type) and issubclass(field.type_, OrmModel):
+                suboptions = field.type_.loader_options(relationship.mapper.class_, depth - 1)
+                if suboptions:
+                    option = option.options(*suboptions)
+            options.append(option)
+        return tuple(options)
+
 
 __all__ = (
     "MandarinModel",
@@ -0,0 +1,80 @@
+import pytest
+from mandarin.testing.fixtures import *
+from mandarin.database import tables
+from mandarin.webapi.utils import LoginSession
+
+from .. import models
+
+
+@pytest.fixture
+def catalog(recreate_db, session):
+    """
+    Fill the database with an album of a few songs, each with its own layers, involvements and genres, so that lazily
+    loading their relationships would exceed the query budgets.
+    """
+    root = tables.Genre(id=0, name="Root")
+    rock = tables.Genre(name="Rock", supergenre=root)
+    metal = tables.Genre(name="Metal", supergenre=rock)
+    person = tables.Person(name="Steffo")
+    role = tables.Role(name="Composer")
+    album = tables.Album(title="Noise", genres=[rock])
+    session.add(tables.AlbumInvolvement(person=person, album=album, role=role))
+    for number in range(1, 6):
+        song = tables.Song(title=f"Song {number}", track=number, album=album, genres=[rock, metal])
+        session.add(tables.SongInvolvement(person=person, song=song, role=role))
+        for name in ("Default", "Instrumental"):
+            session.add(tables.Layer(name=name, song=song))
+    session.add(tables.User(sub="test", name="Test", nickname="test", picture="", email="test@example.org",
+                            email_verified="true", updated_at=""))
+    session.commit()
+    root.supergenre_id = None
+    session.commit()
+    session.expunge_all()
+
+
+@pytest.fixture
+def ls(catalog, session) -> LoginSession:
+    return LoginSession(user=session.query(tables.User).one(), session=session)
+
+
+def serialize(ls: LoginSession, model, table, id_):
+    """
+    Get an item like the endpoints returning a single item do, and serialize it with the model they respond with.
+    """
+    return model.from_orm(ls.get(table, id_, options=model.loader_options(table)))
+
+
+def test_get_album(ls, query_budget):
+    with query_budget(7):
+        album = serialize(ls, models.AlbumWithLayers, tables.Album, 1)
+    assert len(album.songs) == 5
+    assert all(len(song.layers) == 2 for song in album.songs)
+    assert all(song.involvements[0].person.name == "Steffo" for song in album.songs)
+
+
+def test_get_song(ls, query_budget):
+    with query_budget(4):
+        song = serialize(ls, models.SongOutput, tables.Song, 1)
+    assert song.album.title == "Noise"
+    assert len(song.genres) == 2
+
+
+def test_get_person(ls, query_budget):
+    with query_budget(3):
+        person = serialize(ls, models.PersonOutput, tables.Person, 1)
+    assert len(person.song_involvements) == 5
+    assert all(involvement.role.name == "Composer" for involvement in person.song_involvements)
+
+
+def test_get_genre(ls, query_budget):
+    with query_budget(6):
+        genre = serialize(ls, models.GenreOutput, tables.Genre, 0)
+    assert genre.subgenres[0].subgenres[0].name == "Metal"
+
+
+def test_get_layers(ls, query_budget):
+    with query_budget(2):
+        query = ls.session.query(tables.Layer).options(*models.LayerOutput.loader_options(tables.Layer))
+        page = [models.LayerOutput.from_orm(layer) for layer in query.all()]
+    assert len(page) == 10
+    assert all(layer.song is not None for layer in page)
@@ -4,6 +4,8 @@ Extra models are :class:`.MandarinModel`\\ s which represent data not contained
 
 import enum
 
+from royalnet.typing import *
+
 from . import a_base as base
 
 
@@ -17,6 +19,47 @@ class AuthConfig(base.MandarinModel):
     jwks: str
 
 
+class CacheStats(base.MandarinModel):
+    backend: str
+    hits: int
+    misses: int
+    size: int
+
+
+class InstanceStats(base.MandarinModel):
+    songs: int
+    albums: int
+    layers: int
+    encodings: int
+    genres: int
+    people: int
+    roles: int
+    users: int
+    bytes: int
+    orphaned_layers: int
+    orphaned_encodings: int
+
+
+class TransactionStats(base.MandarinModel):
+    transactions: int
+    retries: int
+    failures: int
+
+
+class ThesaurusImport(base.MandarinModel):
+    ids: Dict[str, int]
+    created: List[str]
+
+
+class TaskStatus(base.MandarinModel):
+    id: str
+    state: str
+    ready: bool
+    encoding_id: Optional[int]
+    layer_id: Optional[int]
+    error: Optional[str]
+
+
 class SearchableElementType(str, enum.Enum):
     albums = "albums"
     genres = "genres"
@@ -33,6 +76,11 @@ class ThesaurusableElementType(str, enum.Enum):
 
 __all__ = (
     "AuthConfig",
+    "CacheStats",
+    "InstanceStats",
+    "TransactionStats",
+    "ThesaurusImport",
+    "TaskStatus",
     "SearchableElementType",
     "ThesaurusableElementType",
 )
@@ -1,5 +1,5 @@
 celery_timeout = {
-    202: {"description": "Task queued, but didn't finish in less than 5 seconds"}
+    202: {"description": "Task queued, but didn't finish in less than 15 seconds; its id is returned in the detail"}
 }
 
 login_error = {
@@ -8,4 +8,5 @@ from .layers import *
 from .people import *
 from .search import *
 from .songs import *
+from .stats import *
 from .version import *
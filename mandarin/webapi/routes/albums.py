@@ -3,11 +3,12 @@ from royalnet.typing import *
 import fastapi as f
 import sqlalchemy.orm
 
-from ...database import tables
+from ...database import tables, any_of, link_all, merge_rows, run_transaction
 from ...taskbus import tasks
 from .. import models
 from .. import dependencies
 from .. import responses
+from .. import utils
 
 router_albums = f.APIRouter()
 
@@ -21,17 +22,24 @@ router_albums = f.APIRouter()
     response_model=List[models.Album]
 )
 def get_all(
+    response: f.Response,
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     limit: int = f.Query(500, description="The number of objects that will be returned.", ge=0, le=500),
-    offset: int = f.Query(0, description="The starting object from which the others will be returned.", ge=0),
+    after: Optional[str] = f.Query(None, description="The cursor of the page to return, as received in the "
+                                                     "`X-Next-Cursor` header of the previous page."),
+    offset: int = f.Query(0, description="The number of objects to skip after the cursor. Slow on later pages, "
+                                         "use `after` instead.", ge=0, deprecated=True),
 ):
     """
-    Get an array of all the albums currently in the database, in pages of `limit` elements and starting at the
-    element number `offset`.
+    Get an array of all the albums currently in the database, in pages of `limit` elements.
+
+    If there are more albums, the cursor of the next page is returned in the `X-Next-Cursor` header: pass it as
+    `after` to get the next page.
 
     To avoid denial of service attacks, `limit` cannot be greater than 500.
     """
-    return ls.session.query(tables.Album).order_by(tables.Album.id).limit(limit).offset(offset).all()
+    return utils.paginate(ls.session.query(tables.Album), response=response, columns=[tables.Album.id], limit=limit,
+                          after=after, offset=offset)
 
 
 @router_albums.post(
@@ -50,11 +58,11 @@ def create(
     Create a new, **empty** album with the data specified in the body of the request.
     """
     album = tables.Album(**data.__dict__)
-    ls.session.add(data)
+    ls.session.add(album)
     ls.session.commit()
     ls.log("album.create", obj=album.id)
     ls.session.commit()
-    return album
+    return ls.reload(album, options=models.AlbumOutput.loader_options(tables.Album))
 
 
 @router_albums.get(
@@ -63,14 +71,19 @@ def create(
     response_model=int,
 )
 def count(
-    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session)
+    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session),
+    exact: bool = f.Query(False, description="Whether the albums should be counted exactly, instead of estimating "
+                                             "their number if there are many of them."),
 ):
     """
     Get the total number of albums.
 
     Since it doesn't require any login, it can be useful to display some information on an "instance preview" page.
+
+    If there are many albums, their number is estimated from the statistics of the database, unless `exact` is set;
+    either way, it is cached for a while, so it may be slightly out of date.
     """
-    return session.query(tables.Album).count()
+    return utils.lazy_count_cache.e.count(session, tables.Album, exact=exact)
 
 
 @router_albums.patch(
@@ -101,9 +114,11 @@ def edit_multiple_involve(
     """
     role = ls.get(tables.Role, role_id)
     person = ls.get(tables.Person, person_id)
-    for album in ls.group(tables.Album, album_ids):
-        tables.AlbumInvolvement.make(session=ls.session, role=role, album=album, person=person)
-        ls.log("album.edit.multiple.involve", obj=album.id)
+    ls.session.execute(link_all(
+        tables.AlbumInvolvement.__table__, tables.AlbumInvolvement.album_id, tables.Album, album_ids,
+        person_id=person.id, role_id=role.id,
+    ))
+    ls.log_group("album.edit.multiple.involve", tables.Album, album_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -134,9 +149,12 @@ def edit_multiple_uninvolve(
     """
     role = ls.get(tables.Role, role_id)
     person = ls.get(tables.Person, person_id)
-    for song in ls.group(tables.Album, album_ids):
-        tables.AlbumInvolvement.unmake(session=ls.session, role=role, song=song, person=person)
-        ls.log("album.edit.multiple.uninvolve", obj=song.id)
+    ls.session.query(tables.AlbumInvolvement).filter(
+        tables.AlbumInvolvement.person_id == person.id,
+        tables.AlbumInvolvement.role_id == role.id,
+        any_of(tables.AlbumInvolvement.album_id, album_ids),
+    ).delete(synchronize_session=False)
+    ls.log_group("album.edit.multiple.uninvolve", tables.Album, album_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -162,9 +180,11 @@ def edit_multiple_classify(
     non-existing genre.
     """
     genre = ls.get(tables.Genre, genre_id)
-    for album in ls.group(tables.Album, album_ids):
-        album.genres.append(genre)
-        ls.log("album.edit.multiple.classify", obj=album.id)
+    ls.session.execute(link_all(
+        tables.albumgenres, tables.albumgenres.c.album_id, tables.Album, album_ids,
+        genre_id=genre.id,
+    ))
+    ls.log_group("album.edit.multiple.classify", tables.Album, album_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -190,9 +210,11 @@ def edit_multiple_declassify(
     non-existing genre.
     """
     genre = ls.get(tables.Genre, genre_id)
-    for album in ls.group(tables.Album, album_ids):
-        album.genres.remove(genre)
-        ls.log("album.edit.multiple.declassify", obj=album.id)
+    ls.session.execute(tables.albumgenres.delete().where(sqlalchemy.and_(
+        tables.albumgenres.c.genre_id == genre.id,
+        any_of(tables.albumgenres.c.album_id, album_ids),
+    )))
+    ls.log_group("album.edit.multiple.declassify", tables.Album, album_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -203,40 +225,32 @@ def edit_multiple_declassify(
     status_code=204,
     responses={
         **responses.login_error,
-        400: {"description": "Not enough albums specified"}
+        400: {"description": "Not enough albums specified"},
+        404: {"description": "Album not found"},
     },
 )
 def merge(
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
-    ss: sqlalchemy.orm.Session = f.Depends(dependencies.dependency_db_session_serializable),
     album_ids: List[int] = f.Query(..., description="The ids of the albums to merge."),
 ):
     """
-    Move the songs of all the specified albums into a single one, which will have the metadata of the first album
-    specified.
+    Move the songs, the involvements and the genres of all the specified albums into a single one, which will have
+    the metadata of the first album specified, then delete the other albums.
     """
 
     if len(album_ids) < 2:
         raise f.HTTPException(400, "Not enough albums specified")
 
-    # Get the first album
-    main_album = ss.query(tables.Album).get(album_ids[0])
-    ls.log("album.merge.to", obj=main_album.id)
+    main_id, other_ids = album_ids[0], album_ids[1:]
 
-    # Get the other albums
-    other_albums = ss.query(tables.Album).filter(tables.Album.id.in_(album_ids[1:])).all()
+    def merge_albums(session: sqlalchemy.orm.Session) -> None:
+        if session.query(tables.Album).get(main_id) is None:
+            raise f.HTTPException(404, f"The id '{main_id}' does not match any Album.")
+        ls.log_group("album.merge.to", tables.Album, [main_id], session=session)
+        ls.log_group("album.merge.from", tables.Album, other_ids, session=session)
+        merge_rows(session, tables.Album, main_id, other_ids)
 
-    # Replace and delete the other albums
-    for merged_album in other_albums:
-        for song in merged_album.songs:
-            song.album = main_album
-        ls.log("album.merge.from", obj=merged_album.id)
-        ss.delete(merged_album)
-
-    ss.commit()
-    ss.close()
-
-    ls.session.commit()
+    run_transaction(merge_albums)
     return f.Response(status_code=204)
 
 
@@ -256,7 +270,7 @@ def get_single(
     """
     Get full information for the album with the specified `album_id`.
     """
-    return ls.get(tables.Album, album_id)
+    return ls.get(tables.Album, album_id, options=models.AlbumWithLayers.loader_options(tables.Album))
 
 
 @router_albums.put(
@@ -280,7 +294,7 @@ def edit_single(
     album.update(**data.__dict__)
     ls.log("album.edit.single", obj=album.id)
     ls.session.commit()
-    return album
+    return ls.reload(album, options=models.AlbumOutput.loader_options(tables.Album))
 
 
 @router_albums.delete(
@@ -7,16 +7,22 @@ from ...taskbus import tasks
 from .. import models
 from .. import dependencies
 from .. import responses
+from .. import utils
 
 router_auditlogs = f.APIRouter()
 
 
-def ordered(query, column, order: models.enums.TimestampOrdering):
-    if order is models.enums.TimestampOrdering.OLDEST_FIRST:
-        query = query.order_by(column)
-    elif order is models.enums.TimestampOrdering.LATEST_FIRST:
-        query = query.order_by(column.desc())
-    return query
+def paginated(query, response: f.Response, order: models.enums.TimestampOrdering, limit: int, after: Optional[str],
+              offset: int):
+    return utils.paginate(
+        query.options(*models.AuditLogOutput.loader_options(tables.AuditLog)),
+        response=response,
+        columns=[tables.AuditLog.timestamp, tables.AuditLog.id],
+        limit=limit,
+        after=after,
+        offset=offset,
+        descending=order is models.enums.TimestampOrdering.LATEST_FIRST,
+    )
 
 
 @router_auditlogs.get(
@@ -28,19 +34,26 @@ def ordered(query, column, order: models.enums.TimestampOrdering):
     response_model=List[models.AuditLogOutput]
 )
 def get(
+    response: f.Response,
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     limit: int = f.Query(500, description="The number of objects that will be returned.", ge=0, le=500),
-    offset: int = f.Query(0, description="The starting object from which the others will be returned.", ge=0),
+    after: Optional[str] = f.Query(None, description="The cursor of the page to return, as received in the "
+                                                     "`X-Next-Cursor` header of the previous page."),
+    offset: int = f.Query(0, description="The number of objects to skip after the cursor. Slow on later pages, "
+                                         "use `after` instead.", ge=0, deprecated=True),
     order: models.enums.TimestampOrdering = f.Query(models.enums.TimestampOrdering.ANY,
                                                     description="The order you want the objects to be returned in."),
 ):
     """
-    Get an array of all audit logs currently in the database, in pages of `limit` elements and starting at the 
-    element number `offset`.
+    Get an array of all audit logs currently in the database, in pages of `limit` elements.
+
+    If there are more audit logs, the cursor of the next page is returned in the `X-Next-Cursor` header: pass it as
+    `after` to get the next page.
 
     To avoid denial of service attacks, `limit` cannot be greater than 500.
     """
-    return ordered(ls.session.query(tables.AuditLog), tables.AuditLog.timestamp, order=order).limit(limit).offset(offset).all()
+    return paginated(ls.session.query(tables.AuditLog), response=response, order=order, limit=limit, after=after,
+                     offset=offset)
 
 
 @router_auditlogs.get(
@@ -52,24 +65,28 @@ def get(
     response_model=List[models.AuditLogOutput]
 )
 def get_by_user(
+    response: f.Response,
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     user_id: int = f.Path(..., description="The id of the user to get audit logs about."),
     limit: int = f.Query(500, description="The number of objects that will be returned.", ge=0),
-    offset: int = f.Query(0, description="The starting object from which the others will be returned.", ge=0),
+    after: Optional[str] = f.Query(None, description="The cursor of the page to return, as received in the "
+                                                     "`X-Next-Cursor` header of the previous page."),
+    offset: int = f.Query(0, description="The number of objects to skip after the cursor. Slow on later pages, "
+                                         "use `after` instead.", ge=0, deprecated=True),
     order: models.enums.TimestampOrdering = f.Query(models.enums.TimestampOrdering.ANY,
                                                     description="The order you want the objects to be returned in."),
 ):
     """
-    Get an array of the audit logs in which the specified user is involved, in pages of `limit` elements and
-    starting at the element number `offset`.
+    Get an array of the audit logs in which the specified user is involved, in pages of `limit` elements.
+
+    If there are more audit logs, the cursor of the next page is returned in the `X-Next-Cursor` header: pass it as
+    `after` to get the next page.
 
     To avoid denial of service attacks, `limit` cannot be greater than 500.
     """
     user = ls.get(tables.User, user_id)
-    return (
-        ordered(ls.session.query(tables.AuditLog).filter_by(user=user), tables.AuditLog.timestamp, order=order)
-        .limit(limit).offset(offset).all()
-    )
+    return paginated(ls.session.query(tables.AuditLog).filter_by(user=user), response=response, order=order,
+                     limit=limit, after=after, offset=offset)
 
 
 @router_auditlogs.get(
@@ -81,24 +98,28 @@ def get_by_user(
     response_model=List[models.AuditLogOutput]
 )
 def get_by_action(
+    response: f.Response,
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     action: str = f.Path(..., description="The action to get audit logs about. Uses SQL 'like' syntax. Case "
                                           "insensitive."),
     limit: int = f.Query(500, description="The number of objects that will be returned.", ge=0),
-    offset: int = f.Query(0, description="The starting object from which the others will be returned.", ge=0),
+    after: Optional[str] = f.Query(None, description="The cursor of the page to return, as received in the "
+                                                     "`X-Next-Cursor` header of the previous page."),
+    offset: int = f.Query(0, description="The number of objects to skip after the cursor. Slow on later pages, "
+                                         "use `after` instead.", ge=0, deprecated=True),
     order: models.enums.TimestampOrdering = f.Query(models.enums.TimestampOrdering.ANY,
                                                     description="The order you want the objects to be returned in."),
 ):
     """
-    Get an array of the audit logs that match the passed `action` pattern, in pages of `limit` elements and
-    starting at the element number `offset`.
+    Get an array of the audit logs that match the passed `action` pattern, in pages of `limit` elements.
+
+    If there are more audit logs, the cursor of the next page is returned in the `X-Next-Cursor` header: pass it as
+    `after` to get the next page.
 
     To avoid denial of service attacks, `limit` cannot be greater than 500.
     """
-    return (
-        ordered(ls.session.query(tables.AuditLog).filter(tables.AuditLog.action.ilike(action)), tables.AuditLog.timestamp, order=order)
-        .limit(limit).offset(offset).all()
-    )
+    return paginated(ls.session.query(tables.AuditLog).filter(tables.AuditLog.action.ilike(action)),
+                     response=response, order=order, limit=limit, after=after, offset=offset)
 
 
 __all__ = (
@@ -3,7 +3,8 @@ from __future__ import annotations
 import fastapi as f
 
 from .. import dependencies
-from ...database import create_all, Base, lazy_engine
+from .. import models
+from ...database import create_all, Base, lazy_engine, transaction_stats
 
 router_debug = f.APIRouter()
 
@@ -26,6 +27,43 @@ def database_reset(
     return f.Response(status_code=204)
 
 
+@router_debug.get(
+    "/cache/userinfo",
+    summary="Get the statistics of the user info cache.",
+    response_model=models.CacheStats,
+)
+def cache_userinfo(
+        ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+):
+    """
+    Get the backend of the cache of the user info returned by the OAuth2 IDP, the number of hits and misses it had and
+    the number of values it currently contains.
+
+    With the `memory` backend, the statistics are the ones of the process that handled the request.
+    """
+    cache = dependencies.lazy_user_info_cache.e
+    hits, misses, size = cache.stats()
+    return models.CacheStats(backend=cache.name, hits=hits, misses=misses, size=size)
+
+
+@router_debug.get(
+    "/transactions",
+    summary="Get the statistics of the retried database transactions.",
+    response_model=models.TransactionStats,
+)
+def transactions(
+        ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+):
+    """
+    Get the number of transactions run with automatic retries, such as merges, the number of times they had to be
+    retried because they conflicted with concurrent ones, and the number of them which failed even after being retried.
+
+    The statistics are the ones of the process that handled the request.
+    """
+    count, retries, failures = transaction_stats.stats()
+    return models.TransactionStats(transactions=count, retries=retries, failures=failures)
+
+
 __all__ = (
     "router_debug",
 )
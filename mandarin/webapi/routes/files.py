@@ -1,10 +1,18 @@
 from __future__ import annotations
 
-import io
+import asyncio
+import contextlib
+import logging
+import os
+import uuid
 
-import celery.exceptions
+import celery
+import celery.result
+import celery.states
 import fastapi as f
 import starlette.responses
+from starlette.concurrency import run_in_threadpool
+from royalnet.typing import *
 
 from .. import dependencies
 from .. import models
@@ -12,9 +20,88 @@ from .. import responses
 from ...database import tables
 from ...taskbus import tasks
 
+log = logging.getLogger(__name__)
 router_files = f.APIRouter()
 
 
+def stage_signature(ls: dependencies.LoginSession, file: f.UploadFile, generate_entries: bool) -> celery.Signature:
+    """
+    Stage an uploaded file and create the signature of the task that will process it.
+
+    :param ls: The :class:`.LoginSession` of the user uploading the file.
+    :param file: The uploaded file.
+    :param generate_entries: Whether entries should be automatically generated for the file.
+    :return: The :class:`celery.Signature` of the task, which still has to be queued.
+    """
+    # Spool the file to the staging directory instead of pickling its contents into the taskbus
+    staged_path, staged_hash = tasks.stage_upload(stream=file.file, original_path=file.filename)
+    log.debug(f"Staged {file.filename!r} at {staged_path} (sha512 {staged_hash.hexdigest()})")
+
+    return tasks.process_staged_music.s(
+        staged_path=str(staged_path),
+        original_filename=file.filename,
+        uploader_id=ls.user.id,
+        generate_entries=generate_entries
+    ).set(task_id=task_id_for(ls))
+
+
+def discard_staged(signatures: Iterable[celery.Signature]) -> None:
+    """
+    Delete the files staged for tasks which couldn't be queued, as no worker will ever process them.
+
+    :param signatures: The signatures of the tasks, as returned by :func:`.stage_signature`.
+    """
+    for signature in signatures:
+        log.debug(f"Discarding staged file: {signature.kwargs['staged_path']}")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(signature.kwargs["staged_path"])
+
+
+def task_id_for(ls: dependencies.LoginSession) -> str:
+    """
+    Create the id of a new task queued by the logged in user, prefixing a random id with the id of the user, so that
+    the user who queued a task can be told from its id alone.
+
+    :param ls: The :class:`.LoginSession` of the user queueing the task.
+    :return: The task id.
+    """
+    return f"{ls.user.id}.{uuid.uuid4()}"
+
+
+def owns_task(ls: dependencies.LoginSession, task_id: str) -> bool:
+    """
+    :return: :data:`True` if the task with the specified id was queued by the logged in user, :data:`False` otherwise.
+    """
+    return task_id.partition(".")[0] == str(ls.user.id)
+
+
+def task_queued(result: celery.result.AsyncResult) -> models.TaskStatus:
+    """
+    Create the :class:`.models.TaskStatus` of a task that has just been queued, without querying the result backend.
+
+    :param result: The result of the queued task.
+    :return: The created :class:`.models.TaskStatus`.
+    """
+    return models.TaskStatus(id=result.id, state=celery.states.PENDING, ready=False)
+
+
+def task_status(result: celery.result.AsyncResult) -> models.TaskStatus:
+    """
+    Convert the :class:`celery.result.AsyncResult` of a processing task to a :class:`.models.TaskStatus`.
+
+    :param result: The result to convert.
+    :return: The created :class:`.models.TaskStatus`.
+    """
+    # Read the state only once, as every access queries the result backend
+    state = result.state
+    status = models.TaskStatus(id=result.id, state=state, ready=state in celery.states.READY_STATES)
+    if state == celery.states.SUCCESS:
+        status.encoding_id, status.layer_id = result.result
+    elif state == celery.states.FAILURE:
+        status.error = repr(result.result)
+    return status
+
+
 @router_files.post(
     "/layer",
     summary="Upload an audio track.",
@@ -25,7 +112,7 @@ router_files = f.APIRouter()
         **responses.login_error,
     }
 )
-def upload_layer(
+async def upload_layer(
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     file: f.UploadFile = f.File(..., description="The file to be uploaded."),
     generate_entries: bool = f.Query(True, description="Automatically generate entries (song, album, people) for the "
@@ -36,26 +123,182 @@ def upload_layer(
 
     **If `generate_entries` is selected, ensure the song has something in the Artist and Album Artist fields, or the
     generation will behave strangely due to a bug.**
+
+    This method waits up to 15 seconds for the task to complete: to upload many files, use `/files/layer/queue`
+    instead.
     """
-    # file.file can't be directly pickled, transfer it to a bytesio object
-    stream = io.BytesIO()
-    while data := file.file.read(8192):
-        stream.write(data)
+    signature = await run_in_threadpool(stage_signature, ls=ls, file=file, generate_entries=generate_entries)
+    try:
+        task = await run_in_threadpool(signature.delay)
+    except Exception:
+        await run_in_threadpool(discard_staged, [signature])
+        raise
+
+    # Poll the task from the event loop instead of blocking a thread while waiting for it
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + 15
+    while not await run_in_threadpool(task.ready):
+        if loop.time() > deadline:
+            raise f.HTTPException(202, {
+                "text": "Task queued, but didn't finish in less than 15 seconds",
+                "task_id": task.id,
+            })
+        await asyncio.sleep(0.25)
+
+    _, layer_id = await run_in_threadpool(task.get)
+    # Load and serialize the layer in the threadpool as well, as it queries the database
+    return await run_in_threadpool(lambda: models.LayerOutput.from_orm(
+        ls.get(tables.Layer, layer_id, options=models.LayerOutput.loader_options(tables.Layer))
+    ))
 
-    task = tasks.process_music.delay(
-        stream=stream,
-        original_filename=file.filename,
-        uploader_id=ls.user.id,
-        generate_entries=generate_entries
-    )
 
+@router_files.post(
+    "/layer/queue",
+    summary="Queue an audio track for upload.",
+    response_model=models.TaskStatus,
+    status_code=202,
+    responses={
+        **responses.login_error,
+    }
+)
+def queue_layer(
+    ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+    file: f.UploadFile = f.File(..., description="The file to be uploaded."),
+    generate_entries: bool = f.Query(True, description="Automatically generate entries (song, album, people) for the "
+                                                       "uploaded file.")
+):
+    """
+    Upload a new track to the database, and start a task to process the uploaded track, returning immediately.
+
+    The status of the task can then be retrieved from `/files/tasks/{task_id}`.
+    """
+    signature = stage_signature(ls=ls, file=file, generate_entries=generate_entries)
     try:
-        _, layer_id = task.get(timeout=15)
-    except celery.exceptions.TimeoutError:
-        raise f.HTTPException(202, "Task queued, but didn't finish in less than 15 seconds")
+        task = signature.delay()
+    except Exception:
+        discard_staged([signature])
+        raise
+    return task_queued(task)
 
-    layer = ls.session.query(tables.Layer).get(layer_id)
-    return layer
+
+@router_files.post(
+    "/layers",
+    summary="Queue many audio tracks for upload.",
+    response_model=List[models.TaskStatus],
+    status_code=202,
+    responses={
+        **responses.login_error,
+    }
+)
+def queue_layers(
+    ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+    files: List[f.UploadFile] = f.File(..., description="The files to be uploaded."),
+    generate_entries: bool = f.Query(True, description="Automatically generate entries (song, album, people) for the "
+                                                       "uploaded files.")
+):
+    """
+    Upload many new tracks to the database in a single request, and start a group of tasks to process them, returning
+    immediately.
+
+    The returned task statuses are in the same order as the uploaded files; they can then be retrieved from
+    `/files/tasks/`.
+    """
+    signatures = []
+    try:
+        for file in files:
+            signatures.append(stage_signature(ls=ls, file=file, generate_entries=generate_entries))
+        results = celery.group(signatures).apply_async().results
+    except Exception:
+        discard_staged(signatures)
+        raise
+    return [task_queued(result) for result in results]
+
+
+@router_files.post(
+    "/probe",
+    summary="Check which files are already stored.",
+    response_model=List[str],
+    responses={
+        **responses.login_error,
+        400: {"description": "Invalid or too many hashes"},
+    }
+)
+def probe(
+    ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+    hashes: List[str] = f.Body(..., description="The hex sha512 hashes of the files to check, calculated on their "
+                                                "contents with the tags stripped."),
+):
+    """
+    Get which of the specified hashes match the contents of an already stored file, so that the files having them
+    don't need to be uploaded again.
+
+    To avoid denial of service attacks, no more than 1000 hashes can be checked at once.
+    """
+    if len(hashes) > 1000:
+        raise f.HTTPException(400, "Too many hashes specified")
+
+    try:
+        digests = [bytes.fromhex(h) for h in hashes]
+    except ValueError:
+        raise f.HTTPException(400, "Invalid hash specified")
+
+    query = ls.session.query(tables.Encoding.digest).filter(tables.Encoding.digest.in_(digests)).distinct()
+    return [digest.hex() for digest, in query.all()]
+
+
+@router_files.get(
+    "/tasks/",
+    summary="Get the status of some processing tasks.",
+    response_model=List[models.TaskStatus],
+    responses={
+        **responses.login_error,
+        400: {"description": "Too many tasks"},
+    }
+)
+def get_tasks(
+    ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+    task_ids: List[str] = f.Query(..., description="The ids of the tasks to get the status of."),
+):
+    """
+    Get the status of all the specified processing tasks, skipping the ones which weren't queued by the logged in
+    user.
+
+    Tasks that don't exist or whose results have expired will be reported as `PENDING`.
+
+    To avoid denial of service attacks, no more than 1000 tasks can be checked at once.
+    """
+    if len(task_ids) > 1000:
+        raise f.HTTPException(400, "Too many tasks specified")
+
+    return [
+        task_status(tasks.process_staged_music.AsyncResult(task_id))
+        for task_id in task_ids
+        if owns_task(ls, task_id)
+    ]
+
+
+@router_files.get(
+    "/tasks/{task_id}",
+    summary="Get the status of a processing task.",
+    response_model=models.TaskStatus,
+    responses={
+        **responses.login_error,
+        404: {"description": "Task not queued by the logged in user"},
+    }
+)
+def get_task(
+    ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+    task_id: str = f.Path(..., description="The id of the task to get the status of."),
+):
+    """
+    Get the status of the processing task with the specified `task_id`, which must have been queued by the logged in
+    user.
+
+    A task that doesn't exist or whose result has expired will be reported as `PENDING`.
+    """
+    if not owns_task(ls, task_id):
+        raise f.HTTPException(404, f"The id '{task_id}' does not match any task queued by you.")
+    return task_status(tasks.process_staged_music.AsyncResult(task_id))
 
 
 __all__ = (
@@ -7,11 +7,28 @@ from royalnet.typing import *
 from .. import dependencies
 from .. import models
 from .. import responses
-from ...database import tables
+from .. import utils
+from ...database import tables, any_of, merge_rows, run_transaction, import_thesaurus
 
 router_genres = f.APIRouter()
 
 
+def check_not_subgenre(session: sqlalchemy.orm.Session, genre_ids: List[int], supergenre_id: Optional[int]) -> None:
+    """
+    Ensure that a genre can become the supergenre of some others, as it isn't one of them or one of their subgenres.
+
+    :raises fastapi.HTTPException: If the genre is one of them or one of their subgenres.
+    """
+    if supergenre_id is None or not genre_ids:
+        return
+    cycle = session.query(sqlalchemy.exists().where(sqlalchemy.and_(
+        tables.GenreClosure.descendant_id == supergenre_id,
+        any_of(tables.GenreClosure.ancestor_id, genre_ids),
+    ))).scalar()
+    if cycle:
+        raise f.HTTPException(400, "A genre can't become a subgenre of itself or of one of its subgenres")
+
+
 @router_genres.get(
     "/",
     summary="Get all genres.",
@@ -21,20 +38,27 @@ router_genres = f.APIRouter()
     response_model=List[models.Genre]
 )
 def get_all(
+    response: f.Response,
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     limit: int = f.Query(500, description="The number of objects that will be returned.", ge=0, le=500),
-    offset: int = f.Query(0, description="The starting object from which the others will be returned.", ge=0),
+    after: Optional[str] = f.Query(None, description="The cursor of the page to return, as received in the "
+                                                     "`X-Next-Cursor` header of the previous page."),
+    offset: int = f.Query(0, description="The number of objects to skip after the cursor. Slow on later pages, "
+                                         "use `after` instead.", ge=0, deprecated=True),
 ):
     """
-    Get an array of all the genres currently in the database, in pages of `limit` elements and starting at the
-    element number `offset`.
+    Get an array of all the genres currently in the database, in pages of `limit` elements.
+
+    If there are more genres, the cursor of the next page is returned in the `X-Next-Cursor` header: pass it as
+    `after` to get the next page.
 
     To avoid denial of service attacks, `limit` cannot be greater than 500.
 
     Note that this method doesn't return any information about parents and children of the genres; to access them,
     you'll have to use the method that GETs the genres one by one.
     """
-    return ls.session.query(tables.Genre).order_by(tables.Genre.id).limit(limit).offset(offset).all()
+    return utils.paginate(ls.session.query(tables.Genre), response=response, columns=[tables.Genre.id], limit=limit,
+                          after=after, offset=offset)
 
 
 @router_genres.post(
@@ -63,7 +87,47 @@ def create(
     genre = tables.Genre.make(session=ls.session, **data.dict())
     ls.log("genre.create", obj=genre.id)
     ls.session.commit()
-    return genre
+    return ls.reload(genre, options=models.GenreOutput.loader_options(tables.Genre))
+
+
+@router_genres.post(
+    "/thesaurus",
+    summary="Import a thesaurus of genres.",
+    responses={
+        **responses.login_error,
+        400: {"description": "Invalid thesaurus"},
+        404: {"description": "Supergenre not found"},
+    },
+    response_model=models.ThesaurusImport,
+)
+def create_thesaurus(
+    ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+    thesaurus: Dict[str, Any] = f.Body(..., description="The thesaurus to import: nested objects, where keys are "
+                                                        "genre names and values are their subgenres.",
+                                       example={"Rock": {"Hard Rock": {}, "Punk Rock": {"Pop Punk": {}}}}),
+    supergenre_id: int = f.Query(0, description="The id of the genre the top level genres should be subgenres of."),
+):
+    """
+    Create all the genres of the thesaurus in the request body with a few bulk statements, resolving their supergenres
+    by name.
+
+    Genres with the same name as an existing genre are left unchanged, but their subgenres are still created inside
+    them.
+
+    Returns the ids of all the genres in the thesaurus, and the names of the ones which were created.
+    """
+    ls.get(tables.Genre, supergenre_id)
+
+    def import_genres(session: sqlalchemy.orm.Session) -> Tuple[Dict[str, int], List[str]]:
+        ids, created = import_thesaurus(session, thesaurus, supergenre_id)
+        ls.log_group("genre.create", tables.Genre, [ids[name] for name in created], session=session)
+        return ids, created
+
+    try:
+        ids, created = run_transaction(import_genres)
+    except ValueError as error:
+        raise f.HTTPException(400, str(error))
+    return models.ThesaurusImport(ids=ids, created=created)
 
 
 @router_genres.get(
@@ -72,14 +136,39 @@ def create(
     response_model=int,
 )
 def count(
-    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session)
+    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session),
+    exact: bool = f.Query(False, description="Whether the genres should be counted exactly, instead of estimating "
+                                             "their number if there are many of them."),
 ):
     """
     Get the total number of genres.
 
     Since it doesn't require any login, it can be useful to display some information on an "instance preview" page.
+
+    If there are many genres, their number is estimated from the statistics of the database, unless `exact` is set;
+    either way, it is cached for a while, so it may be slightly out of date.
     """
-    return session.query(tables.Genre).count()
+    return utils.lazy_count_cache.e.count(session, tables.Genre, exact=exact)
+
+
+@router_genres.get(
+    "/tree",
+    summary="Get the tree of all genres.",
+    responses={
+        **responses.login_error,
+    },
+    response_model=List[models.GenreTree],
+)
+def get_tree(
+    ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
+):
+    """
+    Get all genres, arranged in trees by their supergenre: usually, a single tree starting from the root genre.
+
+    The tree is built with a single query and cached until a genre is edited, so it is much faster than getting all the
+    genres one by one.
+    """
+    return f.Response(content=utils.lazy_genre_tree_cache.e.get(ls.session), media_type="application/json")
 
 
 @router_genres.patch(
@@ -88,44 +177,41 @@ def count(
     status_code=204,
     responses={
         **responses.login_error,
-        400: {"description": "Not enough genres specified"}
+        400: {"description": "Not enough genres specified, or merging a genre into its subgenre"},
+        404: {"description": "Genre not found"},
     },
 )
 def merge(
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
-    ss: sqlalchemy.orm.Session = f.Depends(dependencies.dependency_db_session_serializable),
     genre_ids: List[int] = f.Query(..., description="The ids of the genres to merge."),
 ):
     """
-    Merge the songs and albums of the specified genre into a single one, which will have the metadata of the first
-    genre specified.
+    Merge the songs, the albums and the subgenres of the specified genre into a single one, which will have the
+    metadata of the first genre specified, then delete the other genres.
+
+    The root genre can't be merged into another genre, and a genre can't be merged into one of its subgenres.
     """
 
     if len(genre_ids) < 2:
         raise f.HTTPException(400, "Not enough genres specified")
 
-    # Get the first genre
-    main_genre = ss.query(tables.Genre).get(genre_ids[0])
-    ls.log("genre.merge.to", obj=main_genre.id)
+    main_id, other_ids = genre_ids[0], genre_ids[1:]
+    if 0 in other_ids:
+        raise f.HTTPException(400, "The root genre can't be merged into another genre")
 
-    # Get the other genres
-    other_genres = ss.query(tables.Genre).filter(tables.Genre.id.in_(genre_ids[1:])).all()
+    def merge_genres(session: sqlalchemy.orm.Session) -> None:
+        main_genre = session.query(tables.Genre).get(main_id)
+        if main_genre is None:
+            raise f.HTTPException(404, f"The id '{main_id}' does not match any Genre.")
 
-    # Replace and delete the other genres
-    for merged_genre in other_genres:
-        for song in merged_genre.songs:
-            song.genres.remove(merged_genre)
-            song.genres.append(main_genre)
-        for album in merged_genre.albums:
-            album.genres.remove(merged_genre)
-            album.genres.append(main_genre)
-        ls.log("genre.merge.from", obj=merged_genre.id)
-        ss.delete(merged_genre)
+        # The subgenres of the merged genres become subgenres of the main genre, which mustn't be one of them
+        check_not_subgenre(session, [other_id for other_id in other_ids if other_id != main_id], main_id)
 
-    ss.commit()
-    ss.close()
+        ls.log_group("genre.merge.to", tables.Genre, [main_id], session=session)
+        ls.log_group("genre.merge.from", tables.Genre, other_ids, session=session)
+        merge_rows(session, tables.Genre, main_id, other_ids)
 
-    ls.session.commit()
+    run_transaction(merge_genres)
     return f.Response(status_code=204)
 
 
@@ -135,6 +221,8 @@ def merge(
     status_code=204,
     responses={
         **responses.login_error,
+        400: {"description": "Moving a genre into itself or one of its subgenres"},
+        404: {"description": "Supergenre not found"},
     }
 )
 def edit_multiple_move(
@@ -148,14 +236,16 @@ def edit_multiple_move(
     Non-existing `child_ids` passed to the method will be silently skipped, while a 404 error will be raised for a
     non-existing `parent_id`.
     """
-    if parent_id is None:
-        parent = None
-    else:
-        parent = ls.get(tables.Genre, parent_id)
-    for child in ls.group(tables.Genre, child_ids):
-        child.supergenre = parent
-        ls.log("genre.edit.multiple.group", obj=child.id)
-    ls.session.commit()
+
+    # Concurrent moves could create a cycle that none of them can see, so they are serialized
+    def move_genres(session: sqlalchemy.orm.Session) -> None:
+        if session.query(tables.Genre).get(parent_id) is None:
+            raise f.HTTPException(404, f"The id '{parent_id}' does not match any Genre.")
+        check_not_subgenre(session, child_ids, parent_id)
+        ls.update_group(tables.Genre, child_ids, session=session, supergenre_id=parent_id)
+        ls.log_group("genre.edit.multiple.group", tables.Genre, child_ids, session=session)
+
+    run_transaction(move_genres)
     return f.Response(status_code=204)
 
 
@@ -175,7 +265,7 @@ def get_single(
     """
     Get full information for the genre with the specified `genre_id`.
     """
-    return ls.get(tables.Genre, genre_id)
+    return ls.get(tables.Genre, genre_id, options=models.GenreOutput.loader_options(tables.Genre))
 
 
 @router_genres.put(
@@ -184,6 +274,7 @@ def get_single(
     response_model=models.GenreOutput,
     responses={
         **responses.login_error,
+        400: {"description": "Moving the genre into itself or one of its subgenres"},
         404: {"description": "Genre not found"},
     }
 )
@@ -195,11 +286,18 @@ def edit_single(
     """
     Replace the data of the genre with the specified `genre_id` with the data passed in the request body.
     """
-    genre = ls.get(tables.Genre, genre_id)
-    genre.update(**data.dict())
-    ls.log("genre.edit.single", obj=genre.id)
-    ls.session.commit()
-    return genre
+
+    # Concurrent moves could create a cycle that none of them can see, so they are serialized
+    def edit_genre(session: sqlalchemy.orm.Session) -> None:
+        genre = session.query(tables.Genre).get(genre_id)
+        if genre is None:
+            raise f.HTTPException(404, f"The id '{genre_id}' does not match any Genre.")
+        check_not_subgenre(session, [genre_id], data.supergenre_id)
+        genre.update(**data.dict())
+        ls.log_group("genre.edit.single", tables.Genre, [genre_id], session=session)
+
+    run_transaction(edit_genre)
+    return ls.get(tables.Genre, genre_id, options=models.GenreOutput.loader_options(tables.Genre))
 
 
 @router_genres.delete(
@@ -9,6 +9,7 @@ from royalnet.typing import *
 from .. import dependencies
 from .. import models
 from .. import responses
+from .. import utils
 from ...database import tables
 
 router_layers = f.APIRouter()
@@ -23,17 +24,24 @@ router_layers = f.APIRouter()
     response_model=List[models.LayerOutput]
 )
 def get_all(
+    response: f.Response,
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     limit: int = f.Query(500, description="The number of objects that will be returned.", ge=0, le=500),
-    offset: int = f.Query(0, description="The starting object from which the others will be returned.", ge=0),
+    after: Optional[str] = f.Query(None, description="The cursor of the page to return, as received in the "
+                                                     "`X-Next-Cursor` header of the previous page."),
+    offset: int = f.Query(0, description="The number of objects to skip after the cursor. Slow on later pages, "
+                                         "use `after` instead.", ge=0, deprecated=True),
 ):
     """
-    Get an array of all the layers currently in the database, in pages of `limit` elements and starting at the
-    element number `offset`.
+    Get an array of all the layers currently in the database, in pages of `limit` elements.
+
+    If there are more layers, the cursor of the next page is returned in the `X-Next-Cursor` header: pass it as
+    `after` to get the next page.
 
     To avoid denial of service attacks, `limit` cannot be greater than 500.
     """
-    return ls.session.query(tables.Layer).order_by(tables.Layer.id).limit(limit).offset(offset).all()
+    query = ls.session.query(tables.Layer).options(*models.LayerOutput.loader_options(tables.Layer))
+    return utils.paginate(query, response=response, columns=[tables.Layer.id], limit=limit, after=after, offset=offset)
 
 
 @router_layers.get(
@@ -42,14 +50,19 @@ def get_all(
     response_model=int,
 )
 def count(
-    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session)
+    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session),
+    exact: bool = f.Query(False, description="Whether the layers should be counted exactly, instead of estimating "
+                                             "their number if there are many of them."),
 ):
     """
     Get the total number of layers.
 
     Since it doesn't require any login, it can be useful to display some information on an "instance preview" page.
+
+    If there are many layers, their number is estimated from the statistics of the database, unless `exact` is set;
+    either way, it is cached for a while, so it may be slightly out of date.
     """
-    return session.query(tables.Layer).count()
+    return utils.lazy_count_cache.e.count(session, tables.Layer, exact=exact)
 
 
 @router_layers.patch(
@@ -69,10 +82,9 @@ def edit_multiple_move(
     """
     Change the song the specified layers are associated with.
     """
-    song = ls.get(tables.Song, song_id)
-    for layer in ls.group(tables.Layer, layer_ids):
-        layer.song = song
-        ls.log("layer.edit.multiple.move", obj=layer.id)
+    ls.get(tables.Song, song_id)
+    ls.update_group(tables.Layer, layer_ids, song_id=song_id)
+    ls.log_group("layer.edit.multiple.move", tables.Layer, layer_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -94,10 +106,8 @@ def edit_multiple_rename(
     """
     Bulk change the location of all the specified layers.
     """
-    for layer in ls.group(tables.Layer, layer_ids):
-        layer.name = name
-        ls.log("layer.edit.multiple.rename", obj=layer.id)
-
+    ls.update_group(tables.Layer, layer_ids, name=name)
+    ls.log_group("layer.edit.multiple.rename", tables.Layer, layer_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -118,7 +128,7 @@ def get_single(
     """
     Get full information for the layer with the specified `layer_id`.
     """
-    return ls.get(tables.Layer, layer_id)
+    return ls.get(tables.Layer, layer_id, options=models.LayerOutput.loader_options(tables.Layer))
 
 
 @router_layers.get(
@@ -127,22 +137,31 @@ def get_single(
     response_class=starlette.responses.FileResponse,
     responses={
         **responses.login_error,
+        206: {"description": "Partial content"},
+        304: {"description": "Not modified"},
         404: {"description": "File not found"},
+        416: {"description": "Range not satisfiable"},
     }
 )
-async def download(
+def download(
+        request: f.Request,
         ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
         layer_id: int = f.Path(..., description="The id of the layer to be downloaded.")
 ):
     """
     Download a single raw file from the database, without any tags applied.
+
+    Single byte `Range` requests are supported, allowing clients to seek in the track or to resume a download; the
+    file is identified by a strong `ETag`, which can be used with `If-None-Match` and `If-Range`.
     """
+    # This is a plain function, so that the queries and the filesystem checks run in the threadpool
     layer = ls.get(tables.Layer, layer_id)
-    if layer.file is None:
+    if len(layer.encodings) == 0:
         raise f.HTTPException(404, "Layer doesn't have an associated file.")
-    if not os.path.exists(layer.file.location):
+    encoding = layer.encodings[0]
+    if not os.path.exists(encoding.location):
         raise f.HTTPException(404, "File doesn't exist on the server filesystem.")
-    return starlette.responses.FileResponse(layer.file.location, media_type=layer.file.mime_type)
+    return utils.encoding_response(request=request, encoding=encoding)
 
 
 @router_layers.put(
@@ -166,7 +185,7 @@ def edit_single(
     layer.update(**data.__dict__)
     ls.log("layer.edit.single", obj=layer.id)
     ls.session.commit()
-    return layer
+    return ls.reload(layer, options=models.LayerOutput.loader_options(tables.Layer))
 
 
 @router_layers.delete(
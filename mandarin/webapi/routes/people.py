@@ -3,11 +3,12 @@ from royalnet.typing import *
 import fastapi as f
 import sqlalchemy.orm
 
-from ...database import tables, lazy_Session
+from ...database import tables, lazy_Session, merge_rows, run_transaction
 from ...taskbus import tasks
 from .. import models
 from .. import dependencies
 from .. import responses
+from .. import utils
 
 router_people = f.APIRouter()
 
@@ -21,17 +22,24 @@ router_people = f.APIRouter()
     response_model=List[models.Person]
 )
 def get_all(
+    response: f.Response,
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     limit: int = f.Query(500, description="The number of objects that will be returned.", ge=0, le=500),
-    offset: int = f.Query(0, description="The starting object from which the others will be returned.", ge=0),
+    after: Optional[str] = f.Query(None, description="The cursor of the page to return, as received in the "
+                                                     "`X-Next-Cursor` header of the previous page."),
+    offset: int = f.Query(0, description="The number of objects to skip after the cursor. Slow on later pages, "
+                                         "use `after` instead.", ge=0, deprecated=True),
 ):
     """
-    Get an array of all the people currently in the database, in pages of `limit` elements and starting at the
-    element number `offset`.
+    Get an array of all the people currently in the database, in pages of `limit` elements.
+
+    If there are more people, the cursor of the next page is returned in the `X-Next-Cursor` header: pass it as
+    `after` to get the next page.
 
     To avoid denial of service attacks, `limit` cannot be greater than 500.
     """
-    return ls.session.query(tables.Person).order_by(tables.Person.id).limit(limit).offset(offset).all()
+    return utils.paginate(ls.session.query(tables.Person), response=response, columns=[tables.Person.id], limit=limit,
+                          after=after, offset=offset)
 
 
 @router_people.post(
@@ -54,7 +62,7 @@ def create(
     ls.session.commit()
     ls.log("person.create", obj=person.id)
     ls.session.commit()
-    return person
+    return ls.reload(person, options=models.PersonOutput.loader_options(tables.Person))
 
 
 @router_people.get(
@@ -63,14 +71,19 @@ def create(
     response_model=int,
 )
 def count(
-    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session)
+    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session),
+    exact: bool = f.Query(False, description="Whether the people should be counted exactly, instead of estimating "
+                                             "their number if there are many of them."),
 ):
     """
     Get the total number of people.
 
     Since it doesn't require any login, it can be useful to display some information on an "instance preview" page.
+
+    If there are many people, their number is estimated from the statistics of the database, unless `exact` is set;
+    either way, it is cached for a while, so it may be slightly out of date.
     """
-    return session.query(tables.Genre).count()
+    return utils.lazy_count_cache.e.count(session, tables.Person, exact=exact)
 
 
 @router_people.patch(
@@ -79,12 +92,12 @@ def count(
     status_code=204,
     responses={
         **responses.login_error,
-        400: {"description": "Not enough people specified"}
+        400: {"description": "Not enough people specified"},
+        404: {"description": "Person not found"},
     },
 )
 def merge(
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
-    ss: sqlalchemy.orm.Session = f.Depends(dependencies.dependency_db_session_serializable),
     people_ids: List[int] = f.Query(..., description="The ids of the people to merge."),
 ):
     """
@@ -95,26 +108,16 @@ def merge(
     if len(people_ids) < 2:
         raise f.HTTPException(400, "Not enough people specified")
 
-    # Get the first genre
-    main_person = ss.query(tables.Person).get(people_ids[0])
-    ls.log("person.merge.to", obj=main_person.id)
+    main_id, other_ids = people_ids[0], people_ids[1:]
 
-    # Get the other genres
-    other_people = ss.query(tables.Person).filter(tables.Person.id.in_(people_ids[1:])).all()
+    def merge_people(session: sqlalchemy.orm.Session) -> None:
+        if session.query(tables.Person).get(main_id) is None:
+            raise f.HTTPException(404, f"The id '{main_id}' does not match any Person.")
+        ls.log_group("person.merge.to", tables.Person, [main_id], session=session)
+        ls.log_group("person.merge.from", tables.Person, other_ids, session=session)
+        merge_rows(session, tables.Person, main_id, other_ids)
 
-    # Replace and delete the other genres
-    for merged_person in other_people:
-        for song_involvement in merged_person.song_involvements:
-            song_involvement.person = main_person
-        for album_involvement in merged_person.album_involvements:
-            album_involvement.person = main_person
-        ls.log("person.merge.from", obj=merged_person.id)
-        ss.delete(merged_person)
-
-    ss.commit()
-    ss.close()
-
-    ls.session.commit()
+    run_transaction(merge_people)
     return f.Response(status_code=204)
 
 
@@ -134,7 +137,7 @@ def get_single(
     """
     Get full information for the person with the specified `person_id`.
     """
-    return ls.get(tables.Person, person_id)
+    return ls.get(tables.Person, person_id, options=models.PersonOutput.loader_options(tables.Person))
 
 
 @router_people.put(
@@ -158,7 +161,7 @@ def edit_single(
     person.update(**data.__dict__)
     ls.log("person.edit.single", obj=person.id)
     ls.session.commit()
-    return person
+    return ls.reload(person, options=models.PersonOutput.loader_options(tables.Person))
 
 
 @router_people.delete(
@@ -112,8 +112,14 @@ def search_results(
     """
     Search for one or more entities in the database.
     """
+    table = SEARCHABLE_ELEMENT_TABLES[element_type.value]
+    model = SEARCHABLE_ELEMENT_MODELS[element_type.value]
+    elements = ls.session.query(table)
+    if model is not None:
+        elements = elements.options(*model.loader_options(table))
+
     result = ss.search(
-        query=ls.session.query(SEARCHABLE_ELEMENT_TABLES[element_type]),
+        query=elements,
         search_query=query,
         sort=True,
         weights=[weight_d, weight_c, weight_b, weight_a],
@@ -126,7 +132,6 @@ def search_results(
             32 if norm_32 else 0
         )
     ).all()
-    model = SEARCHABLE_ELEMENT_MODELS[element_type.value]
     if model is None:
         return result
     else:
@@ -206,11 +211,12 @@ def search_results(
     """
     Search for one or more songs / albums only in a certain subgenre.
     """
-    top = ls.session.query(tables.Genre.id).filter(tables.Genre.id == filter_genre_id).cte("cte", recursive=True)
-    bot = ls.session.query(tables.Genre.id).join(top, tables.Genre.supergenre_id == top.c.id)
-    genres = top.union(bot)
+    genres = ls.session.query(tables.GenreClosure.descendant_id).filter_by(ancestor_id=filter_genre_id)
     element_table = SEARCHABLE_ELEMENT_TABLES[element_type.value]
-    elements = ls.session.query(element_table).filter(element_table.genres.any(id=genres.c.id))
+    model = SEARCHABLE_ELEMENT_MODELS[element_type.value]
+    elements = ls.session.query(element_table).filter(element_table.genres.any(tables.Genre.id.in_(genres)))
+    if model is not None:
+        elements = elements.options(*model.loader_options(element_table))
 
     result = ss.search(
         query=elements,
@@ -226,7 +232,6 @@ def search_results(
             32 if norm_32 else 0
         )
     ).all()
-    model = SEARCHABLE_ELEMENT_MODELS[element_type.value]
     if model is None:
         return result
     else:
@@ -7,7 +7,8 @@ from royalnet.typing import *
 from .. import dependencies
 from .. import models
 from .. import responses
-from ...database import tables
+from .. import utils
+from ...database import tables, any_of, link_all, merge_rows, run_transaction
 
 router_songs = f.APIRouter()
 
@@ -21,17 +22,24 @@ router_songs = f.APIRouter()
     response_model=List[models.Song]
 )
 def get_all(
+    response: f.Response,
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
     limit: int = f.Query(500, description="The number of objects that will be returned.", ge=0, le=500),
-    offset: int = f.Query(0, description="The starting object from which the others will be returned.", ge=0),
+    after: Optional[str] = f.Query(None, description="The cursor of the page to return, as received in the "
+                                                     "`X-Next-Cursor` header of the previous page."),
+    offset: int = f.Query(0, description="The number of objects to skip after the cursor. Slow on later pages, "
+                                         "use `after` instead.", ge=0, deprecated=True),
 ):
     """
-    Get an array of all the songs currently in the database, in pages of `limit` elements and starting at the
-    element number `offset`.
+    Get an array of all the songs currently in the database, in pages of `limit` elements.
+
+    If there are more songs, the cursor of the next page is returned in the `X-Next-Cursor` header: pass it as
+    `after` to get the next page.
 
     To avoid denial of service attacks, `limit` cannot be greater than 500.
     """
-    return ls.session.query(tables.Song).order_by(tables.Song.id).limit(limit).offset(offset).all()
+    return utils.paginate(ls.session.query(tables.Song), response=response, columns=[tables.Song.id], limit=limit,
+                          after=after, offset=offset)
 
 
 @router_songs.post(
@@ -56,7 +64,7 @@ def create(
     ls.session.commit()
     ls.log("song.create", obj=song.id)
     ls.session.commit()
-    return song
+    return ls.reload(song, options=models.SongOutput.loader_options(tables.Song))
 
 
 @router_songs.get(
@@ -65,14 +73,19 @@ def create(
     response_model=int,
 )
 def count(
-    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session)
+    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session),
+    exact: bool = f.Query(False, description="Whether the songs should be counted exactly, instead of estimating "
+                                             "their number if there are many of them."),
 ):
     """
     Get the total number of songs.
 
     Since it doesn't require any login, it can be useful to display some information on an "instance preview" page.
+
+    If there are many songs, their number is estimated from the statistics of the database, unless `exact` is set;
+    either way, it is cached for a while, so it may be slightly out of date.
     """
-    return session.query(tables.Song).count()
+    return utils.lazy_count_cache.e.count(session, tables.Song, exact=exact)
 
 
 @router_songs.patch(
@@ -93,14 +106,12 @@ def edit_multiple_move(
     Change the album the specified songs are associated with.
     """
     if album_id:
-        album = ls.get(tables.Album, album_id)
+        ls.get(tables.Album, album_id)
     else:
-        album = None
-
-    for song in ls.group(tables.Song, song_ids):
-        song.album = album
-        ls.log("song.edit.multiple.move", obj=song.id)
+        album_id = None
 
+    ls.update_group(tables.Song, song_ids, album_id=album_id)
+    ls.log_group("song.edit.multiple.move", tables.Song, song_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -133,9 +144,11 @@ def edit_multiple_involve(
     """
     role = ls.get(tables.Role, role_id)
     person = ls.get(tables.Person, person_id)
-    for song in ls.group(tables.Song, song_ids):
-        tables.SongInvolvement.make(session=ls.session, role=role, song=song, person=person)
-        ls.log("song.edit.multiple.involve", obj=song.id)
+    ls.session.execute(link_all(
+        tables.SongInvolvement.__table__, tables.SongInvolvement.song_id, tables.Song, song_ids,
+        person_id=person.id, role_id=role.id,
+    ))
+    ls.log_group("song.edit.multiple.involve", tables.Song, song_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -166,9 +179,12 @@ def edit_multiple_uninvolve(
     """
     role = ls.get(tables.Role, role_id)
     person = ls.get(tables.Person, person_id)
-    for song in ls.group(tables.Song, song_ids):
-        tables.SongInvolvement.unmake(session=ls.session, role=role, song=song, person=person)
-        ls.log("song.edit.multiple.uninvolve", obj=song.id)
+    ls.session.query(tables.SongInvolvement).filter(
+        tables.SongInvolvement.person_id == person.id,
+        tables.SongInvolvement.role_id == role.id,
+        any_of(tables.SongInvolvement.song_id, song_ids),
+    ).delete(synchronize_session=False)
+    ls.log_group("song.edit.multiple.uninvolve", tables.Song, song_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -194,9 +210,11 @@ def edit_multiple_classify(
     non-existing genre.
     """
     genre = ls.get(tables.Genre, genre_id)
-    for song in ls.group(tables.Song, song_ids):
-        song.genres.append(genre)
-        ls.log("song.edit.multiple.classify", obj=song.id)
+    ls.session.execute(link_all(
+        tables.songgenres, tables.songgenres.c.song_id, tables.Song, song_ids,
+        genre_id=genre.id,
+    ))
+    ls.log_group("song.edit.multiple.classify", tables.Song, song_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -222,9 +240,11 @@ def edit_multiple_declassify(
     non-existing genre.
     """
     genre = ls.get(tables.Genre, genre_id)
-    for song in ls.group(tables.Song, song_ids):
-        song.genres.remove(genre)
-        ls.log("song.edit.multiple.declassify", obj=song.id)
+    ls.session.execute(tables.songgenres.delete().where(sqlalchemy.and_(
+        tables.songgenres.c.genre_id == genre.id,
+        any_of(tables.songgenres.c.song_id, song_ids),
+    )))
+    ls.log_group("song.edit.multiple.declassify", tables.Song, song_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -246,9 +266,8 @@ def edit_multiple_group(
     """
     Change the disc number of all the specified songs.
     """
-    for song in ls.group(tables.Song, song_ids):
-        song.disc = disc_number
-        ls.log("song.edit.multiple.group", obj=song.id)
+    ls.update_group(tables.Song, song_ids, disc=disc_number)
+    ls.log_group("song.edit.multiple.group", tables.Song, song_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -269,9 +288,8 @@ def edit_multiple_calendarize(
     """
     Change the release year of all the specified songs.
     """
-    for song in ls.group(tables.Song, song_ids):
-        song.year = year
-        ls.log("song.edit.multiple.calendarize", obj=song.id)
+    ls.update_group(tables.Song, song_ids, year=year)
+    ls.log_group("song.edit.multiple.calendarize", tables.Song, song_ids)
     ls.session.commit()
     return f.Response(status_code=204)
 
@@ -282,41 +300,32 @@ def edit_multiple_calendarize(
     status_code=204,
     responses={
         **responses.login_error,
-        400: {"description": "Not enough genres specified"}
+        400: {"description": "Not enough songs specified"},
+        404: {"description": "Song not found"},
     },
 )
 def merge(
     ls: dependencies.LoginSession = f.Depends(dependencies.dependency_login_session),
-    ss: sqlalchemy.orm.Session = f.Depends(dependencies.dependency_db_session_serializable),
-    song_ids: List[int] = f.Query(..., description="The ids of the genres to merge."),
+    song_ids: List[int] = f.Query(..., description="The ids of the songs to merge."),
 ):
     """
-    Move the layers of all the specified songs into a single one, which will have the metadata of the first song
-    specified.
+    Move the layers, the involvements and the genres of all the specified songs into a single one, which will have
+    the metadata of the first song specified, then delete the other songs.
     """
 
     if len(song_ids) < 2:
         raise f.HTTPException(400, "Not enough songs specified")
 
-    # Get the first genre
-    main_song = ss.query(tables.Song).get(song_ids[0])
-    ls.log("song.merge.to", obj=main_song.id)
+    main_id, other_ids = song_ids[0], song_ids[1:]
 
-    # Get the other genres
-    other_songs = ss.query(tables.Song).filter(tables.Song.id.in_(song_ids[1:])).all()
+    def merge_songs(session: sqlalchemy.orm.Session) -> None:
+        if session.query(tables.Song).get(main_id) is None:
+            raise f.HTTPException(404, f"The id '{main_id}' does not match any Song.")
+        ls.log_group("song.merge.to", tables.Song, [main_id], session=session)
+        ls.log_group("song.merge.from", tables.Song, other_ids, session=session)
+        merge_rows(session, tables.Song, main_id, other_ids)
 
-    # Replace and delete the other genres
-    for merged_song in other_songs:
-        for layer in merged_song.layers:
-            layer.song = main_song
-
-        ls.log("song.merge.from", obj=merged_song.id)
-        ss.delete(merged_song)
-
-    ss.commit()
-    ss.close()
-
-    ls.session.commit()
+    run_transaction(merge_songs)
     return f.Response(status_code=204)
 
 
@@ -336,7 +345,7 @@ def get_single(
     """
     Get full information for the song with the specified `song_id`.
     """
-    return ls.get(tables.Song, song_id)
+    return ls.get(tables.Song, song_id, options=models.SongOutput.loader_options(tables.Song))
 
 
 @router_songs.put(
@@ -360,7 +369,7 @@ def edit_single(
     song.update(**data.dict())
     ls.log("song.edit.single", obj=song.id)
     ls.session.commit()
-    return song
+    return ls.reload(song, options=models.SongOutput.loader_options(tables.Song))
 
 
 @router_songs.delete(
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import fastapi as f
+import sqlalchemy.orm
+
+from .. import models
+from .. import dependencies
+from .. import utils
+
+router_stats = f.APIRouter()
+
+
+@router_stats.get(
+    "/",
+    summary="Get the statistics of the instance.",
+    response_model=models.InstanceStats,
+)
+def get_stats(
+    session: sqlalchemy.orm.session.Session = f.Depends(dependencies.dependency_db_session),
+):
+    """
+    Get the number of songs, albums, layers, encodings, genres, people, roles and users in the database, the total
+    size in bytes of the stored encodings, the number of layers not belonging to any song and the number of encodings
+    not belonging to any layer, all computed together by a single query.
+
+    Since it doesn't require any login, it can be useful to display some information on an "instance preview" page;
+    the statistics are cached for a while, and the number of rows of large tables is estimated like `/count` does,
+    so they may be slightly out of date.
+    """
+    return models.InstanceStats(**utils.lazy_count_cache.e.stats(session))
+
+
+__all__ = (
+    "router_stats",
+)
@@ -1 +1,7 @@
 from .loginsession import *
+from .downloads import *
+from .jwks import *
+from .userinfocache import *
+from .pagination import *
+from .counts import *
+from .genretree import *
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import royalnet.lazy
+import sqlalchemy.orm
+from royalnet.typing import *
+
+from ...config import config_get
+from ...database import count_rows, instance_stats
+
+ValueType = TypeVar("ValueType")
+
+
+class CountCache:
+    """
+    A cache of the number of rows of the database tables and of the statistics of the instance, so that the
+    unauthenticated ``/count`` and ``/stats`` endpoints can't be used to make the database count rows over and over.
+    """
+
+    def __init__(self, max_age: float, threshold: int):
+        self.max_age: float = max_age
+        self.threshold: int = threshold
+        self.values: Dict[Hashable, Tuple[float, Any]] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def cached(self, key: Hashable, compute: Callable[[], ValueType]) -> ValueType:
+        """
+        Get a value from the cache, computing and storing it if it wasn't computed in the last ``max_age`` seconds.
+
+        :param key: The key of the value.
+        :param compute: The function computing the value.
+        :return: The value.
+        """
+        with self.lock:
+            item = self.values.get(key)
+        if item is not None and item[0] > time.monotonic():
+            return item[1]
+
+        value = compute()
+        with self.lock:
+            self.values[key] = (time.monotonic() + self.max_age, value)
+        return value
+
+    def count(self, session: sqlalchemy.orm.Session, table: type, exact: bool = False) -> int:
+        """
+        Get the number of rows of a table, counting them with :func:`~mandarin.database.count_rows` if they weren't
+        counted in the last ``max_age`` seconds.
+
+        :param session: The session to count the rows with.
+        :param table: The table to count the rows of.
+        :param exact: Whether the rows should be counted exactly instead of estimated.
+        :return: The number of rows.
+        """
+        return self.cached(
+            (table.__tablename__, exact),
+            lambda: count_rows(session, table, exact=exact, threshold=self.threshold),
+        )
+
+    def stats(self, session: sqlalchemy.orm.Session) -> Dict[str, int]:
+        """
+        Get the statistics of the instance, computing them with :func:`~mandarin.database.instance_stats` if they
+        weren't computed in the last ``max_age`` seconds.
+
+        :param session: The session to compute the statistics with.
+        :return: The statistics.
+        """
+        return self.cached("stats", lambda: instance_stats(session, threshold=self.threshold))
+
+
+lazy_count_cache = royalnet.lazy.Lazy(lambda: CountCache(
+    max_age=config_get("database.counts.maxage", 60),
+    threshold=config_get("database.counts.threshold", 10000),
+))
+"""
+The uninitialized :class:`.CountCache`, configured in the ``database.counts`` section of the config.
+"""
+
+
+__all__ = (
+    "CountCache",
+    "lazy_count_cache",
+)
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import os
+import pathlib
+import re
+import urllib.parse
+
+import aiofiles
+import starlette.datastructures
+import starlette.requests
+import starlette.responses
+from royalnet.typing import *
+
+from ...config import lazy_config, config_get
+from ...database import tables
+
+RANGE_REGEX = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+"""
+The ``Cache-Control`` header sent with encodings: as they are content-addressed, they never change, but they can only
+be downloaded by logged in users.
+"""
+
+OFFLOAD_PREFIX = "/_music"
+"""
+The default prefix of the internal URIs sent in the ``X-Accel-Redirect`` header.
+"""
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse the value of a ``Range`` header containing a single byte range.
+
+    :param header: The value of the header, such as ``bytes=0-1023``, ``bytes=1024-`` or ``bytes=-1024``.
+    :param size: The size in bytes of the requested file.
+    :return: A :class:`tuple` of the first and the last byte of the range, both inclusive, or :data:`None` if the header
+             is malformed or requests multiple ranges, in which case it should be ignored.
+    :raises ValueError: If the range can't be satisfied.
+    """
+    match = RANGE_REGEX.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+
+    if start == "" and end == "":
+        return None
+    elif size == 0:
+        raise ValueError(f"Range requested for an empty file: {header!r}")
+    elif start == "":
+        # Suffix range, requesting the last bytes of the file
+        length = int(end)
+        if length == 0:
+            raise ValueError(f"Empty suffix range: {header!r}")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = int(end) if end != "" else size - 1
+    if start > end or start >= size:
+        raise ValueError(f"Unsatisfiable range: {header!r}")
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    Check if the value of an ``If-None-Match`` header matches an ETag.
+
+    :param header: The value of the header, a comma-separated list of ETags or ``*``.
+    :param etag: The ETag to compare.
+    :return: :data:`True` if the header matches the ETag, :data:`False` otherwise.
+    """
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class RangeFileResponse(starlette.responses.FileResponse):
+    """
+    A :class:`starlette.responses.FileResponse` that sends only a range of bytes of the file, with the
+    ``206 Partial Content`` status code.
+    """
+
+    def __init__(self, path: str, start: int, end: int, stat_result: os.stat_result, **kwargs):
+        self.start: int = start
+        self.end: int = end
+        headers = {
+            **kwargs.pop("headers", {}),
+            "content-length": str(end - start + 1),
+            "content-range": f"bytes {start}-{end}/{stat_result.st_size}",
+        }
+        super().__init__(path, status_code=206, headers=headers, stat_result=stat_result, **kwargs)
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        async with aiofiles.open(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.end - self.start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0 and len(chunk) > 0,
+                })
+                if len(chunk) == 0:
+                    break
+        if self.background is not None:
+            await self.background()
+
+
+def not_modified(request: starlette.requests.Request,
+                 etag: Optional[str],
+                 headers: Dict[str, str]) -> Optional[starlette.responses.Response]:
+    """
+    Check if the client already has the current version of a file, through the ``If-None-Match`` header.
+
+    :param request: The request asking for the file.
+    :param etag: The ETag of the file, or :data:`None` if it doesn't have one.
+    :param headers: The headers to send with the response.
+    :return: A ``304 Not Modified`` response if the client has the file, :data:`None` otherwise.
+    """
+    if etag is None:
+        return None
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None or not etag_matches(if_none_match, etag):
+        return None
+    return starlette.responses.Response(status_code=304, headers=headers)
+
+
+def file_response(request: starlette.requests.Request,
+                  path: str,
+                  media_type: Optional[str],
+                  etag: Optional[str] = None,
+                  headers: Optional[Dict[str, str]] = None) -> starlette.responses.Response:
+    """
+    Create a response serving a file, handling conditional and range requests.
+
+    :param request: The request asking for the file.
+    :param path: The path of the file to serve.
+    :param media_type: The mimetype of the file.
+    :param etag: The strong ETag of the file, or :data:`None` to only allow unconditional range requests.
+    :param headers: Additional headers to send with the response.
+    :return: A ``304 Not Modified``, ``206 Partial Content``, ``416 Range Not Satisfiable`` or ``200 OK`` response.
+    """
+    headers = {
+        "accept-ranges": "bytes",
+        **(headers or {}),
+    }
+    if etag is not None:
+        headers["etag"] = etag
+
+    response = not_modified(request=request, etag=etag, headers=headers)
+    if response is not None:
+        return response
+
+    stat_result = os.stat(path)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # Ranges are ignored if the file changed from the one the client already has a part of
+    if range_header is not None and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, stat_result.st_size)
+        except ValueError:
+            return starlette.responses.Response(status_code=416, headers={
+                **headers,
+                "content-range": f"bytes */{stat_result.st_size}",
+            })
+        if byte_range is not None:
+            start, end = byte_range
+            return RangeFileResponse(path, start=start, end=end, stat_result=stat_result, media_type=media_type,
+                                     headers=headers)
+
+    return starlette.responses.FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result,
+                                            method=request.method)
+
+
+def offload_response(encoding: tables.Encoding, header: str, headers: Dict[str, str]) -> starlette.responses.Response:
+    """
+    Create an empty response asking the reverse proxy in front of Mandarin to serve the file of an
+    :class:`~mandarin.database.tables.Encoding` by itself, so that its contents never pass through Python.
+
+    :param encoding: The encoding to serve.
+    :param header: The header to use, either ``X-Accel-Redirect`` (nginx) or ``X-Sendfile`` (Apache, lighttpd).
+    :param headers: Additional headers to send with the response.
+    :return: The created response.
+    :raises ValueError: If the header isn't supported.
+    """
+    if header.lower() == "x-accel-redirect":
+        # nginx needs an internal URI, mapped to the music directory by an "internal" location block
+        musicdir = pathlib.Path(lazy_config.e["storage.music.dir"]).resolve()
+        relative = pathlib.Path(encoding.location).resolve().relative_to(musicdir)
+        prefix = config_get("storage.music.offload.prefix", OFFLOAD_PREFIX)
+        value = f"{prefix.rstrip('/')}/{urllib.parse.quote(relative.as_posix())}"
+    elif header.lower() == "x-sendfile":
+        value = str(pathlib.Path(encoding.location).resolve())
+    else:
+        raise ValueError(f"Unsupported offload header: {header!r}")
+
+    return starlette.responses.Response(media_type=encoding.mime_type, headers={
+        **headers,
+        header: value,
+    })
+
+
+def encoding_response(request: starlette.requests.Request,
+                      encoding: tables.Encoding) -> starlette.responses.Response:
+    """
+    Create the response serving the file of an :class:`~mandarin.database.tables.Encoding`.
+
+    The hex digest of the encoding is used as a strong ETag, so that ``If-None-Match`` and ``If-Range`` keep working
+    even if the file is moved or copied to another server.
+
+    If the ``storage.music.offload.header`` config key is set, the file is served by the reverse proxy through
+    :func:`.offload_response`; otherwise, it is served directly with :func:`.file_response`.
+
+    :param request: The request asking for the file.
+    :param encoding: The encoding to serve.
+    :return: The created response.
+    """
+    headers = {
+        "cache-control": IMMUTABLE_CACHE_CONTROL,
+    }
+    etag = f'"{encoding.digest.hex()}"' if encoding.digest is not None else None
+
+    header = config_get("storage.music.offload.header")
+    if header is None:
+        return file_response(request=request, path=encoding.location, media_type=encoding.mime_type, etag=etag,
+                             headers=headers)
+
+    if etag is not None:
+        headers["etag"] = etag
+    response = not_modified(request=request, etag=etag, headers=headers)
+    if response is not None:
+        return response
+    return offload_response(encoding=encoding, header=header, headers=headers)
+
+
+class OffloadEmulationMiddleware:
+    """
+    An ASGI middleware emulating the ``X-Accel-Redirect`` and ``X-Sendfile`` handling of a reverse proxy, serving the
+    offloaded files by itself.
+
+    It allows testing and developing instances using :func:`.offload_response` without a reverse proxy in front; it
+    **must not** be used behind an actual reverse proxy, as it would consume the headers before it could see them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        offloaded: Optional[starlette.datastructures.Headers] = None
+
+        async def intercept(message) -> None:
+            nonlocal offloaded
+            if message["type"] == "http.response.start":
+                headers = starlette.datastructures.Headers(raw=message["headers"])
+                if "x-accel-redirect" in headers or "x-sendfile" in headers:
+                    offloaded = headers
+                    return
+            elif message["type"] == "http.response.body" and offloaded is not None:
+                return
+            await send(message)
+
+        await self.app(scope, receive, intercept)
+        if offloaded is None:
+            return
+
+        if "x-accel-redirect" in offloaded:
+            prefix = config_get("storage.music.offload.prefix", OFFLOAD_PREFIX).rstrip("/")
+            uri = urllib.parse.unquote(offloaded["x-accel-redirect"])
+            path = pathlib.Path(lazy_config.e["storage.music.dir"]).joinpath(uri[len(prefix):].lstrip("/"))
+        else:
+            path = pathlib.Path(offloaded["x-sendfile"])
+
+        response = file_response(
+            request=starlette.requests.Request(scope),
+            path=str(path),
+            media_type=offloaded.get("content-type"),
+            etag=offloaded.get("etag"),
+            headers={key: value for key, value in offloaded.items()
+                     if key not in {"x-accel-redirect", "x-sendfile", "content-length", "content-type", "etag"}},
+        )
+        await response(scope, receive, send)
+
+
+__all__ = (
+    "parse_range",
+    "etag_matches",
+    "RangeFileResponse",
+    "not_modified",
+    "file_response",
+    "offload_response",
+    "encoding_response",
+    "OffloadEmulationMiddleware",
+)
@@ -0,0 +1,141 @@
+import json
+import pathlib
+
+import pytest
+import starlette.applications
+import starlette.requests
+import starlette.routing
+import starlette.testclient
+
+from mandarin.database import tables
+from .downloads import parse_range, etag_matches, file_response, offload_response
+
+
+CONTENTS = bytes(range(256)) * 4
+ETAG = '"0123456789abcdef"'
+
+
+@pytest.fixture
+def sample_path(tmp_path) -> pathlib.Path:
+    """
+    Provide a temporary 1024 bytes file, whose contents are :data:`.CONTENTS`.
+    """
+    path = tmp_path.joinpath("sample.bin")
+    path.write_bytes(CONTENTS)
+    return path
+
+
+@pytest.fixture
+def client(sample_path) -> starlette.testclient.TestClient:
+    """
+    Provide a client of an app serving the sample file with :func:`.file_response` at ``/``.
+    """
+    def endpoint(request: starlette.requests.Request):
+        return file_response(request=request, path=str(sample_path), media_type="audio/mpeg", etag=ETAG)
+
+    app = starlette.applications.Starlette(routes=[starlette.routing.Route("/", endpoint)])
+    return starlette.testclient.TestClient(app)
+
+
+class TestParseRange:
+
+    def test_closed(self):
+        assert parse_range("bytes=0-99", 1024) == (0, 99)
+        assert parse_range("bytes=1000-2000", 1024) == (1000, 1023)
+
+    def test_open(self):
+        assert parse_range("bytes=1000-", 1024) == (1000, 1023)
+
+    def test_suffix(self):
+        assert parse_range("bytes=-24", 1024) == (1000, 1023)
+        assert parse_range("bytes=-2048", 1024) == (0, 1023)
+
+    def test_ignored(self):
+        assert parse_range("bytes=-", 1024) is None
+        assert parse_range("bytes=0-1,5-9", 1024) is None
+        assert parse_range("items=0-1", 1024) is None
+
+    def test_unsatisfiable(self):
+        with pytest.raises(ValueError):
+            parse_range("bytes=1024-", 1024)
+        with pytest.raises(ValueError):
+            parse_range("bytes=10-5", 1024)
+        with pytest.raises(ValueError):
+            parse_range("bytes=-0", 1024)
+        with pytest.raises(ValueError):
+            parse_range("bytes=0-", 0)
+
+
+class TestEtagMatches:
+
+    def test_single(self):
+        assert etag_matches(ETAG, ETAG)
+        assert not etag_matches('"other"', ETAG)
+
+    def test_list(self):
+        assert etag_matches(f'"other", {ETAG}', ETAG)
+        assert not etag_matches('"other", "another"', ETAG)
+
+    def test_weak(self):
+        assert etag_matches(f"W/{ETAG}", ETAG)
+
+    def test_any(self):
+        assert etag_matches("*", ETAG)
+
+
+class TestFileResponse:
+
+    def test_full(self, client):
+        r = client.get("/")
+        assert r.status_code == 200
+        assert r.content == CONTENTS
+        assert r.headers["etag"] == ETAG
+        assert r.headers["accept-ranges"] == "bytes"
+
+    def test_range(self, client):
+        r = client.get("/", headers={"Range": "bytes=-24"})
+        assert r.status_code == 206
+        assert r.content == CONTENTS[1000:]
+        assert r.headers["content-range"] == "bytes 1000-1023/1024"
+        assert r.headers["content-length"] == "24"
+
+    def test_unsatisfiable_range(self, client):
+        r = client.get("/", headers={"Range": "bytes=2048-"})
+        assert r.status_code == 416
+        assert r.headers["content-range"] == "bytes */1024"
+
+    def test_stale_if_range(self, client):
+        r = client.get("/", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+        assert r.status_code == 200
+        assert r.content == CONTENTS
+
+    def test_not_modified(self, client):
+        r = client.get("/", headers={"If-None-Match": f'"other", W/{ETAG}'})
+        assert r.status_code == 304
+        assert r.content == b""
+
+
+class TestOffloadResponse:
+
+    def test_accel_redirect(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("MANDARIN_STORAGE_MUSIC_DIR", json.dumps(str(tmp_path)))
+        monkeypatch.setenv("MANDARIN_STORAGE_MUSIC_OFFLOAD_PREFIX", json.dumps("/internal/"))
+        encoding = tables.Encoding(location=str(tmp_path.joinpath("ab", "c d.mp3")), mime_type="audio/mpeg")
+
+        r = offload_response(encoding=encoding, header="X-Accel-Redirect", headers={"etag": ETAG})
+        assert r.headers["x-accel-redirect"] == "/internal/ab/c%20d.mp3"
+        assert r.headers["etag"] == ETAG
+        assert r.headers["content-type"] == "audio/mpeg"
+        assert r.body == b""
+
+    def test_sendfile(self, tmp_path):
+        encoding = tables.Encoding(location=str(tmp_path.joinpath("ab", "cd.mp3")), mime_type="audio/mpeg")
+
+        r = offload_response(encoding=encoding, header="X-Sendfile", headers={})
+        assert r.headers["x-sendfile"] == str(tmp_path.resolve().joinpath("ab", "cd.mp3"))
+
+    def test_unsupported(self, tmp_path):
+        encoding = tables.Encoding(location=str(tmp_path.joinpath("cd.mp3")))
+
+        with pytest.raises(ValueError):
+            offload_response(encoding=encoding, header="X-Unknown", headers={})
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+
+import royalnet.lazy
+import sqlalchemy.orm
+from royalnet.typing import *
+
+from ...config import config_get
+from ...database import tables
+
+GENRE_ACTIONS = "genre.%"
+"""
+The ``LIKE`` pattern matching the actions of the :class:`~mandarin.database.tables.AuditLog` rows of genre edits.
+"""
+
+
+def genre_tree(session: sqlalchemy.orm.Session) -> List[Dict[str, Any]]:
+    """
+    Fetch all the genres with a single query and assemble them into trees in linear time.
+
+    :param session: The session to fetch the genres with.
+    :return: A :class:`list` of the genres without a supergenre, or whose supergenre is missing or themselves, each a
+             :class:`dict` with the same fields as :class:`~mandarin.webapi.models.GenreTree`, their subgenres
+             included.
+    """
+    rows = session.query(
+        tables.Genre.id,
+        tables.Genre.name,
+        tables.Genre.description,
+        tables.Genre.supergenre_id,
+    ).order_by(tables.Genre.id).all()
+
+    nodes: Dict[int, Dict[str, Any]] = {
+        row.id: {"id": row.id, "name": row.name, "description": row.description, "subgenres": []} for row in rows
+    }
+    roots: List[Dict[str, Any]] = []
+    for row in rows:
+        supergenre = nodes.get(row.supergenre_id)
+        if supergenre is None or row.supergenre_id == row.id:
+            roots.append(nodes[row.id])
+        else:
+            supergenre["subgenres"].append(nodes[row.id])
+    return roots
+
+
+def genre_tree_generation(session: sqlalchemy.orm.Session) -> int:
+    """
+    Get a number which changes whenever the genres are edited through the web API by any process, as every edit of
+    the genres is logged with an action starting with ``genre.``.
+
+    It is the greatest id of the :class:`~mandarin.database.tables.AuditLog` rows of genre edits, which is found with
+    a single lookup of a partial index.
+
+    .. note:: A transaction may commit its log after another one with a greater id did; its edit is then only seen
+              when the tree expires, or when the genres are edited again.
+
+    :param session: The session to use.
+    :return: The id of the latest audit log of a genre edit, or ``0`` if the genres were never edited.
+    """
+    return session.query(sqlalchemy.func.max(tables.AuditLog.id)).filter(
+        tables.AuditLog.action.like(GENRE_ACTIONS)
+    ).scalar() or 0
+
+
+class GenreTreeCache:
+    """
+    A cache of the serialized :func:`.genre_tree`, rebuilt whenever the :func:`.genre_tree_generation` changes, so
+    that the edits made by any process of the web API are seen by all the others.
+
+    As genres may also be edited without going through the web API, the tree is also rebuilt if it is older than
+    ``max_age`` seconds.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age: float = max_age
+        self.value: Optional[Tuple[int, float, str]] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def get(self, session: sqlalchemy.orm.Session) -> str:
+        """
+        Get the serialized tree from the cache, building it if the genres were edited since it was built or if it is
+        too old.
+
+        :param session: The session to build the tree with.
+        :return: The tree, serialized as JSON.
+        """
+        # Read the generation before the genres, so that edits committed in the meantime cause another rebuild
+        generation = genre_tree_generation(session)
+        with self.lock:
+            value = self.value
+        if value is not None and value[0] == generation and value[1] > time.monotonic():
+            return value[2]
+
+        tree = json.dumps(genre_tree(session))
+        with self.lock:
+            self.value = (generation, time.monotonic() + self.max_age, tree)
+        return tree
+
+
+lazy_genre_tree_cache = royalnet.lazy.Lazy(lambda: GenreTreeCache(
+    max_age=config_get("database.genretree.maxage", 300),
+))
+"""
+The uninitialized :class:`.GenreTreeCache`, configured in the ``database.genretree`` section of the config.
+"""
+
+
+__all__ = (
+    "genre_tree",
+    "genre_tree_generation",
+    "GenreTreeCache",
+    "lazy_genre_tree_cache",
+)
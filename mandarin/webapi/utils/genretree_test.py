@@ -0,0 +1,101 @@
+import collections
+import json
+
+import pytest
+from mandarin.testing.fixtures import *
+
+from . import genretree as genretree_module
+from .genretree import genre_tree, GenreTreeCache
+
+
+Row = collections.namedtuple("Row", ["id", "name", "description", "supergenre_id"])
+
+
+class FakeSession:
+    """
+    A session whose queries all return the same genre rows, counting how many times they are fetched.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches: int = 0
+
+    def query(self, *columns):
+        return self
+
+    def order_by(self, *columns):
+        return self
+
+    def all(self):
+        self.fetches += 1
+        return list(self.rows)
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock) -> FakeClock:
+    """
+    Replace the clock used by :class:`.GenreTreeCache` with one that only moves when told to.
+    """
+    monkeypatch.setattr(genretree_module.time, "monotonic", fake_clock)
+    return fake_clock
+
+
+@pytest.fixture
+def generation(monkeypatch):
+    """
+    Replace the shared generation of the genres with the number in the returned :class:`list`.
+    """
+    generation = [0]
+    monkeypatch.setattr(genretree_module, "genre_tree_generation", lambda session: generation[0])
+    return generation
+
+
+def names(nodes):
+    return [(node["name"], names(node["subgenres"])) for node in nodes]
+
+
+def test_tree():
+    session = FakeSession([
+        Row(0, "Root", "", None),
+        Row(1, "Rock", "Loud", 0),
+        Row(2, "Metal", "", 1),
+        Row(3, "Jazz", "", 0),
+        Row(4, "Punk", "", 1),
+    ])
+    tree = genre_tree(session)
+    assert session.fetches == 1
+    assert names(tree) == [("Root", [("Rock", [("Metal", []), ("Punk", [])]), ("Jazz", [])])]
+    rock = tree[0]["subgenres"][0]
+    assert (rock["id"], rock["name"], rock["description"]) == (1, "Rock", "Loud")
+
+
+def test_self_parented_root():
+    tree = genre_tree(FakeSession([Row(0, "Root", "", 0), Row(1, "Rock", "", 0)]))
+    assert names(tree) == [("Root", [("Rock", [])])]
+
+
+def test_orphans():
+    tree = genre_tree(FakeSession([Row(0, "Root", "", None), Row(2, "Metal", "", 1), Row(3, "Jazz", "", 0)]))
+    assert names(tree) == [("Root", [("Jazz", [])]), ("Metal", [])]
+
+
+def test_empty():
+    assert genre_tree(FakeSession([])) == []
+
+
+def test_cache(clock, generation):
+    session = FakeSession([Row(0, "Root", "", None)])
+    cache = GenreTreeCache(max_age=60)
+
+    assert json.loads(cache.get(session)) == [{"id": 0, "name": "Root", "description": "", "subgenres": []}]
+    cache.get(session)
+    assert session.fetches == 1
+
+    # Another process edited the genres
+    generation[0] += 1
+    cache.get(session)
+    assert session.fetches == 2
+
+    clock.now += 60
+    cache.get(session)
+    assert session.fetches == 3
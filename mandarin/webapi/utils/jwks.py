@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+
+import jose.exceptions
+import jose.jwt
+import requests
+from royalnet.typing import *
+
+log = logging.getLogger(__name__)
+
+
+class JWKSCache:
+    """
+    A cache of the JSON Web Key Set of the OAuth2 IDP, allowing JWTs to be verified locally instead of asking the IDP
+    about each of them.
+
+    The key set is downloaded again after ``max_age`` seconds, or when a token is signed with an unknown key (such as
+    after a key rotation), but no more often than every ``min_age`` seconds.
+    """
+
+    def __init__(self, url: str, max_age: float = 60 * 60, min_age: float = 60, timeout: float = 10):
+        self.url: str = url
+        self.max_age: float = max_age
+        self.min_age: float = min_age
+        self.timeout: float = timeout
+
+        self.keys: Dict[str, JSON] = {}
+        self.fetched_at: Optional[float] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def age(self) -> float:
+        """
+        :return: The number of seconds since the key set was last downloaded, or infinity if it never was.
+        """
+        if self.fetched_at is None:
+            return float("inf")
+        return time.monotonic() - self.fetched_at
+
+    def expired(self, force: bool = False) -> bool:
+        """
+        :param force: Whether a key set younger than ``max_age`` should be considered expired.
+        :return: :data:`True` if the key set should be downloaded again, :data:`False` otherwise.
+        """
+        age = self.age()
+        return age >= self.min_age and (age >= self.max_age or force)
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Download the key set again if it is older than ``max_age``, or, if ``force`` is set, older than ``min_age``.
+
+        The age is checked before taking the lock as well, so that callers never wait for a download in progress if
+        the key set is fresh enough.
+
+        :param force: Whether the key set should be refreshed even if it isn't expired yet.
+        :raises requests.RequestException: If the key set could not be downloaded.
+        """
+        if not self.expired(force=force):
+            return
+        with self.lock:
+            if not self.expired(force=force):
+                return
+            log.debug(f"Downloading JWKS: {self.url}")
+            r = requests.get(self.url, timeout=self.timeout)
+            r.raise_for_status()
+            self.keys = {key["kid"]: key for key in r.json()["keys"]}
+            self.fetched_at = time.monotonic()
+
+    def cached(self, token: str) -> Optional[JSON]:
+        """
+        Get the key a token was signed with, only if it can be done without downloading the key set, and therefore
+        without blocking or taking the lock.
+
+        :param token: The encoded JWT.
+        :return: The key, or :data:`None` if the key set is expired, doesn't contain the key or the token is malformed.
+        """
+        try:
+            kid = jose.jwt.get_unverified_header(token).get("kid")
+        except jose.exceptions.JWTError:
+            return None
+        if self.age() >= self.max_age:
+            return None
+        return self.keys.get(kid)
+
+    def get(self, kid: str) -> Optional[JSON]:
+        """
+        Get a key from the key set, refreshing it if necessary.
+
+        :param kid: The id of the key.
+        :return: The key, or :data:`None` if it isn't in the key set.
+        """
+        self.refresh()
+        if kid not in self.keys:
+            self.refresh(force=True)
+        return self.keys.get(kid)
+
+    def verify(self, token: str, audience: str, issuer: Optional[str] = None) -> JSON:
+        """
+        Verify the signature and the claims of a JWT.
+
+        :param token: The encoded JWT.
+        :param audience: The audience the token must have been issued for.
+        :param issuer: The issuer that must have issued the token, or :data:`None` to accept any issuer.
+        :return: The claims of the token.
+        :raises jose.exceptions.JWTError: If the token is invalid, expired or signed with an unknown key.
+        """
+        header = jose.jwt.get_unverified_header(token)
+        key = self.get(header.get("kid"))
+        if key is None:
+            raise jose.exceptions.JWTError(f"Token signed with an unknown key: {header.get('kid')!r}")
+        return self.decode(token, key, audience=audience, issuer=issuer)
+
+    @staticmethod
+    def decode(token: str, key: JSON, audience: str, issuer: Optional[str] = None) -> JSON:
+        """
+        Verify the signature and the claims of a JWT against a key, without accessing the key set.
+
+        :param token: The encoded JWT.
+        :param key: The key the token was signed with, as returned by :meth:`.cached` or :meth:`.get`.
+        :param audience: The audience the token must have been issued for.
+        :param issuer: The issuer that must have issued the token, or :data:`None` to accept any issuer.
+        :return: The claims of the token.
+        :raises jose.exceptions.JWTError: If the token is invalid or expired.
+        """
+        return jose.jwt.decode(
+            token,
+            key,
+            algorithms=[key.get("alg", "RS256")],
+            audience=audience,
+            issuer=issuer,
+            options={"verify_at_hash": False},
+        )
+
+
+__all__ = (
+    "JWKSCache",
+)
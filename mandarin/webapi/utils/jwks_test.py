@@ -0,0 +1,128 @@
+import jose.exceptions
+import jose.jwt
+import pytest
+from mandarin.testing.fixtures import *
+
+from . import jwks as jwks_module
+from .jwks import JWKSCache
+
+
+KEY = {"kty": "oct", "kid": "one", "alg": "HS256", "k": "c2VjcmV0LWtleS1vZi10aGUtdGVzdHM"}
+OTHER_KEY = {"kty": "oct", "kid": "two", "alg": "HS256", "k": "YW5vdGhlci1zZWNyZXQta2V5"}
+
+
+class FakeResponse:
+    def __init__(self, keys):
+        self.keys = keys
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self):
+        return {"keys": self.keys}
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock) -> FakeClock:
+    """
+    Replace the clock used by :class:`.JWKSCache` with one that only moves when told to.
+    """
+    monkeypatch.setattr(jwks_module.time, "monotonic", fake_clock)
+    return fake_clock
+
+
+@pytest.fixture
+def idp(monkeypatch):
+    """
+    Replace the IDP with one serving the keys in the returned :class:`list`, recording the downloads.
+    """
+    keys = [KEY]
+    downloads = []
+
+    def get(url, timeout):
+        downloads.append(url)
+        return FakeResponse(list(keys))
+
+    monkeypatch.setattr(jwks_module.requests, "get", get)
+    return keys, downloads
+
+
+def sign(key, **claims) -> str:
+    return jose.jwt.encode({"aud": "mandarin", **claims}, key, algorithm="HS256", headers={"kid": key["kid"]})
+
+
+def test_refresh_max_age(clock, idp):
+    _, downloads = idp
+    cache = JWKSCache(url="https://idp/jwks", max_age=100, min_age=10)
+
+    cache.refresh()
+    assert len(downloads) == 1
+    clock.now += 99
+    cache.refresh()
+    assert len(downloads) == 1
+    clock.now += 1
+    cache.refresh()
+    assert len(downloads) == 2
+
+
+def test_refresh_forced_min_age(clock, idp):
+    _, downloads = idp
+    cache = JWKSCache(url="https://idp/jwks", max_age=100, min_age=10)
+
+    cache.refresh()
+    clock.now += 5
+    cache.refresh(force=True)
+    assert len(downloads) == 1
+    clock.now += 5
+    cache.refresh(force=True)
+    assert len(downloads) == 2
+
+
+def test_rotation(clock, idp):
+    keys, downloads = idp
+    cache = JWKSCache(url="https://idp/jwks", max_age=100, min_age=10)
+    assert cache.get("one") == KEY
+
+    keys.append(OTHER_KEY)
+    clock.now += 1
+    # Too soon after the last download for an unknown key to force a refresh
+    assert cache.get("two") is None
+    clock.now += 10
+    assert cache.get("two") == OTHER_KEY
+    assert len(downloads) == 2
+
+
+def test_cached(clock, idp):
+    cache = JWKSCache(url="https://idp/jwks", max_age=100, min_age=10)
+    token = sign(KEY, sub="user")
+
+    assert cache.cached(token) is None
+    cache.refresh()
+    assert cache.cached(token) == KEY
+    assert cache.cached(sign(OTHER_KEY, sub="user")) is None
+    assert cache.cached("not a token") is None
+    clock.now += 100
+    assert cache.cached(token) is None
+
+
+def test_cached_doesnt_lock(clock, idp):
+    cache = JWKSCache(url="https://idp/jwks", max_age=100, min_age=10)
+    token = sign(KEY, sub="user")
+    cache.refresh()
+
+    with cache.lock:
+        key = cache.cached(token)
+        assert key == KEY
+        assert JWKSCache.decode(token, key, audience="mandarin")["sub"] == "user"
+        # The key set is fresh, so refreshing doesn't wait for the lock either
+        cache.refresh()
+
+
+def test_verify(clock, idp):
+    cache = JWKSCache(url="https://idp/jwks", max_age=100, min_age=10)
+
+    assert cache.verify(sign(KEY, sub="user"), audience="mandarin")["sub"] == "user"
+    with pytest.raises(jose.exceptions.JWTError):
+        cache.verify(sign(KEY, sub="user"), audience="other")
+    with pytest.raises(jose.exceptions.JWTError):
+        cache.verify(sign(OTHER_KEY, sub="user"), audience="mandarin")
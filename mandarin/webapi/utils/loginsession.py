@@ -8,7 +8,7 @@ import fastapi
 import sqlalchemy.orm
 from royalnet.typing import *
 
-from ...database import tables
+from ...database import tables, any_of
 
 RowType = TypeVar("RowType")
 
@@ -18,20 +18,35 @@ class LoginSession:
     user: tables.User
     session: sqlalchemy.orm.session.Session
 
-    def get(self, table: Type[RowType], id_: Any) -> RowType:
+    def get(self, table: Type[RowType], id_: Any, options: Iterable[sqlalchemy.orm.Load] = ()) -> RowType:
         """
         Get the item with the specified id from a table, or raise a 404 error if the item doesn't exist.
 
         :param table: The table to get the item from.
         :param id_: The id to fetch.
+        :param options: The loader options to apply to the query, such as the ones returned by
+                        :meth:`~mandarin.webapi.models.OrmModel.loader_options`.
         :return: The retrieved item.
         :raises fastapi.HTTPException: If the item was not found.
         """
-        obj = self.session.query(table).get(id_)
+        obj = self.session.query(table).options(*options).get(id_)
         if obj is None:
             raise fastapi.HTTPException(404, f"The id '{id_}' does not match any {table.__name__}.")
         return obj
 
+    def reload(self, obj: RowType, options: Iterable[sqlalchemy.orm.Load] = ()) -> RowType:
+        """
+        Load again an item from the database, such as after it was expired by a commit, applying the specified loader
+        options to it even if it is already in the session.
+
+        :param obj: The item to reload.
+        :param options: The loader options to apply to the query, such as the ones returned by
+                        :meth:`~mandarin.webapi.models.OrmModel.loader_options`.
+        :return: The reloaded item.
+        """
+        identity = sqlalchemy.inspect(obj).identity
+        return self.session.query(type(obj)).options(*options).populate_existing().get(identity)
+
     def group(self, table: Type[RowType], ids: List[int]) -> Sequence[RowType]:
         """
         Get the items with the specified ids from the database.
@@ -42,6 +57,22 @@ class LoginSession:
         """
         return self.session.query(table).filter(table.id.in_(ids)).all()
 
+    def update_group(self,
+                     table: Type[RowType],
+                     ids: List[int],
+                     session: Optional[sqlalchemy.orm.session.Session] = None,
+                     **values: Any) -> None:
+        """
+        Update the items with the specified ids with a single ``UPDATE`` statement, without loading them.
+
+        :param table: The table to update the items of.
+        :param ids: The ids of the items to update; ids not matching any item are skipped.
+        :param session: The session to update the items in, if it isn't the one of the login session, such as the one
+                        of a transaction run by :func:`~mandarin.database.run_transaction`.
+        :param values: The new values of the columns, by name.
+        """
+        (session or self.session).query(table).filter(any_of(table.id, ids)).update(values, synchronize_session=False)
+
     def log(self, action: str, obj: t.Optional[int]) -> tables.AuditLog:
         """
         Log an action and add it to the session.
@@ -50,11 +81,35 @@ class LoginSession:
         :param obj: The object to log information about.
         :return: The created AuditLog object.
         """
-        session = sqlalchemy.orm.session.Session.object_session(self)
-        audit_log = tables.AuditLog(user=self, action=action, timestamp=datetime.datetime.now(), obj=obj)
-        session.add(audit_log)
+        audit_log = tables.AuditLog(user=self.user, action=action, timestamp=datetime.datetime.now(), obj=obj)
+        self.session.add(audit_log)
         return audit_log
 
+    def log_group(self,
+                  action: str,
+                  table: Type[RowType],
+                  ids: List[int],
+                  session: Optional[sqlalchemy.orm.session.Session] = None) -> None:
+        """
+        Log the same action for each of the items with the specified ids with a single ``INSERT ... SELECT``
+        statement.
+
+        :param action: The action to log.
+        :param table: The table of the items.
+        :param ids: The ids of the items to log the action for; ids not matching any item are skipped.
+        :param session: The session to log the action in, if it isn't the one of the login session, such as the one of
+                        a transaction run by :func:`~mandarin.database.run_transaction`.
+        """
+        select = sqlalchemy.select([
+            sqlalchemy.literal(self.user.id),
+            sqlalchemy.literal(action),
+            sqlalchemy.literal(datetime.datetime.now()),
+            table.id,
+        ]).where(any_of(table.id, ids))
+        (session or self.session).execute(tables.AuditLog.__table__.insert().from_select(
+            ["user_id", "action", "timestamp", "obj"], select,
+        ))
+
 
 __all__ = (
     "LoginSession",
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import base64
+import datetime
+import json
+
+import fastapi
+import sqlalchemy
+import sqlalchemy.orm
+from royalnet.typing import *
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+"""
+The response header containing the cursor of the next page, if there is one.
+"""
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """
+    Encode the values of the ordering columns of the last row of a page into an opaque cursor.
+
+    :param values: The values to encode; :class:`datetime.datetime` are encoded in ISO 8601 format.
+    :return: The encoded cursor.
+    """
+    values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, columns: List[sqlalchemy.Column]) -> List[Any]:
+    """
+    Decode a cursor created by :func:`.encode_cursor`.
+
+    :param cursor: The cursor to decode.
+    :param columns: The ordering columns the cursor was created for.
+    :return: The decoded values, one for each column.
+    :raises fastapi.HTTPException: If the cursor is invalid.
+    """
+    try:
+        # Unlike urlsafe_b64decode, reject the characters outside of the alphabet instead of skipping them
+        values = json.loads(base64.b64decode(cursor.encode(), altchars=b"-_", validate=True))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("Cursor doesn't match the ordering columns")
+        return [decode_value(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise fastapi.HTTPException(400, "Invalid cursor")
+
+
+def decode_value(column: sqlalchemy.Column, value: Any) -> Any:
+    """
+    Decode a single value of a cursor, checking that it has the Python type of its column.
+
+    :param column: The ordering column the value belongs to.
+    :param value: The value, as found in the JSON of the cursor.
+    :return: The decoded value.
+    :raises ValueError: If the value doesn't match the type of the column.
+    """
+    python_type = column.type.python_type
+    if value is None and column.nullable:
+        return None
+    if python_type is datetime.datetime and isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    # bool is a subclass of int, but it isn't a valid id
+    if type(value) is bool and python_type is not bool:
+        raise ValueError(f"Invalid value for {column.key}: {value!r}")
+    if python_type is float and isinstance(value, int):
+        return float(value)
+    if not isinstance(value, python_type):
+        raise ValueError(f"Invalid value for {column.key}: {value!r}")
+    # Integers out of the range of the database would be rejected by it
+    if python_type is int and not -2 ** 63 <= value < 2 ** 63:
+        raise ValueError(f"Invalid value for {column.key}: {value!r}")
+    return value
+
+
+def paginate(query: sqlalchemy.orm.Query,
+             response: fastapi.Response,
+             columns: List[sqlalchemy.Column],
+             limit: int,
+             after: Optional[str] = None,
+             offset: int = 0,
+             descending: bool = False) -> List[Any]:
+    """
+    Get a page of the results of a query with keyset pagination, so that every page costs the same regardless of how
+    many come before it.
+
+    The results are ordered by ``columns``, which must uniquely identify a row; the cursor of the next page is sent in
+    the :data:`.NEXT_CURSOR_HEADER` of the ``response``, if the page is full.
+
+    :param query: The query to paginate.
+    :param response: The response to add the cursor header to.
+    :param columns: The columns to order the results by.
+    :param limit: The maximum number of results in a page.
+    :param after: The cursor of the page to get, or :data:`None` to get the first page.
+    :param offset: The number of results to skip after the cursor; kept for compatibility, as it has to scan them.
+    :param descending: Whether the results should be in descending order.
+    :return: The results in the page.
+    """
+    if after is not None:
+        values = decode_cursor(after, columns)
+        if descending:
+            query = query.filter(sqlalchemy.tuple_(*columns) < sqlalchemy.tuple_(*values))
+        else:
+            query = query.filter(sqlalchemy.tuple_(*columns) > sqlalchemy.tuple_(*values))
+
+    query = query.order_by(*[column.desc() if descending else column for column in columns])
+    results = query.limit(limit).offset(offset).all()
+
+    if limit > 0 and len(results) == limit:
+        last = results[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([getattr(last, column.key) for column in columns])
+    return results
+
+
+__all__ = (
+    "NEXT_CURSOR_HEADER",
+    "encode_cursor",
+    "decode_cursor",
+    "decode_value",
+    "paginate",
+)
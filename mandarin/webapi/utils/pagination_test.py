@@ -0,0 +1,122 @@
+import base64
+import datetime
+import json
+
+import fastapi
+import pytest
+import sqlalchemy.dialects.postgresql as postgresql
+
+from mandarin.database import tables
+from .pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, paginate
+
+
+COLUMNS = [tables.AuditLog.timestamp, tables.AuditLog.id]
+TIMESTAMP = datetime.datetime(2021, 1, 2, 3, 4, 5, 678901)
+
+
+class FakeQuery:
+    """
+    A query returning the same rows, recording the criteria and the ordering applied to it.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.criteria = []
+        self.ordering = []
+        self.limit_to = None
+
+    def filter(self, criterion):
+        self.criteria.append(criterion)
+        return self
+
+    def order_by(self, *columns):
+        self.ordering.extend(columns)
+        return self
+
+    def limit(self, limit):
+        self.limit_to = limit
+        return self
+
+    def offset(self, offset):
+        return self
+
+    def all(self):
+        return self.rows[:self.limit_to]
+
+
+def raw_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def compiled(clause) -> str:
+    return str(clause.compile(dialect=postgresql.dialect()))
+
+
+def assert_invalid(cursor: str):
+    with pytest.raises(fastapi.HTTPException) as info:
+        decode_cursor(cursor, COLUMNS)
+    assert info.value.status_code == 400
+
+
+def test_round_trip():
+    assert decode_cursor(encode_cursor([TIMESTAMP, 42]), COLUMNS) == [TIMESTAMP, 42]
+
+
+def test_wrong_arity():
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat()]))
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat(), 42, 43]))
+
+
+def test_wrong_shape():
+    assert_invalid(raw_cursor({"timestamp": TIMESTAMP.isoformat(), "id": 42}))
+    assert_invalid(raw_cursor(42))
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat(), [42]]))
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat(), {"id": 42}]))
+
+
+def test_wrong_type():
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat(), "42"]))
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat(), 4.2]))
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat(), True]))
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat(), None]))
+    assert_invalid(raw_cursor([TIMESTAMP.isoformat(), 2 ** 63]))
+    assert_invalid(raw_cursor(["yesterday", 42]))
+    assert_invalid(raw_cursor([1609556645, 42]))
+
+
+def test_tampered():
+    cursor = encode_cursor([TIMESTAMP, 42])
+    assert_invalid(cursor[:-3])
+    assert_invalid("!" + cursor)
+    assert_invalid(base64.urlsafe_b64encode(b"\xff\xfe[1, 2]").decode())
+    assert_invalid(base64.urlsafe_b64encode(b"[1, 2").decode())
+
+
+def test_paginate_first_page():
+    rows = [tables.AuditLog(id=number, timestamp=TIMESTAMP) for number in range(1, 4)]
+    query = FakeQuery(rows)
+    response = fastapi.Response()
+
+    assert paginate(query, response, columns=COLUMNS, limit=2) == rows[:2]
+    assert query.criteria == []
+    assert decode_cursor(response.headers[NEXT_CURSOR_HEADER], COLUMNS) == [TIMESTAMP, 2]
+
+
+def test_paginate_last_page():
+    query = FakeQuery([tables.AuditLog(id=1, timestamp=TIMESTAMP)])
+    response = fastapi.Response()
+
+    paginate(query, response, columns=COLUMNS, limit=2, after=encode_cursor([TIMESTAMP, 0]))
+    assert NEXT_CURSOR_HEADER not in response.headers
+    assert compiled(query.criteria[0]) == \
+        "(auditlogs.timestamp, auditlogs.id) > (%(param_1)s, %(param_2)s)"
+    assert [compiled(column) for column in query.ordering] == ["auditlogs.timestamp", "auditlogs.id"]
+
+
+def test_paginate_descending():
+    query = FakeQuery([])
+    paginate(query, fastapi.Response(), columns=COLUMNS, limit=2, after=encode_cursor([TIMESTAMP, 42]),
+             descending=True)
+    assert compiled(query.criteria[0]) == \
+        "(auditlogs.timestamp, auditlogs.id) < (%(param_1)s, %(param_2)s)"
+    assert [compiled(column) for column in query.ordering] == ["auditlogs.timestamp DESC", "auditlogs.id DESC"]
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import abc
+import collections
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import jose.exceptions
+import jose.jwt
+import redis
+from royalnet.typing import *
+
+from ...config import lazy_config, config_get
+
+log = logging.getLogger(__name__)
+
+
+def token_key(token: str) -> str:
+    """
+    :return: The cache key of an access token, which is hashed so that tokens are never stored as they are.
+    """
+    return f"token:{hashlib.sha256(token.encode()).hexdigest()}"
+
+
+def token_ttl(token: str, max_age: float) -> float:
+    """
+    Get for how long the user info of a token can be cached, which is until the token expires.
+
+    The ``exp`` claim of the token is read without verifying the token, as it is only used to expire the cache sooner.
+
+    :param token: The access token.
+    :param max_age: The maximum number of seconds the user info can be cached for.
+    :return: The number of seconds the user info can be cached for, which is ``max_age`` if the token is opaque or
+             doesn't expire.
+    """
+    try:
+        exp = jose.jwt.get_unverified_claims(token).get("exp")
+    except jose.exceptions.JWTError:
+        return max_age
+    if exp is None:
+        return max_age
+    return min(max(exp - time.time(), 0), max_age)
+
+
+class UserInfoCache(metaclass=abc.ABCMeta):
+    """
+    The abstract base class of the caches of the user info returned by the IDP, counting their hits and misses.
+    """
+
+    name: str = NotImplemented
+    """
+    The name of the backend of the cache.
+    """
+
+    blocking: bool = NotImplemented
+    """
+    Whether accessing the cache performs blocking I/O, and therefore has to be done outside of the event loop.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age: float = max_age
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[JSON]:
+        """
+        Get a value from the cache, counting the hit or the miss.
+
+        :param key: The key of the value.
+        :return: The cached value, or :data:`None` if it isn't cached or it has expired.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def set(self, key: str, value: JSON, ttl: Optional[float] = None) -> None:
+        """
+        Store a value in the cache.
+
+        :param key: The key of the value.
+        :param value: The value to store.
+        :param ttl: The number of seconds after which the value should expire, capped at ``max_age``.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def stats(self) -> Tuple[int, int, int]:
+        """
+        :return: A :class:`tuple` of the number of hits, misses and values currently stored.
+        """
+        raise NotImplementedError()
+
+    def ttl(self, ttl: Optional[float]) -> float:
+        """
+        :return: The number of seconds a value should be cached for, given the requested ``ttl``.
+        """
+        return self.max_age if ttl is None else min(ttl, self.max_age)
+
+
+class MemoryUserInfoCache(UserInfoCache):
+    """
+    A :class:`.UserInfoCache` storing values in the memory of the current process, evicting the least recently used
+    ones when more than ``max_len`` are stored.
+    """
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_age: float, max_len: int):
+        super().__init__(max_age=max_age)
+        self.max_len: int = max_len
+        self.values: collections.OrderedDict[str, Tuple[float, JSON]] = collections.OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[JSON]:
+        with self.lock:
+            item = self.values.get(key)
+            if item is None or item[0] < time.monotonic():
+                self.values.pop(key, None)
+                self.misses += 1
+                return None
+            self.values.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: str, value: JSON, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl(ttl)
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.values[key] = (time.monotonic() + ttl, value)
+            self.values.move_to_end(key)
+            while len(self.values) > self.max_len:
+                self.values.popitem(last=False)
+
+    def stats(self) -> Tuple[int, int, int]:
+        with self.lock:
+            return self.hits, self.misses, len(self.values)
+
+
+class RedisUserInfoCache(UserInfoCache):
+    """
+    A :class:`.UserInfoCache` storing values in a Redis database, so that they are shared by all the processes of the
+    web API; the hits and misses are counted in the database as well.
+    """
+
+    name = "redis"
+    blocking = True
+
+    def __init__(self, max_age: float, url: str, prefix: str = "mandarin:userinfo:"):
+        super().__init__(max_age=max_age)
+        self.redis: redis.Redis = redis.Redis.from_url(url)
+        self.prefix: str = prefix
+
+    def get(self, key: str) -> Optional[JSON]:
+        value = self.redis.get(f"{self.prefix}{key}")
+        self.redis.incr(f"{self.prefix}{'misses' if value is None else 'hits'}")
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: JSON, ttl: Optional[float] = None) -> None:
+        ttl = int(self.ttl(ttl))
+        if ttl <= 0:
+            return
+        self.redis.set(f"{self.prefix}{key}", json.dumps(value), ex=ttl)
+
+    def stats(self) -> Tuple[int, int, int]:
+        hits, misses = self.redis.mget(f"{self.prefix}hits", f"{self.prefix}misses")
+        size = sum(1 for _ in self.redis.scan_iter(match=f"{self.prefix}*:*"))
+        return int(hits or 0), int(misses or 0), size
+
+
+def make_user_info_cache() -> UserInfoCache:
+    """
+    Create the :class:`.UserInfoCache` set in the ``auth.cache`` section of the config.
+
+    :return: The created cache.
+    :raises ValueError: If the configured backend doesn't exist.
+    """
+    backend = config_get("auth.cache.backend", "memory")
+    max_age = config_get("auth.cache.maxage", 60 * 60 * 24)
+
+    if backend == "memory":
+        return MemoryUserInfoCache(max_age=max_age, max_len=config_get("auth.cache.size", 10000))
+    elif backend == "redis":
+        # By default, reuse the Redis database of the taskbus
+        url = config_get("auth.cache.url") or lazy_config.e["taskbus.backend"]
+        return RedisUserInfoCache(max_age=max_age, url=url)
+    else:
+        raise ValueError(f"Unknown user info cache backend: {backend!r}")
+
+
+__all__ = (
+    "token_key",
+    "token_ttl",
+    "UserInfoCache",
+    "MemoryUserInfoCache",
+    "RedisUserInfoCache",
+    "make_user_info_cache",
+)
@@ -0,0 +1,80 @@
+import jose.jwt
+import pytest
+from mandarin.testing.fixtures import *
+
+from . import userinfocache as userinfocache_module
+from .userinfocache import MemoryUserInfoCache, token_key, token_ttl
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock) -> FakeClock:
+    """
+    Replace both the monotonic and the wall clock used by the user info caches with one that only moves when told to.
+    """
+    monkeypatch.setattr(userinfocache_module.time, "monotonic", fake_clock)
+    monkeypatch.setattr(userinfocache_module.time, "time", fake_clock)
+    return fake_clock
+
+
+def test_token_key():
+    assert token_key("abc") == token_key("abc")
+    assert token_key("abc") != token_key("abd")
+    assert "abc" not in token_key("abc")
+
+
+def test_token_ttl(clock):
+    def token(**claims) -> str:
+        return jose.jwt.encode(claims, "secret", algorithm="HS256")
+
+    assert token_ttl(token(exp=clock.now + 30), max_age=60) == 30
+    assert token_ttl(token(exp=clock.now + 90), max_age=60) == 60
+    assert token_ttl(token(exp=clock.now - 30), max_age=60) == 0
+    assert token_ttl(token(sub="user"), max_age=60) == 60
+    assert token_ttl("opaque", max_age=60) == 60
+
+
+def test_memory_expiry(clock):
+    cache = MemoryUserInfoCache(max_age=60, max_len=10)
+    cache.set("capped", {"sub": "a"}, ttl=10)
+    cache.set("default", {"sub": "b"})
+    cache.set("long", {"sub": "c"}, ttl=600)
+
+    clock.now += 10
+    assert cache.get("capped") == {"sub": "a"}
+    clock.now += 1
+    assert cache.get("capped") is None
+    assert cache.get("default") == {"sub": "b"}
+    clock.now += 50
+    assert cache.get("default") is None
+    assert cache.get("long") is None
+
+
+def test_memory_expired_ttl(clock):
+    cache = MemoryUserInfoCache(max_age=60, max_len=10)
+    cache.set("expired", {"sub": "a"}, ttl=0)
+    cache.set("negative", {"sub": "b"}, ttl=-5)
+
+    assert cache.get("expired") is None
+    assert cache.get("negative") is None
+    assert cache.stats()[2] == 0
+
+
+def test_memory_lru(clock):
+    cache = MemoryUserInfoCache(max_age=60, max_len=2)
+    cache.set("a", {"sub": "a"})
+    cache.set("b", {"sub": "b"})
+    assert cache.get("a") is not None
+    cache.set("c", {"sub": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_memory_stats(clock):
+    cache = MemoryUserInfoCache(max_age=60, max_len=10)
+    cache.set("a", {"sub": "a"})
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == (2, 1, 1)